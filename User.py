@@ -1,14 +1,17 @@
 import datetime
 from getpass import getpass
 from connection_and_queries import Connection
+from write_behind import QueueFullError
+from explain_capture import MISESTIMATE_FACTOR
 
 class User:
-    def __init__(self, connection: Connection):
+    def __init__(self, connection: Connection, prefetch=False):
         """
         Initializes a User object.
 
         Parameters:
             connection (Connection): An instance of the Connection class for database interaction.
+            prefetch (bool): Whether to warm the result cache in the background after login, see warm_up().
         
         Attributes:
             connection (Connection): The database connection.
@@ -20,6 +23,7 @@ class User:
         self.user_id = None
         self.username = None
         self.collections = None
+        self.prefetch = prefetch
     
     def login(self, username: str, password: str):
         """
@@ -42,7 +46,23 @@ class User:
             return
         self.user_id = user_id
         self.username = username
+        if self.prefetch:
+            self.warm_up()
         print(f'Welcome {self.username}! Logged in successfully :)')
+
+    def warm_up(self):
+        """
+        Starts loading what list, profile, top20 and rec show into the result cache, so those commands
+        answer from the cache right after login. Uses the same arguments the commands pass.
+        """
+        self.connection.prefetch([
+            ("get_collections", (self.user_id,)),
+            ("collection_info", (self.user_id,)),
+            ("follower_info", (self.user_id,)),
+            ("top_rated_books", (self.user_id,)),
+            ("top20", ()),
+            ("recommendations", (self.user_id,)),
+        ])
         
     def join(self, username, email, password, first_name, last_name):
         """
@@ -174,7 +194,7 @@ class User:
             return
         result = self.connection.add_book_to_collection(self.user_id, book_title, collection_title)
         if result is False:
-            print("Collection doesn't exist.")
+            print("Book or collection doesn't exist.")
         else:
             print(f'Book "{book_title}" added to collection "{collection_title}" successfully.')
     
@@ -189,7 +209,9 @@ class User:
         if self.username is None:
             print("Please log in to remove a book from a collection.")
             return
-        self.connection.remove_book_from_collection(self.user_id, book_title, collection_title)
+        if self.connection.remove_book_from_collection(self.user_id, book_title, collection_title) is False:
+            print("Book or collection doesn't exist.")
+            return
         print(f'Book "{book_title}" removed from collection "{collection_title}" successfully.')
     
     def rate_book(self, book_title, rating):
@@ -203,7 +225,12 @@ class User:
         if self.username is None:
             print("Please log in to rate a book.")
             return
-        self.connection.rate_a_book(self.user_id, book_title, rating)
+        try:
+            if self.connection.rate_a_book(self.user_id, book_title, rating) is False:
+                return
+        except QueueFullError as e:
+            print(f"{e} Please try again in a moment.")
+            return
         print(f'Book "{book_title}" has been rated {rating} stars.')
 
     def read_book(self, book_title, start_page, end_page):
@@ -221,7 +248,11 @@ class User:
         reading_time_minutes = (end_page - start_page) * 3 # assuming each page takes 3 minutes to read
         start_time = datetime.datetime.now()
         end_time = datetime.datetime.now() + datetime.timedelta(minutes=reading_time_minutes)
-        self.connection.read_book(self.user_id, book_title, start_time, end_time, start_page, end_page)
+        try:
+            self.connection.read_book(self.user_id, book_title, start_time, end_time, start_page, end_page)
+        except QueueFullError as e:
+            print(f"{e} Please try again in a moment.")
+            return
         print(f'Book "{book_title}" has been read from page {start_page} to page {end_page}. It took {reading_time_minutes} minutes to read.')
         
     def follow(self, email):
@@ -252,6 +283,165 @@ class User:
         if result:
              print(f'"{self.username}" unfollowed {email} successfully :(')
 
+    def follow_many(self, emails):
+        """
+        Follows several users at once by email.
+
+        Parameters:
+            emails (list of str): The email addresses of the users to follow.
+        """
+        if self.username is None:
+            print("Please log in to follow users.")
+            return
+        result = self.connection.follow_many(self.user_id, emails)
+        if result is None:
+            return
+        followed, missing = result
+        print(f'"{self.username}" followed {followed} users successfully :)')
+        for email in missing:
+            print(f"No user found with email {email}.")
+
+    def unfollow_many(self, emails):
+        """
+        Unfollows several users at once by email.
+
+        Parameters:
+            emails (list of str): The email addresses of the users to unfollow.
+        """
+        if self.username is None:
+            print("Please log in to unfollow users.")
+            return
+        result = self.connection.unfollow_many(self.user_id, emails)
+        if result is None:
+            return
+        unfollowed, missing = result
+        print(f'"{self.username}" unfollowed {unfollowed} users successfully :(')
+        for email in missing:
+            print(f"No user found with email {email}.")
+
+    def load_follow_graph(self):
+        """
+        Loads the in-memory follow graph index and displays how much memory it uses.
+        """
+        if self.username is None:
+            print("Please log in to load the follow graph.")
+            return
+        print("Loading the follow graph...")
+        try:
+            report = self.connection.load_follow_graph()
+        except Exception as e:
+            print(f"Failed to load the follow graph: {e}")
+            return
+        for name, size in report.items():
+            print(f"{name}: {size / (1024 * 1024):.2f} MB")
+
+    def suggest(self):
+        """
+        Displays users the user may want to follow, based on friends-of-friends.
+        """
+        if self.username is None:
+            print("Please log in to see who to follow.")
+            return
+        suggested = self.connection.suggested_users(self.user_id)
+        if not suggested:
+            print("No suggestions found or an error occurred.")
+            return
+        print("Who to follow:")
+        for i, (username, email, mutual_count, shared_books) in enumerate(suggested, start=1):
+            print(f"{i}. {username} ({email}) - Followed by {mutual_count} people you follow, {shared_books} books in common")
+
+    def refresh_suggestions(self, full=False):
+        """
+        Recomputes the precomputed "who to follow" suggestions.
+
+        Parameters:
+            full (bool): Whether to recompute every user instead of only the changed ones.
+        """
+        if self.username is None:
+            print("Please log in to refresh suggestions.")
+            return
+        print("Refreshing suggestions...")
+        try:
+            count = self.connection.refresh_suggestions(full=full)
+        except Exception as e:
+            print(f"Failed to refresh suggestions: {e}")
+            return
+        print(f"Refreshed suggestions for {count} users.")
+
+    def cache_stats(self):
+        """
+        Displays hit rates and counters for the query result cache.
+        """
+        if self.connection.result_cache is None:
+            print("The result cache is not enabled. Start with --cache to enable it.")
+            return
+        stats = self.connection.result_cache.stats()
+        print(f"Cached results: {stats['entries']}")
+        for method, counters in sorted(stats["methods"].items()):
+            print(f"{method}: {counters['hit_rate']:.0%} hit rate ({counters['hits']} hits, {counters['misses']} misses, "
+                  f"{counters['invalidated']} invalidated, {counters['expired']} expired, {counters['evicted']} evicted)")
+
+    def explain_report(self, capture):
+        """
+        Displays the captured query plans per method: time spent, sequential scans and row-estimate misses.
+
+        Parameters:
+            capture (ExplainCapture): The plans collected while explain mode was on.
+        """
+        summary = capture.summary()
+        if not summary:
+            print("No statements were captured.")
+            return
+        for row in summary:
+            print(f"{row['method']}: {row['statements']} statements, {row['execution_ms']:.1f} ms")
+            if row["seq_scans"]:
+                print(f"  sequential scans on: {', '.join(row['seq_scans'])}")
+            if row["misestimates"]:
+                print(f"  {row['misestimates']} plan nodes with row estimates off by {MISESTIMATE_FACTOR}x or more")
+
+    def trace_report(self, tracer):
+        """
+        Displays where each traced command spent its time: waiting on the database or in Python.
+
+        Parameters:
+            tracer (Tracer): The spans recorded while tracing was on.
+        """
+        summary = tracer.summary("User") or tracer.summary("Connection")
+        if not summary:
+            print("No commands were traced.")
+            return
+        for row in summary:
+            print(f"{row['name']}: {row['calls']} calls, {row['wall_ms']:.1f} ms "
+                  f"({row['db_ms']:.1f} ms in {row['statements']} statements, {row['python_ms']:.1f} ms in Python)")
+
+    def stats(self, days=None):
+        """
+        Displays reading totals and streaks.
+
+        Parameters:
+            days (int): How many days back to include, None for all time.
+        """
+        if self.username is None:
+            print("Please log in to view your reading stats.")
+            return
+        if days is not None and days < 1:
+            print("The number of days must be at least 1.")
+            return
+        stats = self.connection.reading_stats(self.user_id, days)
+        if stats is None:
+            print("Failed to retrieve reading stats.")
+            return
+        period = f"the last {days} days" if days is not None else "all time"
+        print(f"Reading stats for {period}:")
+        print(f"Pages read: {stats['pages']}")
+        print(f"Time spent reading: {stats['minutes']} minutes")
+        print(f"Reading sessions: {stats['sessions']} across {stats['books']} books")
+        print(f"Days read: {stats['days_read']}")
+        if stats['days_read']:
+            print(f"Pages per reading day: {stats['pages'] / stats['days_read']:.1f}")
+        print(f"Current streak: {stats['current_streak']} days")
+        print(f"Longest streak: {stats['longest_streak']} days")
+
     def follower_info(self):
         if self.username is None:
             print("Please log in to view following info.")
@@ -275,6 +465,104 @@ class User:
         for collection in self.collections:
             print(f"{str(collection)}\n")
 
+    def refresh_recommendations(self):
+        """
+        Precomputes the recommendations of every recently active user (the nightly job).
+        """
+        if self.username is None:
+            print("Please log in to precompute recommendations.")
+            return
+        print("Precomputing recommendations...")
+        try:
+            count = self.connection.refresh_recommendations()
+        except Exception as e:
+            print(f"Failed to precompute recommendations: {e}")
+            return
+        print(f"Recomputed recommendations for {count} active users.")
+
+    def rebuild_trending(self):
+        """
+        Recomputes the trending scores from the full reading and rating history.
+        """
+        print("Rebuilding trending scores...")
+        try:
+            count = self.connection.rebuild_trending()
+        except Exception as e:
+            print(f"Failed to rebuild trending scores: {e}")
+            return
+        print(f"Scored {count} books.")
+
+    def load_catalog(self, path, workers=None):
+        """
+        Bulk-loads a catalog dump and displays what was skipped and changed.
+
+        Parameters:
+            path (str): The CSV or JSONL dump.
+            workers (int): Number of parallel COPY workers, None for one per core.
+        """
+        print("Loading the catalog...")
+        try:
+            result = self.connection.load_catalog(path, workers=workers)
+        except Exception as e:
+            print(f"Failed to load the catalog: {e}")
+            return
+        for line_number, error in result["skipped"][:20]:
+            print(f"Skipped line {line_number}: {error}")
+        print(f"Read {result['records']} books, skipped {len(result['skipped'])}.")
+        for table, changed in result["rows"].items():
+            print(f"{table}: {changed} rows added or updated")
+
+    def partition_reading_sessions(self):
+        """
+        Partitions the reading history by month, if it is not yet, and creates the upcoming months' partitions.
+        """
+        print("Partitioning reading sessions...")
+        try:
+            migrated = self.connection.partition_reading_sessions()
+        except Exception as e:
+            print(f"Failed to partition reading sessions: {e}")
+            return
+        if migrated:
+            print("Reading sessions are now partitioned by month.")
+        else:
+            print("Reading sessions were already partitioned; upcoming partitions are in place.")
+
+    def backfill_reading_rollups(self):
+        """
+        Rebuilds the daily reading rollups from the reading history.
+        """
+        print("Rebuilding daily reading rollups...")
+        try:
+            count = self.connection.backfill_reading_rollups()
+        except Exception as e:
+            print(f"Failed to rebuild the daily reading rollups: {e}")
+            return
+        print(f"Wrote {count} rollup rows.")
+
+    def check_collections(self, fix=False):
+        """
+        Checks that every collection's stored book count and page total match its contents.
+
+        Parameters:
+            fix (bool): Whether to repair the collections whose summaries are wrong.
+        """
+        if self.username is None:
+            print("Please log in to check collection summaries.")
+            return
+        print("Checking collection summaries...")
+        try:
+            mismatches = self.connection.check_collection_summaries(fix=fix)
+        except Exception as e:
+            print(f"Failed to check collection summaries: {e}")
+            return
+        if not mismatches:
+            print("All collection summaries are consistent.")
+            return
+        for collection_id, book_count, actual_count, page_total, actual_pages in mismatches:
+            print(f"Collection {collection_id}: {book_count} books / {page_total} pages stored, {actual_count} books / {actual_pages} pages actual")
+        if fix:
+            print(f"Repaired {len(mismatches)} collections.")
+
     def collection_info(self):
         if self.username is None:
             print("Please log in to view collection info")
@@ -312,9 +600,7 @@ class User:
             search_value (str): The value to search for.
         """
         print(f'Searching for books related to {search_value} containing {search_term}...')
-        search_results = self.connection.search_books(search_term, search_value)
-        for result in search_results:
-            print(f"{result}")
+        self._print_books(self.connection.search_books(search_term, search_value))
             
     def sort(self, search_term, search_value, order_value, order_by):
         """
@@ -327,9 +613,37 @@ class User:
             order_by (str): The sort order ('asc' or 'desc').
         """
         print(f'Sorting books related to {search_value} containing {search_term} by {order_value} in {order_by} order...')
-        search_results = self.connection.sort_books(search_term, search_value, order_value, order_by)
-        for result in search_results:
-            print(f"{result}")
+        self._print_books(self.connection.sort_books(search_term, search_value, order_value, order_by))
+
+    def _print_books(self, books):
+        """
+        Displays search results, one book per entry.
+
+        Parameters:
+            books (list of tuples): Rows in the Connection.search_books shape.
+        """
+        if not books:
+            print("No books found.")
+            return
+        for (book_id, title, length, authors, publishers, editors, audiences, genres,
+             release_dates, avg_rating, rating_count) in books:
+            print(f"{title} ({length} pages)")
+            if authors:
+                print(f"  Authors: {', '.join(authors)}")
+            if publishers:
+                print(f"  Publishers: {', '.join(publishers)}")
+            if editors:
+                print(f"  Editors: {', '.join(editors)}")
+            if genres:
+                print(f"  Genres: {', '.join(genres)}")
+            if audiences:
+                print(f"  Audiences: {', '.join(audiences)}")
+            if release_dates:
+                print(f"  Editions: {', '.join(str(date) for date in release_dates)}")
+            if rating_count:
+                print(f"  Average Rating: {avg_rating:.2f} ({rating_count} ratings)")
+            else:
+                print("  Not rated yet")
 
     def top20(self):
         """
@@ -359,6 +673,65 @@ class User:
         for i, (title, avg_rating, five_star_count) in enumerate(popular, start=1):
             print(f"{i}. {title} - Average Rating: {avg_rating:.2f}, 5-Star Ratings: {five_star_count}")
 
+    def most_read(self, days=90, among_followers=False):
+        """
+        Displays the books read by the most different people.
+
+        Parameters:
+            days (int): How many days back to include.
+            among_followers (bool): Whether to count only the user's followers.
+        """
+        if among_followers and self.username is None:
+            print("Please log in to see the most read books among your followers.")
+            return
+        books = self.connection.most_read(days, user_id=self.user_id if among_followers else None)
+        if not books:
+            print("No books found or an error occurred.")
+            return
+        print(f"Most read books in the last {days} days{' among your followers' if among_followers else ''}:")
+        for i, (title, readers) in enumerate(books, start=1):
+            print(f"{i}. {title} - {readers} readers")
+
+    def feed(self, page_size=10):
+        """
+        Displays what the people the user follows have been reading and rating, a page at a time.
+
+        Parameters:
+            page_size (int): Items shown per page.
+        """
+        if self.username is None:
+            print("Please log in to see your feed.")
+            return
+        before = None
+        while True:
+            items = self.connection.feed(self.user_id, before=before, n=page_size)
+            if items is None:
+                print("An error occurred while retrieving your feed.")
+                return
+            if not items:
+                print("Nothing new from the people you follow." if before is None else "No older activity.")
+                return
+            for item_id, username, kind, title, detail, created_at in items:
+                if kind == "read":
+                    print(f"{created_at:%Y-%m-%d %H:%M} {username} read {detail} pages of {title}")
+                else:
+                    print(f"{created_at:%Y-%m-%d %H:%M} {username} rated {title} {detail} stars")
+            if len(items) < page_size or input("Show older activity? [y/n]: ").lower() != "y":
+                return
+            before = items[-1][0]
+
+    def trending(self):
+        """
+        Displays the books with the most recent reading and rating activity.
+        """
+        books = self.connection.trending_books()
+        if not books:
+            print("No trending books found or an error occurred.")
+            return
+        print("Trending books:")
+        for i, (title, score) in enumerate(books, start=1):
+            print(f"{i}. {title} - Trending Score: {score:.2f}")
+
     def top5new(self):
         """
         Displays the top 5 new releases of the month, sorted by average rating and 5-star counts.
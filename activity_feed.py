@@ -0,0 +1,134 @@
+from psycopg2.extras import execute_values
+from follow_graph import user_key
+
+# Activity from users with more followers than this is not copied into each follower's feed;
+# readers pull it from the activity table instead when they read their feed
+FANOUT_LIMIT = 1000
+
+# Items kept per feed. Each feed is a ring of FEED_LENGTH slots, so a new item overwrites the oldest.
+FEED_LENGTH = 500
+
+# Every reading session and rating as a feed item. feed_item holds one row per (follower, slot) pointing
+# at an activity; feed_head holds how many items each feed has received, which picks the next slot.
+FEED_TABLES = f"""
+CREATE TABLE IF NOT EXISTS activity (
+    item_id BIGSERIAL PRIMARY KEY,
+    actor_id INTEGER NOT NULL,
+    kind VARCHAR(8) NOT NULL,
+    book_id INTEGER NOT NULL,
+    detail INTEGER,
+    created_at TIMESTAMP NOT NULL,
+    fanned_out BOOLEAN NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activity_pull_idx ON activity (actor_id, item_id) WHERE NOT fanned_out;
+CREATE TABLE IF NOT EXISTS feed_head (
+    user_id INTEGER PRIMARY KEY,
+    position BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feed_item (
+    user_id INTEGER NOT NULL,
+    slot INTEGER NOT NULL,
+    item_id BIGINT NOT NULL,
+    PRIMARY KEY (user_id, slot)
+);
+CREATE INDEX IF NOT EXISTS feed_item_user_item_idx ON feed_item (user_id, item_id);
+"""
+
+# Stores the activities in {source}, a subquery with (actor_id, kind, book_id, detail, created_at) columns,
+# and pushes those of actors with at most FANOUT_LIMIT followers into their followers' feeds. When one
+# statement brings several items to the same feed they take consecutive slots, and only the newest
+# FEED_LENGTH of them are kept. To be used as the CTEs of a larger statement; %% is a literal %.
+FAN_OUT = f"""
+act AS (
+    INSERT INTO activity (actor_id, kind, book_id, detail, created_at, fanned_out)
+    SELECT src.actor_id, src.kind, src.book_id, src.detail, src.created_at,
+           (SELECT COUNT(*) FROM (SELECT 1 FROM following WHERE followee = src.actor_id LIMIT {FANOUT_LIMIT + 1}) f)
+               <= {FANOUT_LIMIT}
+    FROM {{source}} AS src
+    RETURNING item_id, actor_id, fanned_out
+), fan AS (
+    SELECT f.follower AS user_id, act.item_id,
+           ROW_NUMBER() OVER (PARTITION BY f.follower ORDER BY act.item_id) AS n,
+           COUNT(*) OVER (PARTITION BY f.follower) AS k
+    FROM act
+    JOIN following f ON f.followee = act.actor_id
+    WHERE act.fanned_out
+), heads AS (
+    INSERT INTO feed_head (user_id, position)
+    SELECT user_id, MAX(k) FROM fan GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET position = feed_head.position + EXCLUDED.position
+    RETURNING user_id, position
+), pushed AS (
+    INSERT INTO feed_item (user_id, slot, item_id)
+    SELECT fan.user_id, (heads.position - fan.k + fan.n) %% {FEED_LENGTH}, fan.item_id
+    FROM fan
+    JOIN heads ON heads.user_id = fan.user_id
+    WHERE fan.n > fan.k - {FEED_LENGTH}
+    ON CONFLICT (user_id, slot) DO UPDATE SET item_id = EXCLUDED.item_id
+)"""
+
+RECORD_ACTIVITY = "WITH " + FAN_OUT.format(
+    source="(SELECT * FROM (VALUES %s) AS v(actor_id, kind, book_id, detail, created_at))"
+) + "\nSELECT COUNT(*) FROM act"
+
+# A page of a user's feed, newest first: the items pushed to them, merged with the latest pulled items
+# of each followee. Both sides stop at the page size, and a page after the first starts below the last
+# item_id shown, so each page costs the same however deep it is. The pull side probes activity_pull_idx
+# once per followee, so a page is O(followees) index probes. Only activity that was not fanned out is
+# in that partial index, so a probe for an ordinary followee reads no rows.
+# Items pushed by users since unfollowed are left out.
+FEED_PAGE = """
+SELECT a.item_id, u.username, a.kind, b.title, a.detail, a.created_at
+FROM (
+    (SELECT fi.item_id
+     FROM feed_item fi
+     WHERE fi.user_id = %(user_id)s AND fi.item_id < %(before)s
+     ORDER BY fi.item_id DESC
+     LIMIT %(n)s)
+    UNION ALL
+    (SELECT pulled.item_id
+     FROM following f
+     CROSS JOIN LATERAL (
+         SELECT pa.item_id
+         FROM activity pa
+         WHERE pa.actor_id = f.followee AND NOT pa.fanned_out AND pa.item_id < %(before)s
+         ORDER BY pa.item_id DESC
+         LIMIT %(n)s
+     ) pulled
+     WHERE f.follower = %(user_id)s)
+) page
+JOIN activity a ON a.item_id = page.item_id
+JOIN users u ON u.user_id = a.actor_id
+JOIN book b ON b.book_id = a.book_id
+WHERE EXISTS (SELECT 1 FROM following f WHERE f.follower = %(user_id)s AND f.followee = a.actor_id)
+ORDER BY a.item_id DESC
+LIMIT %(n)s
+"""
+
+def record_activity(cursor, activities):
+    """
+    Adds activities to the actors' followers' feeds. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A cursor on the caller's connection.
+        activities (list of tuples): (actor_id, kind, book_id, detail, created_at), where kind is
+                                     "read" (detail is pages read) or "rate" (detail is stars).
+    """
+    execute_values(cursor, RECORD_ACTIVITY, [(user_key(actor_id), kind, book_id, detail, created_at)
+                                             for actor_id, kind, book_id, detail, created_at in activities])
+
+def feed_page(cursor, user_id, before=None, n=20):
+    """
+    Reads one page of a user's feed. Costs one index probe per followee plus the page itself; see FEED_PAGE.
+
+    Parameters:
+        cursor: A database cursor.
+        user_id (int): Whose feed.
+        before (int): The item_id of the last item on the previous page, None for the first page.
+        n (int): Items per page.
+
+    Returns:
+        list of tuples: (item_id, username, kind, title, detail, created_at), newest first.
+    """
+    cursor.execute(FEED_PAGE, {"user_id": user_key(user_id), "before": before if before is not None else 2 ** 62, "n": n})
+    return cursor.fetchall()
@@ -0,0 +1,294 @@
+import sys
+import json
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from connection_and_queries import Connection
+
+def _read(connection, user_id, args):
+    # Same timing assumption as User.read_book: each page takes 3 minutes to read
+    start_page, end_page = int(args["start_page"]), int(args["end_page"])
+    start_time = datetime.datetime.now()
+    end_time = start_time + datetime.timedelta(minutes=(end_page - start_page) * 3)
+    return connection.read_book(user_id, args["book_title"], start_time, end_time, start_page, end_page)
+
+def _rate(connection, user_id, args):
+    if connection.rate_a_book(user_id, args["book_title"], int(args["rating"])) is False:
+        raise ValueError("Book doesn't exist.")
+
+def _profile(connection, user_id, args):
+    return {
+        "collections": connection.collection_info(user_id),
+        "follow": connection.follower_info(user_id),
+        "top_rated": connection.top_rated_books(user_id),
+    }
+
+def _check(result, message):
+    """
+    Turns the False/None failure returns used by Connection into an error for the batch result.
+    """
+    if result is False or result is None:
+        raise ValueError(message)
+    return result
+
+# Maps each batch command to the Connection method behind the interactive command of the same name.
+# Handlers take (connection, user_id, args) and return a JSON-serializable result.
+COMMANDS = {
+    "create": lambda c, uid, a: c.create_collection(uid, a["title"]),
+    "delete": lambda c, uid, a: c.delete_collection(uid, a["title"]),
+    "rename": lambda c, uid, a: c.modify_collection_name(uid, old_name=a["old_title"], new_name=a["new_title"]),
+    "add": lambda c, uid, a: _check(c.add_book_to_collection(uid, a["book_title"], a["collection_title"]), "Book or collection doesn't exist."),
+    "remove": lambda c, uid, a: _check(c.remove_book_from_collection(uid, a["book_title"], a["collection_title"]), "Book or collection doesn't exist."),
+    "rate": _rate,
+    "read": _read,
+    "profile": _profile,
+    "follow": lambda c, uid, a: _check(c.follow(uid, a["email"]), f"Could not follow {a['email']}."),
+    "unfollow": lambda c, uid, a: _check(c.unfollow(uid, a["email"]), f"Could not unfollow {a['email']}."),
+    "followmany": lambda c, uid, a: dict(zip(("followed", "missing"), _check(c.follow_many(uid, a["emails"]), "Bulk follow failed."))),
+    "unfollowmany": lambda c, uid, a: dict(zip(("unfollowed", "missing"), _check(c.unfollow_many(uid, a["emails"]), "Bulk unfollow failed."))),
+    "list": lambda c, uid, a: c.get_collections(uid),
+    "search": lambda c, uid, a: c.search_books(a["search_term"], a["search_value"]),
+    "sort": lambda c, uid, a: c.sort_books(a["search_term"], a["search_value"], a["order_value"], a.get("order_by", "asc")),
+    "top20": lambda c, uid, a: _check(c.top20(), "Failed to retrieve top 20."),
+    "follower20": lambda c, uid, a: _check(c.follower20(uid), "Failed to retrieve follower top 20."),
+    "top5new": lambda c, uid, a: _check(c.top5new(), "Failed to retrieve top 5 new releases."),
+    "rec": lambda c, uid, a: _check(c.recommendations(uid), "Failed to retrieve recommendations."),
+    "suggest": lambda c, uid, a: _check(c.suggested_users(uid), "Failed to retrieve suggestions."),
+    "stats": lambda c, uid, a: _check(c.reading_stats(uid, a.get("days")), "Failed to retrieve reading stats."),
+    "statsbackfill": lambda c, uid, a: c.backfill_reading_rollups(),
+    "partitionsessions": lambda c, uid, a: c.partition_reading_sessions(a.get("months_ahead", 3)),
+    "archivesessions": lambda c, uid, a: c.archive_reading_sessions(int(a["keep_months"]), a.get("archive_dir"), a.get("drop", False)),
+    "migrate": lambda c, uid, a: c.apply_migrations(a.get("target")),
+    "recbuild": lambda c, uid, a: c.refresh_recommendations(a.get("workers"), a.get("active_days", 30)),
+    "mostread": lambda c, uid, a: _check(c.most_read(a.get("days", 90), uid if a.get("followers") else None),
+                                         "Failed to retrieve the most read books."),
+    "feed": lambda c, uid, a: _check(c.feed(uid, a.get("before"), a.get("n", 20)), "Failed to retrieve the feed."),
+    "trending": lambda c, uid, a: _check(c.trending_books(a.get("n", 20)), "Failed to retrieve trending books."),
+    "trendingrebuild": lambda c, uid, a: c.rebuild_trending(),
+    "loadcatalog": lambda c, uid, a: c.load_catalog(a["path"], a.get("workers")),
+}
+
+# Commands that do not need a logged-in user
+ANONYMOUS_COMMANDS = {"join", "search", "sort", "top20", "top5new", "trending", "mostread"}
+
+# Schema changes, rebuilds and bulk loads; these need no user but are only run by an admin runner
+ADMIN_COMMANDS = {"statsbackfill", "partitionsessions", "archivesessions", "migrate",
+                  "recbuild", "trendingrebuild", "loadcatalog"}
+
+def parse_records(lines):
+    """
+    Parses JSONL batch input. Each line is an object such as
+    {"username": "alice", "password": "...", "command": "add", "args": {"book_title": "Dune", "collection_title": "Sci-Fi"}}.
+    The plaintext password is checked as login checks it; only an admin runner may leave it out.
+    Blank lines are skipped. A line that is not a JSON object gets a failed result of its own, and
+    the other lines still run.
+
+    Parameters:
+        lines (iterable of str): The input lines.
+
+    Returns:
+        tuple: (records, errors): (line_number, record) pairs for the lines that parsed, and a
+        failed result for each line that did not.
+    """
+    records = []
+    errors = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            errors.append({"line": line_number, "ok": False, "error": f"Invalid request: {e}"})
+            continue
+        records.append((line_number, record))
+    return records, errors
+
+def partition_by_user(records, workers):
+    """
+    Splits records across workers so every record for a given user lands on the same worker, in input order.
+
+    Returns:
+        list of lists: One list of (line_number, record) pairs per worker.
+    """
+    shards = [[] for _ in range(workers)]
+    assignment = {}
+    for line_number, record in records:
+        key = record.get("username") or record.get("args", {}).get("username") or ""
+        if key not in assignment:
+            assignment[key] = len(assignment) % workers
+        shards[assignment[key]].append((line_number, record))
+    return shards
+
+class BatchRunner:
+    """
+    Runs batch commands through Connection, one connection per worker thread, and writes one JSON
+    result per input line to the output stream.
+
+    Records act as the user they name only with that user's password. An admin runner also accepts
+    records without a password, acting as any user, and runs the ADMIN_COMMANDS.
+    """
+
+    def __init__(self, ssh_username, ssh_password, hash_password, output=sys.stdout, group_size=1, workers=1,
+                 replica_address=None, tracer=None, admin=False):
+        """
+        Parameters:
+            ssh_username (str): SSH username for connecting to the remote server.
+            ssh_password (str): SSH password for connecting to the remote server.
+            hash_password (callable): Hashes plaintext passwords for join and record passwords, as the interactive CLI does.
+            output (file): Where result lines are written.
+            group_size (int): Number of commands committed together in one transaction per worker.
+            workers (int): Number of worker threads, each with its own connection.
+            replica_address (tuple): (host, port) of a read replica to route read-only commands to.
+            tracer (Tracer): Records a span per command and statement across all workers, if given.
+            admin (bool): Whether to run admin commands and records without a password.
+        """
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+        self.hash_password = hash_password
+        self.output = output
+        self.group_size = max(1, group_size)
+        self.workers = max(1, workers)
+        self.replica_address = replica_address
+        self.tracer = tracer
+        self.admin = admin
+        self.output_lock = threading.Lock()
+
+    def emit(self, result):
+        with self.output_lock:
+            self.output.write(json.dumps(result, default=str) + "\n")
+            self.output.flush()
+
+    def find_user(self, connection, users, record):
+        """
+        Resolves the record's user, checking its password unless this is an admin runner.
+        Found users are remembered in users, keyed by username and hashed password.
+
+        Returns:
+            tuple: The user ID.
+
+        Raises:
+            ValueError: If the password is missing or wrong, or there is no such user.
+        """
+        username = record["username"]
+        password = record.get("password")
+        if password is None and not self.admin:
+            raise ValueError(f"Command {record['command']} needs the password of {username}.")
+        key = (username, self.hash_password(password) if password is not None else None)
+        if key not in users:
+            user_id = connection.find_user(*key)
+            if user_id is None:
+                raise ValueError(f"No such user or wrong password: {username}")
+            users[key] = user_id
+        return users[key]
+
+    def run_command(self, connection, users, record):
+        """
+        Runs a single record and returns its result.
+
+        Raises:
+            Exception: Any error raised by the command; the caller records it.
+        """
+        command = record["command"]
+        args = record.get("args", {})
+        if command == "join":
+            return connection.join(args["username"], args["email"], self.hash_password(args["password"]),
+                                   args["first_name"], args["last_name"])
+        if command not in COMMANDS:
+            raise ValueError(f"Command not recognized: {command}")
+        if command in ADMIN_COMMANDS and not self.admin:
+            raise ValueError(f"Command {command} is only available with --admin.")
+        user_id = None
+        if record.get("username") is not None:
+            user_id = self.find_user(connection, users, record)
+        elif command not in ANONYMOUS_COMMANDS and command not in ADMIN_COMMANDS:
+            raise ValueError(f"Command {command} needs a username.")
+        return COMMANDS[command](connection, user_id, args)
+
+    def run_traced(self, connection, users, record):
+        """
+        Runs a single record, inside a span named after its command when tracing.
+        """
+        if self.tracer is None:
+            return self.run_command(connection, users, record)
+        with self.tracer.span(f"batch.{record.get('command')}", "batch", username=record.get("username")):
+            return self.run_command(connection, users, record)
+
+    def run_shard(self, shard):
+        """
+        Runs one worker's records in order, committing every group_size commands.
+        If a command fails with a database error, the rest of its group is rolled back or skipped and
+        reported as such; commands rejected with a ValueError (unknown user, missing collection) are
+        reported without affecting the rest of the group.
+
+        Raises:
+            SchemaOutdatedError: If the database is missing migrations; nothing is run.
+        """
+        connection = Connection(self.ssh_username, self.ssh_password, replica_address=self.replica_address)
+        try:
+            connection.check_schema()
+        except Exception:
+            connection.close()
+            raise
+        if self.tracer is not None:
+            connection.enable_tracing(self.tracer)
+        users = {}
+        try:
+            for start in range(0, len(shard), self.group_size):
+                group = shard[start:start + self.group_size]
+                results = []
+                try:
+                    with connection.grouped_commits():
+                        for line_number, record in group:
+                            result = {"line": line_number, "username": record.get("username"), "command": record.get("command")}
+                            try:
+                                result["result"] = self.run_traced(connection, users, record)
+                                result["ok"] = not connection.group_failed
+                                if not result["ok"]:
+                                    result["error"] = "Command failed and rolled back its transaction group."
+                            except ValueError as e:
+                                # Rejected before or without changing anything, so the group can go on
+                                result["ok"] = False
+                                result["error"] = str(e)
+                            except Exception as e:
+                                result["ok"] = False
+                                result["error"] = str(e)
+                                connection.rollback()
+                            results.append(result)
+                            if connection.group_failed:
+                                break
+                    group_error = "Rolled back with its transaction group."
+                except Exception as e:
+                    group_error = f"Commit failed: {e}"
+                if connection.group_failed:
+                    # Nothing from this group was committed
+                    for result in results:
+                        if result["ok"]:
+                            result["ok"] = False
+                            result["error"] = group_error
+                    done = {result["line"] for result in results}
+                    for line_number, record in group:
+                        if line_number not in done:
+                            results.append({"line": line_number, "username": record.get("username"),
+                                            "command": record.get("command"), "ok": False,
+                                            "error": "Skipped after an earlier failure in its transaction group."})
+                for result in results:
+                    self.emit(result)
+        finally:
+            connection.close()
+
+    def run(self, lines):
+        """
+        Parses the input and runs it across the worker threads.
+
+        Parameters:
+            lines (iterable of str): JSONL input lines.
+        """
+        records, errors = parse_records(lines)
+        for error in errors:
+            self.emit(error)
+        shards = [shard for shard in partition_by_user(records, self.workers) if shard]
+        with ThreadPoolExecutor(max_workers=len(shards) or 1) as pool:
+            for future in [pool.submit(self.run_shard, shard) for shard in shards]:
+                future.result()
@@ -0,0 +1,200 @@
+import sys
+import time
+import json
+import argparse
+import statistics
+from connection_and_queries import Connection
+import collection_summary
+import book_ratings
+import reader_sketch
+import contributors
+import migrations
+
+# Synthetic data for a fresh, fully migrated database. %(name)s values come from SIZES and the command line.
+SEED = """
+INSERT INTO users SELECT g, 'user' || g, md5(g::text), 'First' || g, 'Last' || g, NOW(), NOW()
+FROM generate_series(1, %(users)s) g ON CONFLICT DO NOTHING;
+INSERT INTO user_email SELECT g, 'user' || g || '@example.com' FROM generate_series(1, %(users)s) g ON CONFLICT DO NOTHING;
+INSERT INTO book SELECT g, 'Book ' || g, 100 + g %% 400 FROM generate_series(1, %(books)s) g ON CONFLICT DO NOTHING;
+INSERT INTO contributor SELECT g, 'First' || g, 'Last' || g FROM generate_series(1, %(contributors)s) g ON CONFLICT DO NOTHING;
+INSERT INTO writes SELECT g, 1 + g %% %(contributors)s FROM generate_series(1, %(books)s) g ON CONFLICT DO NOTHING;
+INSERT INTO publishes SELECT g, 1 + (g * 7) %% %(contributors)s FROM generate_series(1, %(books)s) g ON CONFLICT DO NOTHING;
+INSERT INTO genre SELECT g, 'Genre ' || g FROM generate_series(1, 20) g ON CONFLICT DO NOTHING;
+INSERT INTO classifies_as SELECT g, 1 + g %% 20 FROM generate_series(1, %(books)s) g ON CONFLICT DO NOTHING;
+INSERT INTO edition SELECT g, CURRENT_DATE - (g %% 3650) FROM generate_series(1, %(books)s) g;
+INSERT INTO following
+SELECT 1 + (random() * (%(users)s - 1))::int, 1 + (random() * (%(users)s - 1))::int
+FROM generate_series(1, %(follows)s) ON CONFLICT DO NOTHING;
+INSERT INTO rating
+SELECT 1 + (random() * (%(books)s - 1))::int, 1 + (random() * (%(users)s - 1))::int, 1 + (random() * 4)::int
+FROM generate_series(1, %(ratings)s);
+INSERT INTO collection (collection_id, name, user_id)
+SELECT g, 'Collection ' || g, 1 + g %% %(users)s FROM generate_series(1, %(collections)s) g ON CONFLICT DO NOTHING;
+INSERT INTO part_of
+SELECT 1 + (random() * (%(books)s - 1))::int, 1 + g %% %(collections)s FROM generate_series(1, %(collections)s * 10) g;
+INSERT INTO reading_session (session_id, user_id, book_id, start_time, end_time, pages_read)
+SELECT g, 1 + (random() * (%(users)s - 1))::int, 1 + (random() * (%(books)s - 1))::int, t, t + INTERVAL '30 minutes', 10
+FROM (SELECT g, NOW() - random() * INTERVAL '365 days' AS t FROM generate_series(1, %(sessions)s) g) s;
+INSERT INTO "book+session" SELECT book_id, session_id FROM reading_session;
+"""
+
+# Row counts per scale unit
+SIZES = {
+    "users": 10000,
+    "books": 20000,
+    "contributors": 5000,
+    "follows": 100000,
+    "ratings": 200000,
+    "collections": 20000,
+    "sessions": 500000,
+}
+
+def seed(connection, scale):
+    """
+    Fills a fresh, fully migrated database with synthetic data.
+
+    Parameters:
+        connection (Connection): A direct connection to the benchmark database.
+        scale (float): Multiplier applied to SIZES.
+    """
+    sizes = {name: max(2, int(count * scale)) for name, count in SIZES.items()}
+    connection.cursor.execute(SEED, sizes)
+    collection_summary.check_consistency(connection.cursor, fix=True)
+    connection.cursor.execute(book_ratings.BACKFILL)
+    connection.cursor.execute(reader_sketch.BACKFILL)
+    connection.cursor.execute("ANALYZE")
+    connection.connection.commit()
+
+def _rolled_back(method):
+    """
+    Wraps a write so it runs inside a transaction group that is always rolled back,
+    keeping the benchmark data unchanged between runs.
+    """
+    def probe(connection):
+        with connection.grouped_commits():
+            method(connection)
+            connection.group_failed = True
+    return probe
+
+def probes(connection):
+    """
+    Builds the Connection method calls that exercise each index, keyed by index name.
+
+    Returns:
+        dict: index name -> list of (method label, callable taking the Connection).
+    """
+    user_id = (1,)
+    connection.cursor.execute('SELECT name FROM collection WHERE user_id = 1 ORDER BY name LIMIT 1')
+    row = connection.cursor.fetchone()
+    collection_name = row[0] if row else None
+    return {
+        "users_username_idx": [("find_user", lambda c: c.find_user("user1"))],
+        "user_email_email_idx": [("resolve_emails", lambda c: c.resolve_emails(["user2@example.com", "user3@example.com"]))],
+        "book_title_idx": [
+            ("search_books(title)", lambda c: c.search_books("title", "Book 1")),
+            ("rate_a_book", _rolled_back(lambda c: c.rate_a_book(user_id, "Book 1", 5))),
+        ],
+        "collection_user_name_idx": [
+            ("get_collections", lambda c: c.get_collections(user_id)),
+            ("collection_info", lambda c: c.collection_info(user_id)),
+        ],
+        "part_of_collection_idx": [
+            ("remove_book_from_collection", _rolled_back(lambda c: c.remove_book_from_collection(user_id, "Book 1", collection_name))),
+        ],
+        "following_followee_idx": [
+            ("follower_info", lambda c: c.follower_info(user_id)),
+            ("follower20", lambda c: c.follower20(user_id)),
+        ],
+        "rating_book_idx": [("top20", lambda c: c.top20()), ("top5new", lambda c: c.top5new())],
+        "rating_user_idx": [("top_rated_books", lambda c: c.top_rated_books(user_id))],
+        "reading_session_start_time_idx": [("top20", lambda c: c.top20())],
+        "reading_session_user_idx": [
+            ("follower20", lambda c: c.follower20(user_id)),
+            ("recommendations", lambda c: c.recommendations(user_id)),
+        ],
+        "classifies_as_genre_idx": [("recommendations", lambda c: c.recommendations(user_id))],
+        "edition_release_date_idx": [("top5new", lambda c: c.top5new())],
+        "contributor_name_key_idx": [("search_books(author)", lambda c: c.search_books("author", "First1 Last1"))],
+        "writes_contributor_idx": [("search_books(author)", lambda c: c.search_books("author", "First1 Last1"))],
+        "publishes_contributor_idx": [("sort_books(publisher)", lambda c: c.sort_books("publisher", "First1 Last1", "title", "asc"))],
+    }
+
+def time_call(connection, call, repeat):
+    """
+    Returns:
+        float: The median wall time of call in milliseconds over repeat runs, after one warm-up run.
+    """
+    call(connection)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call(connection)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def run(connection, repeat=5):
+    """
+    For each managed index: drops it, times the methods that use it, recreates it and times them again.
+
+    Returns:
+        list of dicts: One result per (index, method) with before_ms, after_ms and speedup.
+    """
+    statements = dict(migrations.INDEXES)
+    statements.update(
+        (statement.split()[5], statement) for statement in contributors.CONTRIBUTOR_INDEXES.strip().splitlines()
+    )
+    results = []
+    for index, calls in probes(connection).items():
+        connection.cursor.execute(f"DROP INDEX IF EXISTS {index}")
+        connection.connection.commit()
+        before = {label: time_call(connection, call, repeat) for label, call in calls}
+        connection.cursor.execute(statements[index])
+        connection.connection.commit()
+        for label, call in calls:
+            after = time_call(connection, call, repeat)
+            results.append({
+                "index": index,
+                "method": label,
+                "before_ms": round(before[label], 3),
+                "after_ms": round(after, 3),
+                "speedup": round(before[label] / after, 1) if after else None,
+            })
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks each managed index against the Connection methods that use it.")
+    parser.add_argument("--database", required=True, help="name of a local, disposable database")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the synthetic data sizes")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per method")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data already in the database")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE as JSON")
+    arguments = parser.parse_args(argv)
+
+    parameters = {"database": arguments.database, "host": arguments.host, "port": arguments.port}
+    if arguments.user:
+        parameters["user"] = arguments.user
+    if arguments.password:
+        parameters["password"] = arguments.password
+    connection = Connection.direct(**parameters)
+    try:
+        migrations.migrate(connection.connection)
+        if not arguments.no_seed:
+            print("Seeding synthetic data...")
+            seed(connection, arguments.scale)
+        results = run(connection, repeat=arguments.repeat)
+    finally:
+        connection.close()
+
+    print(f"{'index':32s} {'method':30s} {'before ms':>10s} {'after ms':>10s} {'speedup':>8s}")
+    for result in results:
+        print(f"{result['index']:32s} {result['method']:30s} {result['before_ms']:10.3f} {result['after_ms']:10.3f} {result['speedup'] or 0:7.1f}x")
+    if arguments.json:
+        with open(arguments.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+import sys
+import time
+import argparse
+import datetime
+import statistics
+from connection_and_queries import Connection
+import benchmark_indexes
+import migrations
+import reader_sketch
+
+# Exact distinct readers per book over the same days reader_sketch.MOST_READ merges
+EXACT_MOST_READ = """
+SELECT rs.book_id, COUNT(DISTINCT rs.user_id) AS readers
+FROM reading_session rs
+WHERE rs.book_id IS NOT NULL AND rs.start_time >= %s AND rs.start_time < %s
+GROUP BY rs.book_id
+ORDER BY readers DESC
+LIMIT %s
+"""
+
+def timed(cursor, query, values, repeat):
+    """
+    Returns:
+        tuple: (rows from the last run, median milliseconds over repeat runs after one warm-up run)
+    """
+    cursor.execute(query, values)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, values)
+        rows = cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, statistics.median(timings)
+
+def compare(cursor, days, n, repeat, today=None):
+    """
+    Ranks the top n books by distinct readers over the last days days both exactly and from the
+    sketches, and compares the counts and query times.
+
+    Returns:
+        dict: exact_ms, sketch_ms, books compared, mean and max relative error, and top-n overlap.
+    """
+    today = today or datetime.date.today()
+    first_day = today - datetime.timedelta(days=days - 1)
+    exact, exact_ms = timed(cursor, EXACT_MOST_READ, (first_day, today + datetime.timedelta(days=1), n), repeat)
+    # Estimates for every book, so each exactly ranked book can be looked up
+    estimates, sketch_ms = timed(cursor, reader_sketch.MOST_READ, (first_day, today, 1000000), repeat)
+    estimated = {book_id: float(readers) for book_id, readers in estimates}
+    errors = [abs(estimated.get(book_id, 0) - readers) / readers for book_id, readers in exact]
+    top_exact = {book_id for book_id, readers in exact}
+    top_sketch = {book_id for book_id, readers in estimates[:n]}
+    return {
+        "days": days,
+        "exact_ms": exact_ms,
+        "sketch_ms": sketch_ms,
+        "books": len(exact),
+        "mean_error": statistics.mean(errors) if errors else 0.0,
+        "max_error": max(errors, default=0.0),
+        "top_overlap": len(top_exact & top_sketch) / max(len(top_exact), 1),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares sketch-estimated distinct readers with exact counts.")
+    parser.add_argument("--database", required=True, help="name of a local, disposable database")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the synthetic data sizes")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data already in the database")
+    parser.add_argument("--top", type=int, default=20, help="how many top books to compare")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query")
+    arguments = parser.parse_args(argv)
+
+    parameters = {"database": arguments.database, "host": arguments.host, "port": arguments.port}
+    if arguments.user:
+        parameters["user"] = arguments.user
+    if arguments.password:
+        parameters["password"] = arguments.password
+    connection = Connection.direct(**parameters)
+    try:
+        migrations.migrate(connection.connection)
+        if not arguments.no_seed:
+            print("Seeding synthetic data...")
+            benchmark_indexes.seed(connection, arguments.scale)
+        results = [compare(connection.cursor, days, arguments.top, arguments.repeat) for days in (7, 30, 90, 365)]
+    finally:
+        connection.close()
+
+    print(f"{'days':>5s} {'exact ms':>10s} {'sketch ms':>10s} {'speedup':>8s} {'books':>6s} {'mean err':>9s} {'max err':>8s} {'top overlap':>12s}")
+    for r in results:
+        speedup = r["exact_ms"] / r["sketch_ms"] if r["sketch_ms"] else 0
+        print(f"{r['days']:5d} {r['exact_ms']:10.2f} {r['sketch_ms']:10.2f} {speedup:7.1f}x {r['books']:6d} "
+              f"{r['mean_error']:8.1%} {r['max_error']:7.1%} {r['top_overlap']:11.0%}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
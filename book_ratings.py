@@ -0,0 +1,60 @@
+from psycopg2.extras import execute_values
+
+# Adds the maintained rating count and star total to each book and backfills them
+BOOK_RATING_COLUMNS = """
+ALTER TABLE book ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE book ADD COLUMN IF NOT EXISTS rating_total INTEGER NOT NULL DEFAULT 0;
+"""
+
+# Recomputes every book's rating summary from the rating table, resetting books without ratings to 0/0.
+# Only the books whose stored summary is wrong are updated.
+BACKFILL = """
+UPDATE book b
+SET rating_count = s.ratings, rating_total = s.stars
+FROM (
+    SELECT bk.book_id, COUNT(r.book_id) AS ratings, COALESCE(SUM(r.stars), 0) AS stars
+    FROM book bk
+    LEFT JOIN rating r ON r.book_id = bk.book_id
+    GROUP BY bk.book_id
+) s
+WHERE b.book_id = s.book_id
+  AND (b.rating_count IS DISTINCT FROM s.ratings OR b.rating_total IS DISTINCT FROM s.stars)
+"""
+
+# Adds when each rating was made, so trending.rebuild can replay ratings; older ratings are left NULL
+RATED_AT_COLUMN = """
+ALTER TABLE rating ADD COLUMN IF NOT EXISTS rated_at TIMESTAMP;
+"""
+
+# Stores ratings and adds them to their books' summaries in the same statement
+RECORD_RATINGS = """
+WITH added AS (
+    INSERT INTO rating (book_id, user_id, stars, rated_at) VALUES %s
+    RETURNING book_id, stars
+)
+UPDATE book b
+SET rating_count = b.rating_count + a.ratings, rating_total = b.rating_total + a.stars
+FROM (SELECT book_id, COUNT(*) AS ratings, SUM(stars) AS stars FROM added GROUP BY book_id) a
+WHERE b.book_id = a.book_id
+"""
+
+def create_columns(cursor):
+    """
+    Adds the rating summary columns to the book table and fills them in. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(BOOK_RATING_COLUMNS)
+    cursor.execute(BACKFILL)
+
+def record_ratings(cursor, ratings):
+    """
+    Stores ratings and keeps the book rating summaries in step. Every rating is stored, including a
+    reader rating the same book again. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A cursor on the caller's connection.
+        ratings (list of tuples): (book_id, user_id, stars, rated_at) per rating.
+    """
+    execute_values(cursor, RECORD_RATINGS, ratings)
@@ -0,0 +1,324 @@
+import os
+import csv
+import sys
+import json
+import shutil
+import argparse
+import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import contributors
+import collection_summary
+
+# Rows per COPY. Each chunk is staged, merged and committed by one worker on its own connection.
+CHUNK_ROWS = 500000
+
+# CSV fields that hold several values separate them with this character
+CSV_LIST_SEPARATOR = "|"
+
+# Book record fields that hold lists
+LIST_FIELDS = ("authors", "publishers", "editors", "genres", "audiences", "release_dates")
+
+# Book record fields naming contributors, and the role table linking them to the book
+ROLE_FIELDS = {"authors": "writes", "publishers": "publishes", "editors": "edits"}
+
+# The columns loaded into each table
+COLUMNS = {
+    "book": ("book_id", "title", "length"),
+    "contributor": ("contributor_id", "first_name", "last_name"),
+    "genre": ("genre_id", "type"),
+    "audience": ("audience_id", "type"),
+    "writes": ("book_id", "contributor_id"),
+    "publishes": ("book_id", "contributor_id"),
+    "edits": ("book_id", "contributor_id"),
+    "classifies_as": ("book_id", "genre_id"),
+    "enjoys": ("book_id", "audience_id"),
+    "edition": ("book_id", "release_date"),
+}
+
+# Tables in the first phase are referenced by the second phase's, so the phases run one after the other;
+# the chunks within a phase are loaded in parallel
+PHASES = [
+    ("book", "contributor", "genre", "audience"),
+    ("writes", "publishes", "edits", "classifies_as", "enjoys", "edition"),
+]
+
+# How each staged chunk is merged into its table. Rows already present are left alone, and books whose
+# title or length changed are updated, so loading the same dump again changes nothing. The book merge
+# also reports which existing books changed length, since their collections' page totals are now off.
+MERGE = {
+    "book": """
+        WITH old AS (
+            SELECT book_id, length FROM book WHERE book_id IN (SELECT book_id FROM stage)
+        ), merged AS (
+            INSERT INTO book (book_id, title, length)
+            SELECT DISTINCT ON (book_id) book_id, title, length FROM stage
+            ON CONFLICT (book_id) DO UPDATE SET title = EXCLUDED.title, length = EXCLUDED.length
+            WHERE (book.title, book.length) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.length)
+            RETURNING book_id, length
+        )
+        SELECT (SELECT COUNT(*) FROM merged),
+               ARRAY(SELECT m.book_id FROM merged m JOIN old o ON o.book_id = m.book_id
+                     WHERE m.length IS DISTINCT FROM o.length)
+    """,
+    # edition has no key, so existing (book, date) pairs are skipped explicitly
+    "edition": """
+        INSERT INTO edition (book_id, release_date)
+        SELECT DISTINCT s.book_id, s.release_date FROM stage s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM edition e
+            WHERE e.book_id = s.book_id AND e.release_date IS NOT DISTINCT FROM s.release_date
+        )
+    """,
+}
+for _table, _columns in COLUMNS.items():
+    MERGE.setdefault(_table, f"INSERT INTO {_table} ({', '.join(_columns)}) "
+                             f"SELECT {', '.join(_columns)} FROM stage ON CONFLICT DO NOTHING")
+
+def _copy_field(value):
+    """
+    Formats one value for COPY's text format.
+    """
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def split_name(name):
+    """
+    Splits a contributor name into (first_name, last_name). "Last, First" is understood, otherwise the
+    last word is the last name; a single word is stored as the last name.
+    """
+    if "," in name:
+        last, first = name.split(",", 1)
+        return first.strip() or None, last.strip()
+    parts = name.rsplit(None, 1)
+    if len(parts) == 1:
+        return None, parts[0]
+    return parts[0], parts[1]
+
+def read_records(path, format=None):
+    """
+    Reads book records from a catalog dump. Each record has book_id, title and optionally length,
+    plus the lists authors, publishers, editors, genres, audiences and release_dates (ISO dates).
+    JSONL records hold the lists as arrays; CSV rows have one column per field with the list
+    values separated by CSV_LIST_SEPARATOR.
+
+    Parameters:
+        path (str): The dump file.
+        format (str): "csv" or "jsonl", defaults to the file extension.
+
+    Yields:
+        tuple: (line number, record dict).
+    """
+    format = format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf-8") as source:
+        if format == "csv":
+            for line_number, row in enumerate(csv.DictReader(source), start=2):
+                for field in LIST_FIELDS:
+                    row[field] = [value.strip() for value in (row.get(field) or "").split(CSV_LIST_SEPARATOR)
+                                  if value.strip()]
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(source, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+class _Spool:
+    """
+    Writes one table's rows to numbered chunk files in COPY text format.
+    """
+
+    def __init__(self, directory, table):
+        self.directory = directory
+        self.table = table
+        self.chunks = []
+        self.rows = 0
+        self.file = None
+
+    def write(self, row):
+        if self.rows % CHUNK_ROWS == 0:
+            if self.file is not None:
+                self.file.close()
+            path = os.path.join(self.directory, f"{self.table}.{len(self.chunks)}.tsv")
+            self.chunks.append(path)
+            self.file = open(path, "w", encoding="utf-8")
+        self.file.write("\t".join(_copy_field(value) for value in row) + "\n")
+        self.rows += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+class _Names:
+    """
+    Resolves names to IDs: existing rows are matched by normalized name, and new names get the
+    next free IDs and are written to the table's spool.
+    """
+
+    def __init__(self, cursor, query, spool, make_row, key):
+        cursor.execute(query)
+        self.ids = {}
+        next_id = 0
+        for row_id, name_key in cursor.fetchall():
+            self.ids.setdefault(name_key, row_id)
+            next_id = max(next_id, row_id)
+        self.next_id = next_id + 1
+        self.spool = spool
+        self.make_row = make_row
+        self.key = key
+
+    def resolve(self, name):
+        key = self.key(name)
+        row_id = self.ids.get(key)
+        if row_id is None:
+            row_id = self.ids[key] = self.next_id
+            self.next_id += 1
+            self.spool.write((row_id,) + self.make_row(name))
+        return row_id
+
+def _spool_catalog(connection, records, directory):
+    """
+    Reads the dump once, resolving contributors, genres and audiences in memory, and writes each table's
+    rows to its spool.
+
+    Returns:
+        tuple: (dict of table -> _Spool, list of (line number, error) for the records skipped).
+    """
+    spools = {table: _Spool(directory, table) for table in COLUMNS}
+    with connection.cursor() as cursor:
+        people = _Names(cursor, f"SELECT contributor_id, {contributors.NAME_KEY} FROM contributor ORDER BY contributor_id",
+                        spools["contributor"], split_name, contributors.name_key)
+        genres = _Names(cursor, "SELECT genre_id, lower(type) FROM genre ORDER BY genre_id",
+                        spools["genre"], lambda name: (name,), str.lower)
+        audiences = _Names(cursor, "SELECT audience_id, lower(type) FROM audience ORDER BY audience_id",
+                           spools["audience"], lambda name: (name,), str.lower)
+    connection.rollback()
+    skipped = []
+    for line_number, record in records:
+        try:
+            book_id = int(record["book_id"])
+            title = record["title"].strip()
+            if not title:
+                raise ValueError("empty title")
+            length = int(record["length"]) if record.get("length") not in (None, "") else None
+            release_dates = {datetime.date.fromisoformat(str(day)) for day in record.get("release_dates") or []}
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            skipped.append((line_number, f"{type(e).__name__}: {e}"))
+            continue
+        spools["book"].write((book_id, title, length))
+        for field, table in ROLE_FIELDS.items():
+            for contributor_id in {people.resolve(name.strip()) for name in record.get(field) or [] if name.strip()}:
+                spools[table].write((book_id, contributor_id))
+        for genre_id in {genres.resolve(name.strip()) for name in record.get("genres") or [] if name.strip()}:
+            spools["classifies_as"].write((book_id, genre_id))
+        for audience_id in {audiences.resolve(name.strip()) for name in record.get("audiences") or [] if name.strip()}:
+            spools["enjoys"].write((book_id, audience_id))
+        for day in release_dates:
+            spools["edition"].write((book_id, day))
+    for spool in spools.values():
+        spool.close()
+    return spools, skipped
+
+def _load_chunk(parameters, table, path):
+    """
+    Copies one chunk into a temporary staging table and merges it into its table in one transaction.
+
+    Returns:
+        tuple: (table, rows inserted or updated, IDs of existing books whose length changed).
+    """
+    connection = psycopg2.connect(**parameters)
+    columns = ", ".join(COLUMNS[table])
+    try:
+        with connection.cursor() as cursor:
+            # A lost commit is recovered by loading the dump again
+            cursor.execute("SET synchronous_commit = off")
+            cursor.execute(f"CREATE TEMP TABLE stage ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA")
+            with open(path, encoding="utf-8") as data:
+                cursor.copy_expert(f"COPY stage ({columns}) FROM STDIN", data)
+            cursor.execute(MERGE[table])
+            if cursor.description is not None:
+                changed, resized = cursor.fetchone()
+            else:
+                changed, resized = cursor.rowcount, []
+        connection.commit()
+        return table, changed, resized
+    finally:
+        connection.close()
+
+def load_catalog(parameters, path, workers=None, format=None, spool_dir=None):
+    """
+    Loads a catalog dump into book, contributor, genre, audience, edition and their link tables.
+
+    The dump is read once and split into per-table COPY chunks on disk, then the chunks are copied in
+    parallel, one connection per worker, books and the tables they reference first. Loading the same
+    dump again, or a newer one, only adds what is missing and updates changed titles and lengths.
+    Collections holding a book whose length changed get their page totals recomputed at the end.
+    New contributor, genre and audience IDs are assigned here, so only one load may run at a time.
+
+    Parameters:
+        parameters (dict): psycopg2.connect keyword arguments, as Connection.parameters.
+        path (str): The dump file, see read_records.
+        workers (int): Number of parallel COPY workers, defaults to the number of cores.
+        format (str): "csv" or "jsonl", defaults to the file extension.
+        spool_dir (str): Where the chunk files are written, defaults to the system temporary directory.
+
+    Returns:
+        dict: records (books read), skipped (list of (line number, error)) and rows (table -> rows changed,
+              including collection when page totals were recomputed).
+    """
+    directory = tempfile.mkdtemp(prefix="catalog-", dir=spool_dir)
+    try:
+        connection = psycopg2.connect(**parameters)
+        try:
+            spools, skipped = _spool_catalog(connection, read_records(path, format), directory)
+        finally:
+            connection.close()
+        rows = {table: 0 for table in COLUMNS}
+        resized = []
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            for phase in PHASES:
+                futures = [pool.submit(_load_chunk, parameters, table, chunk)
+                           for table in phase for chunk in spools[table].chunks]
+                for future in futures:
+                    table, changed, books = future.result()
+                    rows[table] += changed
+                    resized += books
+        connection = psycopg2.connect(**parameters)
+        try:
+            # Once, after the parallel merges, so their transactions never contend for collection rows
+            if resized:
+                with connection.cursor() as cursor:
+                    rows["collection"] = collection_summary.recompute(cursor, resized)
+                connection.commit()
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {', '.join(COLUMNS)}")
+        finally:
+            connection.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"records": spools["book"].rows, "skipped": skipped, "rows": rows}
+
+def main(argv=None):
+    """
+    Loads a catalog dump into a database reached directly (e.g. a local Postgres), without the SSH tunnel.
+    """
+    parser = argparse.ArgumentParser(description="Loads a book catalog dump (CSV or JSONL) into the Books Platform.")
+    parser.add_argument("dsn", help='libpq connection string, e.g. "dbname=books host=localhost"')
+    parser.add_argument("path", help="the catalog dump")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="dump format, defaults to the file extension")
+    parser.add_argument("--workers", type=int, help="parallel COPY workers (default: number of cores)")
+    parser.add_argument("--spool-dir", help="directory for the intermediate chunk files")
+    arguments = parser.parse_args(argv)
+    result = load_catalog({"dsn": arguments.dsn}, arguments.path, workers=arguments.workers,
+                          format=arguments.format, spool_dir=arguments.spool_dir)
+    for line_number, error in result["skipped"][:20]:
+        print(f"Skipped line {line_number}: {error}", file=sys.stderr)
+    print(f"Read {result['records']} books, skipped {len(result['skipped'])}.")
+    for table, changed in result["rows"].items():
+        print(f"{table:15s} {changed} rows added or updated")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+# Adds the maintained book count and page total to each collection and backfills them
+COLLECTION_SUMMARY_COLUMNS = """
+ALTER TABLE collection ADD COLUMN IF NOT EXISTS book_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE collection ADD COLUMN IF NOT EXISTS page_total INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS collection_user_name_idx ON collection (user_id, name);
+"""
+
+# Recomputes every collection's summary from part_of and book
+ACTUAL_SUMMARIES = """
+SELECT c.collection_id,
+       c.book_count, COUNT(p.book_id) AS actual_count,
+       c.page_total, COALESCE(SUM(b.length), 0) AS actual_pages
+FROM collection c
+LEFT JOIN part_of p ON c.collection_id = p.collection_id
+LEFT JOIN book b ON p.book_id = b.book_id
+GROUP BY c.collection_id, c.book_count, c.page_total
+"""
+
+def create_columns(cursor):
+    """
+    Adds the summary columns to the collection table and fills them in. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(COLLECTION_SUMMARY_COLUMNS)
+    check_consistency(cursor, fix=True)
+
+def check_consistency(cursor, fix=False):
+    """
+    Compares each collection's stored summary with one recomputed from part_of and book.
+    Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+        fix (bool): Whether to overwrite the mismatched summaries with the recomputed values.
+
+    Returns:
+        list of tuples: (collection_id, book_count, actual_count, page_total, actual_pages) for every
+        collection whose stored summary is wrong.
+    """
+    cursor.execute(f"""
+        SELECT * FROM ({ACTUAL_SUMMARIES}) s
+        WHERE s.book_count <> s.actual_count OR s.page_total <> s.actual_pages
+        ORDER BY s.collection_id
+    """)
+    mismatches = cursor.fetchall()
+    if fix and mismatches:
+        cursor.execute(f"""
+            UPDATE collection c
+            SET book_count = s.actual_count, page_total = s.actual_pages
+            FROM ({ACTUAL_SUMMARIES}) s
+            WHERE c.collection_id = s.collection_id
+              AND (s.book_count <> s.actual_count OR s.page_total <> s.actual_pages)
+        """)
+    return mismatches
+
+def recompute(cursor, book_ids):
+    """
+    Recomputes the summaries of the collections that hold any of the given books, e.g. after their
+    lengths changed. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+        book_ids (list of int): The books whose collections are recomputed.
+
+    Returns:
+        int: The number of collections whose summary changed.
+    """
+    cursor.execute("""
+        UPDATE collection c
+        SET book_count = s.actual_count, page_total = s.actual_pages
+        FROM (
+            SELECT p.collection_id, COUNT(p.book_id) AS actual_count, COALESCE(SUM(b.length), 0) AS actual_pages
+            FROM part_of p
+            LEFT JOIN book b ON p.book_id = b.book_id
+            WHERE p.collection_id IN (SELECT collection_id FROM part_of WHERE book_id = ANY(%s))
+            GROUP BY p.collection_id
+        ) s
+        WHERE c.collection_id = s.collection_id
+          AND (c.book_count, c.page_total) IS DISTINCT FROM (s.actual_count, s.actual_pages)
+    """, (list(book_ids),))
+    return cursor.rowcount
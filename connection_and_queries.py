@@ -1,16 +1,169 @@
+import time
 import datetime
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 from sshtunnel import SSHTunnelForwarder, BaseSSHTunnelForwarderError
 from constants import DATABASE_NAME
+from follow_graph import FollowGraph, user_key
+from title_index import PrefixIndex
+import suggestions
+import collection_summary
+import reading_rollup
+import session_partitions
+import recommendations
+import contributors
+import book_ratings
+import trending
+import reader_sketch
+import catalog_loader
+import activity_feed
+from trending import TrendingEngine
+import migrations
+from write_behind import WriteBehindQueue
+from result_cache import ResultCache, reads, writes, cache_key
+from explain_capture import ExplainCapture
+from tracing import Tracer
+
+# One row per book: contributors, audiences, genres and edition dates aggregated into arrays,
+# and the average rating read from the summary columns on book instead of the raw ratings
+BOOK_SUMMARY = """
+SELECT b.book_id, b.title, b.length,
+       ARRAY(SELECT CONCAT_WS(' ', c.first_name, c.last_name) FROM writes w
+             JOIN contributor c ON w.contributor_id = c.contributor_id
+             WHERE w.book_id = b.book_id ORDER BY 1) AS authors,
+       ARRAY(SELECT CONCAT_WS(' ', c.first_name, c.last_name) FROM publishes p
+             JOIN contributor c ON p.contributor_id = c.contributor_id
+             WHERE p.book_id = b.book_id ORDER BY 1) AS publishers,
+       ARRAY(SELECT CONCAT_WS(' ', c.first_name, c.last_name) FROM edits e
+             JOIN contributor c ON e.contributor_id = c.contributor_id
+             WHERE e.book_id = b.book_id ORDER BY 1) AS editors,
+       ARRAY(SELECT a.type FROM enjoys en JOIN audience a ON en.audience_id = a.audience_id
+             WHERE en.book_id = b.book_id ORDER BY 1) AS audiences,
+       ARRAY(SELECT g.type FROM classifies_as ca JOIN genre g ON ca.genre_id = g.genre_id
+             WHERE ca.book_id = b.book_id ORDER BY 1) AS genres,
+       ARRAY(SELECT ed.release_date FROM edition ed WHERE ed.book_id = b.book_id ORDER BY 1) AS release_dates,
+       b.rating_total::float / NULLIF(b.rating_count, 0) AS avg_rating,
+       b.rating_count
+FROM book b
+"""
+
+# Records a reading session in one statement: the book lookup, the session and its "book+session" link,
+# the daily rollup, the distinct-reader sketch and the reader's followers' feeds. Returns the book_id,
+# or no row if the title is unknown.
+READ_BOOK = """
+WITH b AS (
+    SELECT book_id FROM book WHERE title = %(title)s LIMIT 1
+), s AS (
+    INSERT INTO reading_session (session_id, user_id, book_id, start_time, end_time, pages_read)
+    SELECT (SELECT COALESCE(MAX(session_id), 0) + 1 FROM reading_session),
+           %(user_id)s, b.book_id, %(start_time)s, %(end_time)s, %(pages_read)s
+    FROM b
+    RETURNING session_id, user_id, book_id, start_time, end_time, pages_read
+), link AS (
+    INSERT INTO "book+session" (book_id, session_id) SELECT book_id, session_id FROM s
+), daily AS ({daily}), sketch AS ({sketch}), {feed}
+SELECT book_id FROM s
+""".format(
+    daily=reading_rollup.UPSERT.format(rows="""
+    SELECT user_id, book_id, start_time::DATE, pages_read,
+           FLOOR(EXTRACT(EPOCH FROM end_time - start_time) / 60)::INTEGER, 1
+    FROM s"""),
+    sketch=reader_sketch.UPSERT_READERS.format(source="(SELECT book_id, start_time::DATE AS day, user_id FROM s) AS readers"),
+    feed=activity_feed.FAN_OUT.format(
+        source="(SELECT user_id AS actor_id, 'read' AS kind, book_id, pages_read AS detail, start_time AS created_at FROM s)"
+    ),
+)
+
+# Seconds between SSH keepalive packets on the tunnel
+KEEPALIVE_SECONDS = 15
+
+# TCP keepalives on the database connection, so a dead peer is noticed instead of hanging
+DATABASE_KEEPALIVES = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+}
+
+# A connection idle for longer than this is pinged before its next use
+HEALTH_CHECK_IDLE_SECONDS = 60
+
+# How many times reconnect() tries, and the cap on the doubling delay between tries
+RECONNECT_ATTEMPTS = 6
+RECONNECT_MAX_DELAY = 8
+
+# How long reads stay on the primary after the replica failed before it is tried again
+REPLICA_RETRY_SECONDS = 30
+
+# Threads, each with its own connection, that run prefetch() queries
+PREFETCH_WORKERS = 3
+
+# Public plumbing that would only add a duplicate span around every traced method
+TRACE_EXCLUDED = ("run_with_reconnect", "ensure_connected", "connection_lost", "enable_tracing", "disable_tracing")
+
+def _lsn_value(lsn):
+    # A pg_lsn such as "16/B374D848" as one comparable number
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+class ReplicaState:
+    """
+    Read-your-writes bookkeeping for a read replica, shared by every connection serving one session
+    (see worker_connection), so a write made on any of them keeps all of them reading from the
+    primary until the replica has replayed it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.unreplicated_write = False
+        self.lsn = None  # The primary position the replica must reach, None once it has
+
+    def mark_write(self):
+        self.unreplicated_write = True
+
+    def take_write(self):
+        """
+        Returns:
+            bool: Whether a write was made since the last call, clearing the flag.
+        """
+        with self.lock:
+            written, self.unreplicated_write = self.unreplicated_write, False
+            return written
+
+    def require(self, lsn):
+        """
+        Raises the position the replica must reach to lsn, unless it already is at least that.
+        """
+        with self.lock:
+            if self.lsn is None or _lsn_value(lsn) > _lsn_value(self.lsn):
+                self.lsn = lsn
+
+    def reached(self, lsn):
+        """
+        Clears the required position if the replica has replayed up to lsn and nothing later is required.
+        """
+        with self.lock:
+            if self.lsn == lsn:
+                self.lsn = None
+
+class RetryError(ConnectionError):
+    """
+    Raised when the connection dropped during a write. The connection has been re-established but the
+    write's transaction was lost, so the command did not happen and can be retried.
+    """
 
 class Connection:
-    def __init__(self, ssh_username, ssh_password):
+    def __init__(self, ssh_username, ssh_password, replica_address=None):
         """
         Initializes the Connection object with SSH tunnel and database connection.
 
         Parameters:
             ssh_username (str): SSH username for connecting to the remote server.
             ssh_password (str): SSH password for connecting to the remote server.
+            replica_address (tuple): (host, port) of a read replica as seen from the SSH server.
+                                     If given, it is tunneled too and read-only methods are routed to it.
 
         Raises:
             ConnectionError: If there is an error while connecting using SSH.
@@ -20,10 +173,11 @@ class Connection:
                 ('starbug.cs.rit.edu', 22),
                 ssh_username = ssh_username,
                 ssh_password = ssh_password,
-                remote_bind_address = ('127.0.0.1', 5432),
+                remote_bind_addresses = [('127.0.0.1', 5432)] + ([replica_address] if replica_address else []),
                 allow_agent = False,
                 ssh_config_file = None,
                 ssh_pkey = None,
+                set_keepalive = KEEPALIVE_SECONDS,
             )
             self.server.start()
         except BaseSSHTunnelForwarderError as e:
@@ -34,19 +188,293 @@ class Connection:
             'user' : ssh_username,
             'password' : ssh_password,
             'host' : '127.0.0.1',
-            'port' : self.server.local_bind_port,
+            'port' : self.server.local_bind_ports[0],
+            **DATABASE_KEEPALIVES,
         }
-        self.connection = psycopg2.connect(**parameters)
+        replica = None
+        if replica_address:
+            replica = dict(parameters, port=self.server.local_bind_ports[1])
+        self._connect(parameters, replica)
+
+    @classmethod
+    def direct(cls, replica=None, **parameters):
+        """
+        Connects straight to a database without an SSH tunnel, e.g. a local Postgres for testing
+        and benchmarks.
+
+        Parameters:
+            replica (dict): psycopg2.connect keyword arguments for a read replica, if any.
+            parameters: psycopg2.connect keyword arguments (database, user, password, host, port).
+
+        Returns:
+            Connection: The connected object.
+        """
+        self = cls.__new__(cls)
+        self.server = None
+        self._connect(parameters, replica)
+        return self
+
+    def _connect(self, parameters, replica=None):
+        """
+        Opens the database connection and initializes the per-connection state.
+        """
+        self.parameters = parameters
+        self.prepared = {}
+        self.explain_capture = None
+        self.tracer = None
+        self._open_database()
+        self.replica_parameters = replica
+        self.replica_connection = None
+        self.replica_retry_at = 0
+        self.replica_state = ReplicaState()
+        if replica is not None:
+            self._open_replica()
+        self.follow_graph = None
+        self.title_index = None
+        self.trending = TrendingEngine()
+        self.group_commits = False
+        self.group_failed = False
+        self.write_behind = None
+        self.result_cache = None
+        self.prefetch_pool = None
+        self.prefetch_connections = []
+        self.prefetch_local = threading.local()
+
+    def _open_database(self):
+        """
+        Opens the database connection and its cursors, and re-creates the prepared statements.
+        """
+        self.connection = psycopg2.connect(**self.parameters)
+        self.connection.cursor_factory = self._cursor_factory()
         self.cursor = self.connection.cursor()
         self.collectioncursor = self.connection.cursor()
+        for statement in self.prepared.values():
+            self.cursor.execute(statement)
+        self.connection.commit()
+        self.last_used = time.monotonic()
+
+    def prepare(self, name, statement):
+        """
+        Creates a server-side prepared statement that is re-created whenever the connection is re-established.
+
+        Parameters:
+            name (str): The statement name, used with EXECUTE.
+            statement (str): The statement body, with $1, $2, ... placeholders.
+        """
+        self.prepared[name] = f"PREPARE {name} AS {statement}"
+        self.cursor.execute(self.prepared[name])
+
+    def connection_lost(self):
+        """
+        Returns:
+            bool: Whether the SSH tunnel or the database connection is known to be down.
+        """
+        return self.connection.closed != 0 or (self.server is not None and not self.server.is_active)
+
+    def ensure_connected(self):
+        """
+        Health check run before each database method: reconnects if the tunnel or connection is down,
+        and pings the database first if the connection has been idle for a while.
+        """
+        if not self.connection_lost() and time.monotonic() - self.last_used > HEALTH_CHECK_IDLE_SECONDS:
+            try:
+                with psycopg2.extensions.cursor(self.connection) as cursor:
+                    cursor.execute('SELECT 1')
+            except psycopg2.Error:
+                pass
+        if self.connection_lost():
+            self.reconnect()
+
+    def reconnect(self):
+        """
+        Re-establishes the SSH tunnel (if any) and the database connection, retrying with exponential backoff.
+        The in-memory state (follow graph, title index, result cache) is kept. An open transaction is
+        lost, so a grouped_commits() block in progress is marked as failed.
+
+        Raises:
+            ConnectionError: If every attempt fails.
+        """
+        if self.group_commits:
+            self.group_failed = True
+        try:
+            self.connection.close()
+        except psycopg2.Error:
+            pass
+        delay = 0.5
+        for attempt in range(RECONNECT_ATTEMPTS):
+            try:
+                if self.server is not None:
+                    self.server.restart()
+                    self.parameters['port'] = self.server.local_bind_ports[0]
+                    if self.replica_parameters is not None:
+                        self.replica_parameters['port'] = self.server.local_bind_ports[1]
+                self._open_database()
+                return
+            except (BaseSSHTunnelForwarderError, psycopg2.OperationalError) as e:
+                print(f"Reconnect attempt {attempt + 1} failed: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        raise ConnectionError("Could not re-establish the database connection.")
+
+    def run_with_reconnect(self, method, args, kwargs, retry):
+        """
+        Calls a database method after a health check. If the connection drops during the call it is
+        re-established; read-only methods (retry=True) are then run again, outside grouped_commits()
+        where the transaction they belonged to is gone. Used by the reads and writes decorators.
+
+        Read-only methods go to the replica when one is configured and has caught up with this
+        session's writes; if the replica fails they fall back to the primary.
+
+        Raises:
+            RetryError: If the connection dropped during a write, or inside grouped_commits(); it is
+                        reconnected but the transaction is lost.
+        """
+        read_only = retry
+        if not read_only:
+            # Reads stay on the primary until the replica has replayed this write
+            self.replica_state.mark_write()
+        if read_only and not self.group_commits and self._replica_ready():
+            try:
+                value = self._run_on_replica(method, args, kwargs)
+                if value is not None or self.replica_connection.closed == 0:
+                    return value
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                if self.replica_connection.closed == 0:
+                    raise
+            self._drop_replica()
+        self.ensure_connected()
+        retry = retry and not self.group_commits
+        try:
+            value = method(self, *args, **kwargs)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if not self.connection_lost():
+                raise
+            self.reconnect()
+            if not retry:
+                raise RetryError("The connection to the database was lost and has been re-established, "
+                                 "but the command did not complete. Please try it again.") from e
+            value = method(self, *args, **kwargs)
+        else:
+            # Most methods report errors by printing them and returning None
+            if self.connection_lost():
+                self.reconnect()
+                if retry and value is None:
+                    value = method(self, *args, **kwargs)
+        finally:
+            if not read_only:
+                # Again once the write has committed, in case another connection of this session took the
+                # primary's position while it was still running
+                self.replica_state.mark_write()
+        self.last_used = time.monotonic()
+        return value
+
+    def _open_replica(self):
+        try:
+            self.replica_connection = psycopg2.connect(**self.replica_parameters)
+        except psycopg2.OperationalError as e:
+            print(f"Could not connect to the read replica, reading from the primary: {e}")
+            self._drop_replica()
+            return
+        self.replica_connection.set_session(readonly=True)
+        self.replica_connection.cursor_factory = self._cursor_factory()
+        self.replica_cursor = self.replica_connection.cursor()
+        self.replica_collectioncursor = self.replica_connection.cursor()
+
+    def _drop_replica(self):
+        """
+        Stops routing reads to the replica for REPLICA_RETRY_SECONDS after it failed.
+        """
+        if self.replica_connection is not None:
+            try:
+                self.replica_connection.close()
+            except psycopg2.Error:
+                pass
+        self.replica_connection = None
+        self.replica_retry_at = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def _replica_ready(self):
+        """
+        Returns:
+            bool: Whether the next read can go to the replica: one is configured and reachable, and it has
+                  replayed every write this session made (read-your-writes).
+        """
+        if self.replica_parameters is None:
+            return False
+        if self.replica_connection is None or self.replica_connection.closed:
+            if time.monotonic() < self.replica_retry_at:
+                return False
+            self._open_replica()
+            if self.replica_connection is None:
+                return False
+        state = self.replica_state
+        if not state.unreplicated_write and state.lsn is None:
+            return True
+        written = state.take_write()
+        try:
+            if written:
+                # The primary's current position covers every write this session has committed
+                with psycopg2.extensions.cursor(self.connection) as cursor:
+                    cursor.execute('SELECT pg_current_wal_lsn()')
+                    state.require(cursor.fetchone()[0])
+            lsn = state.lsn
+            if lsn is None:
+                return True
+            with psycopg2.extensions.cursor(self.replica_connection) as cursor:
+                # Not being in recovery means the "replica" is a standalone server, which is always current
+                cursor.execute('SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn', (lsn,))
+                caught_up = cursor.fetchone()[0]
+        except psycopg2.Error:
+            if written:
+                state.mark_write()
+            return False
+        if caught_up:
+            state.reached(lsn)
+        return caught_up
+
+    def _run_on_replica(self, method, args, kwargs):
+        """
+        Runs a read-only method with the connection and cursors swapped for the replica's.
+        """
+        primary = (self.connection, self.cursor, self.collectioncursor)
+        self.connection, self.cursor, self.collectioncursor = (
+            self.replica_connection, self.replica_cursor, self.replica_collectioncursor
+        )
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.connection, self.cursor, self.collectioncursor = primary
+            # End the read's transaction so it does not hold back replay on the replica
+            if not self.replica_connection.closed:
+                self.replica_connection.rollback()
+
+    def open_connection(self):
+        """
+        Opens an additional database connection through the same SSH tunnel, for work that runs
+        outside this object's transaction (background threads, worker pools).
+
+        Returns:
+            connection: A new psycopg2 connection.
+        """
+        return psycopg2.connect(**self.parameters)
 
     def close(self):
         """
         Closes the database connection and SSH tunnel.
         """
+        if self.write_behind is not None:
+            self.write_behind.close()
+        if self.prefetch_pool is not None:
+            self.prefetch_pool.shutdown(wait=True)
+            for worker in self.prefetch_connections:
+                worker.close()
+        if self.trending.pending and not self.connection.closed:
+            self._save_trending()
         self.cursor.close()
         self.connection.close()
-        self.server.stop()
+        if self.replica_connection is not None:
+            self.replica_connection.close()
+        if self.server is not None:
+            self.server.stop()
         
     def __exit__(self):
         """
@@ -54,6 +482,256 @@ class Connection:
         """
         self.close()
 
+    def commit(self):
+        """
+        Commits the current transaction, unless commits are being grouped by grouped_commits().
+        """
+        if not self.group_commits:
+            self.connection.commit()
+
+    def rollback(self):
+        """
+        Rolls back the current transaction. Inside grouped_commits() this discards the whole group,
+        so the group is flagged as failed. Does nothing if the connection is closed: the server has
+        already discarded the transaction, and the next call reconnects.
+        """
+        if self.group_commits:
+            self.group_failed = True
+        if self.connection.closed:
+            return
+        self.connection.rollback()
+
+    @contextmanager
+    def grouped_commits(self):
+        """
+        Runs several methods in one transaction: their individual commits are skipped and a single
+        commit is issued on exit. If any of them rolls back or raises, the whole group is rolled back
+        and group_failed is left set so the caller can tell.
+        """
+        self.group_commits = True
+        self.group_failed = False
+        try:
+            yield self
+            if self.group_failed:
+                self.connection.rollback()
+            else:
+                self.connection.commit()
+        except Exception:
+            self.group_failed = True
+            self.connection.rollback()
+            raise
+        finally:
+            self.group_commits = False
+
+    def find_user(self, username, password=None):
+        """
+        Looks up a user by username without logging them in.
+
+        Parameters:
+            username (str): User's username.
+            password (str): User's hashed password, checked if given.
+
+        Returns:
+            tuple: User ID if the user exists (and the password matches), None otherwise.
+        """
+        if password is None:
+            self.cursor.execute('SELECT user_id FROM "users" WHERE username=%s', (username,))
+        else:
+            self.cursor.execute('SELECT user_id FROM "users" WHERE username=%s AND password=%s', (username, password))
+        return self.cursor.fetchone()
+
+    def enable_result_cache(self, max_entries=1024, default_ttl=None, ttls=None):
+        """
+        Caches the results of read-only methods until a write touches a table they read.
+        See result_cache.ResultCache for the options.
+        """
+        self.result_cache = ResultCache(max_entries=max_entries, default_ttl=default_ttl, ttls=ttls)
+
+    def worker_connection(self):
+        """
+        Opens another Connection through this one's tunnel (and replica) that shares its result cache,
+        trending scores and replica bookkeeping, for threads serving the same session in parallel. A write
+        on any of them keeps all of them off the replica until it has been replayed, so a stale replica
+        read cannot reach the shared cache. Closing it leaves the tunnel open.
+
+        Returns:
+            Connection: The new connection.
+        """
+        worker = Connection.direct(replica=self.replica_parameters, **self.parameters)
+        # The same dicts, so a reconnect picks up the ports of a restarted tunnel
+        worker.parameters = self.parameters
+        worker.replica_parameters = self.replica_parameters
+        worker.result_cache = self.result_cache
+        worker.trending = self.trending
+        worker.replica_state = self.replica_state
+        return worker
+
+    def prefetch(self, calls):
+        """
+        Runs read-only methods in the background, each on one of PREFETCH_WORKERS extra connections,
+        and stores their results in the result cache. A call to one of them while its prefetch is still
+        running waits for it instead of querying again. Does nothing unless the result cache is enabled.
+
+        Parameters:
+            calls (list of tuples): (method name, positional arguments) of @reads methods, with the
+                                    arguments exactly as the later calls will pass them.
+        """
+        if self.result_cache is None:
+            return
+        if self.prefetch_pool is None:
+            self.prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        for name, args in calls:
+            key = cache_key(name, tuple(args), {})
+            self.result_cache.expect(key, self.prefetch_pool.submit(self._prefetch_one, name, tuple(args), key))
+
+    def _prefetch_one(self, name, args, key):
+        worker = getattr(self.prefetch_local, "connection", None)
+        if worker is None:
+            worker = self.worker_connection()
+            self.prefetch_local.connection = worker
+            self.prefetch_connections.append(worker)
+        method = getattr(Connection, name)
+        since = self.result_cache.version()
+        # The undecorated method, since the decorated one would wait for this very prefetch
+        value = worker.run_with_reconnect(method.__wrapped__, args, {}, retry=True)
+        if value is not None:
+            self.result_cache.put(key, value, method.reads_tables, method.reads_ttl, since=since)
+
+    def invalidate_tables(self, tables):
+        """
+        Drops cached results that read any of the given tables. Used for writes made outside
+        this object's methods, such as the write-behind worker's batches.
+
+        Parameters:
+            tables (iterable of str): The tables that were written.
+        """
+        if self.result_cache is not None:
+            self.result_cache.invalidate(tables)
+
+    def _cursor_factory(self):
+        """
+        Returns:
+            type: The cursor class for the enabled diagnostics; tracing wraps explain capture when both are on.
+        """
+        factory = psycopg2.extensions.cursor if self.explain_capture is None else self.explain_capture.cursor_factory
+        if self.tracer is not None:
+            factory = self.tracer.cursor_factory(factory)
+        return factory
+
+    def _reopen_cursors(self):
+        cursor_factory = self._cursor_factory()
+        self.cursor.close()
+        self.collectioncursor.close()
+        self.connection.cursor_factory = cursor_factory
+        self.cursor = self.connection.cursor()
+        self.collectioncursor = self.connection.cursor()
+        if self.replica_connection is not None:
+            self.replica_connection.cursor_factory = cursor_factory
+            self.replica_cursor = self.replica_connection.cursor()
+            self.replica_collectioncursor = self.replica_connection.cursor()
+
+    def enable_explain(self):
+        """
+        Starts capturing an EXPLAIN (ANALYZE, BUFFERS) plan for every statement this connection runs.
+        Cached results are dropped so the next calls reach the database. See explain_capture.ExplainCapture.
+
+        Returns:
+            ExplainCapture: The capture collecting the plans.
+        """
+        self.explain_capture = ExplainCapture(Connection)
+        self._reopen_cursors()
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        return self.explain_capture
+
+    def disable_explain(self):
+        """
+        Stops capturing plans.
+
+        Returns:
+            ExplainCapture: The capture with the plans collected while it was enabled.
+        """
+        capture = self.explain_capture
+        self.explain_capture = None
+        self._reopen_cursors()
+        return capture
+
+    def enable_tracing(self, tracer=None):
+        """
+        Starts recording a span for every public method call and statement on this connection.
+        See tracing.Tracer.
+
+        Parameters:
+            tracer (Tracer): The tracer to record into, e.g. one shared by several connections.
+
+        Returns:
+            Tracer: The tracer recording the spans.
+        """
+        self.tracer = tracer or Tracer()
+        self._reopen_cursors()
+        self.tracer.instrument(self, "Connection", exclude=TRACE_EXCLUDED)
+        return self.tracer
+
+    def disable_tracing(self):
+        """
+        Stops recording spans.
+
+        Returns:
+            Tracer: The tracer with the spans recorded while it was enabled.
+        """
+        tracer = self.tracer
+        tracer.uninstrument(self)
+        self.tracer = None
+        self._reopen_cursors()
+        return tracer
+
+    def enable_write_behind(self, **options):
+        """
+        Routes read_book and rate_a_book through a WriteBehindQueue, which writes them in batches
+        on its own connection instead of committing each one synchronously.
+
+        Parameters:
+            options: Passed to WriteBehindQueue (max_size, batch_size, flush_interval, spool_path, block, put_timeout).
+        """
+        self.write_behind = WriteBehindQueue(self.open_connection, on_flush=self.invalidate_tables,
+                                             trending_engine=self.trending, **options)
+
+    def load_follow_graph(self):
+        """
+        Loads the "following" table into an in-memory FollowGraph. Once loaded, follower counts and
+        follower sets are served from it and follow/unfollow keep it current.
+
+        Returns:
+            dict: The graph's memory report in bytes.
+        """
+        self.follow_graph = FollowGraph.load(self.connection)
+        return self.follow_graph.memory_report()
+
+    def complete_names(self, prefix, k=10, kind=None):
+        """
+        Autocompletes book titles and contributor names. The prefix index is loaded on first use
+        and picks up new books and contributors once it is older than title_index.REFRESH_SECONDS.
+
+        Parameters:
+            prefix (str): What the user has typed so far.
+            k (int): The maximum number of completions.
+            kind (str): "title" or "contributor" to restrict the matches, None for both.
+
+        Returns:
+            list of str: Up to k matching names, in alphabetical order.
+        """
+        try:
+            if self.title_index is None:
+                self.title_index = PrefixIndex.load(self.cursor)
+            elif self.title_index.is_stale():
+                self.title_index.refresh(self.cursor)
+        except Exception as e:
+            print(f"An error occurred while loading the title index: {e}")
+            self.rollback()
+            return []
+        return self.title_index.complete(prefix, k=k, kind=kind)
+
+    @writes("users", "user_email")
     def join(self, username, email, password, firstname, lastname):
         """
         Registers a new user and adds their information to the "Users" table.
@@ -70,38 +748,29 @@ class Connection:
         """
         formatted_date_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        # Check if the username already exists
-        self.cursor.execute('SELECT user_id FROM "users" WHERE username=%s', (username,))
-        user_id = self.cursor.fetchone()
-        if user_id:
-            return None  # User already exists
-
-        # Get the next user_id by finding the current max user_id
-        self.cursor.execute('SELECT MAX(user_id) FROM users')
-        max_user_id = self.cursor.fetchone()[0]
-        user_id = 1 if max_user_id is None else max_user_id + 1
-
-        # Insert into the users table
-        print("Inserting into users table")
+        # One statement: the username check, the next user_id, and both inserts
         self.cursor.execute(
-            'INSERT INTO "users" (username, user_id, password, first_name, last_name, creation_date, last_access_date) VALUES (%s, %s, %s, %s, %s, %s, %s)',
-            (username, user_id, password, firstname, lastname, formatted_date_time, formatted_date_time)
-        )
-
-        # Insert into the user_email table
-        print("Inserting into user email table")
-        self.cursor.execute(
-            'INSERT INTO "user_email" (user_id, email) VALUES (%s, %s)',
-            (user_id, email)
+            """
+            WITH new_user AS (
+                INSERT INTO users (user_id, username, password, first_name, last_name, creation_date, last_access_date)
+                SELECT COALESCE(MAX(user_id), 0) + 1, %(username)s, %(password)s, %(first_name)s, %(last_name)s,
+                       %(now)s, %(now)s
+                FROM users
+                HAVING NOT EXISTS (SELECT 1 FROM users WHERE username = %(username)s)
+                RETURNING user_id
+            ), new_email AS (
+                INSERT INTO user_email (user_id, email) SELECT user_id, %(email)s FROM new_user
+            )
+            SELECT user_id FROM new_user
+            """,
+            {"username": username, "password": password, "first_name": firstname, "last_name": lastname,
+             "email": email, "now": formatted_date_time}
         )
+        user_id = self.cursor.fetchone()  # None if the username is taken
+        self.commit()
+        return user_id
 
-        # Commit the transaction
-        self.connection.commit()
-
-        # Retrieve and return the newly created user_id
-        self.cursor.execute('SELECT user_id FROM "users" WHERE username=%s', (username,))
-        return self.cursor.fetchone()
-
+    @writes("users")
     def login(self, username, password):
         """
         Logs in a user and updates their last access date.
@@ -114,12 +783,15 @@ class Connection:
             tuple: User ID if login is successful, None if login fails.
         """
         formatted_date_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.cursor.execute('SELECT user_id FROM "users" WHERE username=%s AND password=%s', (username, password))
+        self.cursor.execute(
+            'UPDATE "users" SET last_access_date=%s WHERE username=%s AND password=%s RETURNING user_id',
+            (formatted_date_time, username, password)
+        )
         user_id = self.cursor.fetchone()
-        self.cursor.execute('UPDATE "users" SET last_access_date=%s WHERE user_id=%s', (formatted_date_time, user_id))
-        self.connection.commit()
+        self.commit()
         return user_id
     
+    @writes("collection")
     def create_collection(self, user_id, name):
         """
         Creates a new collection for a user into the "Collection" table.
@@ -128,14 +800,15 @@ class Connection:
             user_id (int): User's ID.
             name (str): Name of the collection.
         """
-        # Get the next user_id by finding the current max user_id
-        self.cursor.execute('SELECT MAX(collection_id) FROM collection')
-        max_collection_id = self.cursor.fetchone()[0]
-        collection_id = 1 if max_collection_id is None else max_collection_id + 1
-        self.cursor.execute('INSERT INTO "collection" (collection_id, name, user_id) VALUES (%s, %s, %s)', (collection_id, name, user_id))
-        self.connection.commit()
+        self.cursor.execute(
+            'INSERT INTO "collection" (collection_id, name, user_id) '
+            'SELECT COALESCE(MAX(collection_id), 0) + 1, %s, %s FROM collection',
+            (name, user_id)
+        )
+        self.commit()
         return
         
+    @writes("collection", "part_of")
     def delete_collection(self, user_id, name):
         """
         Deletes a user's collection.
@@ -147,17 +820,27 @@ class Connection:
         Raises:
             FileNotFoundError: If the collection does not exist.
         """
-        self.cursor.execute('SELECT * FROM "collection" WHERE user_id=%s AND name=%s', (user_id, name))
-        result = self.cursor.fetchone()
-        if result is None:
+        # Lock the collection row so no concurrent add or remove touches its summary mid-delete,
+        # then delete its books and itself in the same statement
+        self.cursor.execute(
+            """
+            WITH target AS (
+                SELECT collection_id FROM "collection" WHERE user_id=%s AND name=%s FOR UPDATE
+            ), books AS (
+                DELETE FROM part_of WHERE collection_id IN (SELECT collection_id FROM target)
+            )
+            DELETE FROM "collection" WHERE collection_id IN (SELECT collection_id FROM target)
+            RETURNING collection_id
+            """,
+            (user_id, name)
+        )
+        if self.cursor.fetchone() is None:
+            self.rollback()
             raise FileNotFoundError
-        self.cursor.execute('SELECT collection_id FROM "collection" WHERE user_id=%s AND name=%s', (user_id, name))
-        collection_id = self.cursor.fetchone()
-        self.cursor.execute('DELETE FROM part_of WHERE collection_id=%s', collection_id)
-        self.cursor.execute('DELETE FROM "collection" WHERE user_id=%s AND name=%s', (user_id, name))
-        self.connection.commit()
+        self.commit()
         return
     
+    @writes("collection")
     def modify_collection_name(self, user_id, old_name, new_name):
         """
         Renames the name of a user's collection.
@@ -175,9 +858,10 @@ class Connection:
         if result is None:
             raise FileNotFoundError
         self.cursor.execute('UPDATE "collection" SET name=%s WHERE user_id=%s AND name=%s', (new_name, user_id, old_name))
-        self.connection.commit()
+        self.commit()
         return
     
+    @writes("collection", "part_of")
     def add_book_to_collection(self, user_id, book_name, collection_name):
         """
         Adds a book to a user's collection.
@@ -186,18 +870,42 @@ class Connection:
             user_id (int): User's ID.
             book_name (str): Title of the book to be added.
             collection_name (str): Name of the collection to add the book to.
+
+        Returns:
+            bool: False if the book or the collection does not exist.
         """
         self.cursor.execute('SELECT book_id FROM "book" WHERE title=%s', [book_name])
         book_id = self.cursor.fetchone()
+        if book_id is None:
+            return False
         book_id = str(book_id[0])
         self.cursor.execute('SELECT collection_id FROM "collection" WHERE name=%s AND user_id=%s', (collection_name, user_id))
         collection_id = self.cursor.fetchone()
         if collection_id is None:
             return False
-        self.cursor.execute('INSERT INTO part_of (book_id, collection_id) VALUES (%s, %s)', (book_id, collection_id))
-        self.connection.commit()
+        # Insert the book and bump the collection's summary in the same statement
+        self.cursor.execute(
+            """
+            WITH added AS (
+                INSERT INTO part_of (book_id, collection_id) VALUES (%s, %s)
+                RETURNING book_id, collection_id
+            )
+            UPDATE "collection" c
+            SET book_count = c.book_count + a.books, page_total = c.page_total + a.pages
+            FROM (
+                SELECT added.collection_id, COUNT(*) AS books, COALESCE(SUM(b.length), 0) AS pages
+                FROM added
+                LEFT JOIN "book" b ON added.book_id = b.book_id
+                GROUP BY added.collection_id
+            ) a
+            WHERE c.collection_id = a.collection_id
+            """,
+            (book_id, collection_id)
+        )
+        self.commit()
         return True
     
+    @writes("collection", "part_of")
     def remove_book_from_collection(self, user_id, book_name, collection_name):
         """
         Removes a book from a user's collection.
@@ -206,16 +914,42 @@ class Connection:
             user_id (int): User's ID.
             book_name (str): Title of the book to be removed from the collection.
             collection_name (str): Name of the collection from which to remove the book.
+
+        Returns:
+            bool: False if the book or the collection does not exist.
         """
         self.cursor.execute('SELECT book_id FROM "book" WHERE title=%s', [book_name])
         book_id = self.cursor.fetchone()
+        if book_id is None:
+            return False
         book_id = str(book_id[0])
         self.cursor.execute('SELECT collection_id FROM "collection" WHERE name=%s AND user_id=%s', (collection_name, user_id))
         collection_id = self.cursor.fetchone()
-        self.cursor.execute('DELETE FROM part_of WHERE book_id=%s AND collection_id=%s', (book_id, collection_id))
-        self.connection.commit()
-        return
+        if collection_id is None:
+            return False
+        # Delete the book and lower the collection's summary in the same statement
+        self.cursor.execute(
+            """
+            WITH removed AS (
+                DELETE FROM part_of WHERE book_id=%s AND collection_id=%s
+                RETURNING book_id, collection_id
+            )
+            UPDATE "collection" c
+            SET book_count = c.book_count - r.books, page_total = c.page_total - r.pages
+            FROM (
+                SELECT removed.collection_id, COUNT(*) AS books, COALESCE(SUM(b.length), 0) AS pages
+                FROM removed
+                LEFT JOIN "book" b ON removed.book_id = b.book_id
+                GROUP BY removed.collection_id
+            ) r
+            WHERE c.collection_id = r.collection_id
+            """,
+            (book_id, collection_id)
+        )
+        self.commit()
+        return True
     
+    @reads("collection")
     def get_collections(self, user_id):
         """
         Gets a list of collections for a user.
@@ -227,28 +961,40 @@ class Connection:
             list of tuples: A list of collections with their names, book counts, and total page counts.
         """
         uid = user_id[0]
-        collection_sql_stmnt = f"""
+        # Book counts and page totals are maintained by add_book_to_collection and remove_book_from_collection
+        collection_sql_stmnt = """
             SELECT
                 c.name AS "Collection Name",
-                COUNT(p.book_id) AS "Number of Books",
-                SUM(b.length) AS "Length (Pages)"
+                c.book_count AS "Number of Books",
+                c.page_total AS "Length (Pages)"
             FROM
                 "collection" c
-            LEFT JOIN
-                part_of p ON c.collection_id = p.collection_id
-            LEFT JOIN
-                "book" b ON p.book_id = b.book_id
             WHERE
-                c.user_id = {uid}
-            GROUP BY
-                c.collection_id, c.name
+                c.user_id = %s
             ORDER BY
                 c.name;
         """
         
-        self.cursor.execute(collection_sql_stmnt)
+        self.cursor.execute(collection_sql_stmnt, (uid,))
         return self.cursor.fetchall()
 
+    @writes("collection")
+    def check_collection_summaries(self, fix=False):
+        """
+        Verifies the stored book counts and page totals of every collection.
+
+        Parameters:
+            fix (bool): Whether to repair the collections whose summaries are wrong.
+
+        Returns:
+            list of tuples: (collection_id, book_count, actual_count, page_total, actual_pages) for each
+            mismatched collection.
+        """
+        mismatches = collection_summary.check_consistency(self.cursor, fix=fix)
+        self.commit()
+        return mismatches
+
+    @reads("collection")
     def collection_info(self, user_id):
         """
         Retrieves the count of collections created by a specified user.
@@ -276,9 +1022,10 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving collection info: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    @writes("rating", "book", "activity", "feed_item")
     def rate_a_book(self, user_id, book_name, rating):
         """
         Rates a book by adding their rating to the "rates" table.
@@ -287,14 +1034,26 @@ class Connection:
             user_id (int): User's ID.
             book_name (str): Title of the book to rate.
             rating (int): User's rating for the book.
+
+        Raises:
+            QueueFullError: If write-behind is enabled and its queue is full.
         """
+        if self.write_behind is not None:
+            self.write_behind.rate_a_book(user_id, book_name, rating)
+            return
         self.cursor.execute('SELECT book_id FROM "book" WHERE title=%s', [book_name])
         book_id = self.cursor.fetchone()
-        book_id = str(book_id[0])
-        self.cursor.execute('INSERT INTO rating (book_id, user_id, stars) VALUES (%s, %s, %s)', (book_id, user_id, str(rating)))
-        self.connection.commit()
+        if book_id is None:
+            print(f"Error: Book '{book_name}' not found in the database.")
+            return False
+        rated_at = datetime.datetime.now()
+        book_ratings.record_ratings(self.cursor, [(book_id[0], user_key(user_id), int(rating), rated_at)])
+        activity_feed.record_activity(self.cursor, [(user_id, "rate", book_id[0], int(rating), rated_at)])
+        self.commit()
+        self._record_trending(book_id[0], trending.STAR_WEIGHT * int(rating), rated_at)
         return
 
+    @reads("rating", "book")
     def top_rated_books(self, user_id):
         """
         Retrieves the top 10 books rated by a specific user, ordered by rating and title.
@@ -325,9 +1084,10 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving top rated books: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    @writes("reading_session", "book+session", "reading_daily", "book_reader_sketch", "activity", "feed_item")
     def read_book(self, user_id, book_name, start_time, end_time, start_page, end_page):
         """
         Records a user's reading session by adding an entry to the "Session" table and associating the book with the session in the "has" table.
@@ -339,52 +1099,29 @@ class Connection:
             end_time (str): End time of the reading session.
             start_page (int): The starting page number.
             end_page (int): The ending page number.
-        """
-        # Get the next session_id
-        self.cursor.execute('SELECT MAX(session_id) FROM reading_session')
-        max_session_id_result = self.cursor.fetchone()
-        max_session_id = max_session_id_result[0] if max_session_id_result and max_session_id_result[
-            0] is not None else 0
-        session_id = max_session_id + 1
 
-        # Calculate pages read
-        Pages_read = end_page - start_page
-
-        # Get the book_id for the specified book name
-        self.cursor.execute('SELECT book_id FROM "book" WHERE title=%s', (book_name,))
-        book_id_result = self.cursor.fetchone()
-        if not book_id_result:
-            print(f"Error: Book '{book_name}' not found in the database.")
+        Raises:
+            QueueFullError: If write-behind is enabled and its queue is full.
+        """
+        if self.write_behind is not None:
+            self.write_behind.read_book(user_id, book_name, start_time, end_time, start_page, end_page)
             return
-        book_id = book_id_result[0]
 
-        # Insert into reading_session table
-        self.cursor.execute(
-            'INSERT INTO reading_session (session_id, user_id, start_time, end_time, pages_read) VALUES (%s, %s, %s, %s, %s)',
-            (session_id, user_id, start_time, end_time, Pages_read)
-        )
-        self.connection.commit()
-
-        # Verify the session was created and fetch the session_id
-        self.cursor.execute(
-            'SELECT session_id FROM reading_session WHERE user_id=%s AND start_time=%s AND end_time=%s AND pages_read=%s',
-            (user_id, start_time, end_time, Pages_read)
-        )
-        session_id_result = self.cursor.fetchone()
-        if not session_id_result:
-            print("Error: Unable to retrieve session_id after insertion.")
+        self.cursor.execute(READ_BOOK, {
+            "title": book_name, "user_id": user_key(user_id), "start_time": start_time, "end_time": end_time,
+            "pages_read": end_page - start_page,
+        })
+        row = self.cursor.fetchone()
+        if row is None:
+            # Nothing was written
+            print(f"Error: Book '{book_name}' not found in the database.")
             return
-        session_id = session_id_result[0]
-
-        # Insert into book+session table (associative table for book and session relationship)
-        self.cursor.execute(
-            'INSERT INTO "book+session" (book_id, session_id) VALUES (%s, %s)',
-            (book_id, session_id)
-        )
-        self.connection.commit()
+        self.commit()
+        self._record_trending(row[0], trending.READ_WEIGHT, start_time)
 
         print(f"Book '{book_name}' has been read from page {start_page} to page {end_page}.")
 
+    @writes("following")
     def follow(self, follower_id, email):
         """
         Adds a new row to the following table, where the follower follows the user identified by email.
@@ -413,17 +1150,21 @@ class Connection:
                 'INSERT INTO following (follower, followee) VALUES (%s, %s)',
                 (follower_id, followee_id)
             )
+            suggestions.mark_dirty(self.cursor, follower_id)
 
             # Commit the transaction
-            self.connection.commit()
+            self.commit()
+            if self.follow_graph is not None:
+                self.follow_graph.add_edge(follower_id, followee_id)
             print(f"You are now following user with email {email}.")
             return True
 
         except Exception as e:
             print(f"An error occurred while trying to follow: {e}")
-            self.connection.rollback()  # Roll back in case of an error
+            self.rollback()  # Roll back in case of an error
             return False
 
+    @writes("following")
     def unfollow(self, follower_id, email):
         """
         Removes a row from the following table, where the follower stops following the user identified by email.
@@ -452,17 +1193,296 @@ class Connection:
                 'DELETE FROM following WHERE follower = %s AND followee = %s',
                 (follower_id, followee_id)
             )
+            suggestions.mark_dirty(self.cursor, follower_id)
 
             # Commit the transaction
-            self.connection.commit()
+            self.commit()
+            if self.follow_graph is not None:
+                self.follow_graph.remove_edge(follower_id, followee_id)
             print(f"You have unfollowed user with email {email}.")
             return True
 
         except Exception as e:
             print(f"An error occurred while trying to unfollow: {e}")
-            self.connection.rollback()  # Roll back in case of an error
+            self.rollback()  # Roll back in case of an error
             return False
 
+    def resolve_emails(self, emails):
+        """
+        Resolves a list of emails to user IDs with a single query.
+
+        Parameters:
+            emails (list of str): The emails to look up.
+
+        Returns:
+            tuple: (found, missing) where found maps email to user_id and missing is a list of emails
+            that did not match any user, in the order they were given.
+        """
+        emails = list(dict.fromkeys(emails))
+        self.cursor.execute('SELECT email, user_id FROM user_email WHERE email = ANY(%s)', (emails,))
+        found = dict(self.cursor.fetchall())
+        missing = [email for email in emails if email not in found]
+        return found, missing
+
+    @writes("following")
+    def follow_many(self, follower_id, emails):
+        """
+        Follows every user in a list of emails, resolving and inserting them in bulk.
+        Relationships that already exist are left untouched.
+
+        Parameters:
+            follower_id (int): The user_id of the person doing the following.
+            emails (list of str): The emails of the users to be followed.
+
+        Returns:
+            tuple: (number of users followed, list of emails that did not match any user),
+            or None if an error occurs.
+        """
+        try:
+            # Step 1: Resolve every email in one round trip
+            found, missing = self.resolve_emails(emails)
+            followee_ids = list(found.values())
+            followed = 0
+
+            # Step 2: Insert all relationships in a single statement
+            if followee_ids:
+                self.cursor.execute(
+                    '''
+                    INSERT INTO following (follower, followee)
+                    SELECT %s, followee FROM unnest(%s) AS followee
+                    ON CONFLICT DO NOTHING
+                    ''',
+                    (follower_id, followee_ids)
+                )
+                # Pairs that were already followed are skipped and not counted
+                followed = self.cursor.rowcount
+                suggestions.mark_dirty(self.cursor, follower_id)
+                self.commit()
+                if self.follow_graph is not None:
+                    for followee_id in followee_ids:
+                        self.follow_graph.add_edge(follower_id, followee_id)
+            return followed, missing
+
+        except Exception as e:
+            print(f"An error occurred while trying to follow in bulk: {e}")
+            self.rollback()
+            return None
+
+    @writes("following")
+    def unfollow_many(self, follower_id, emails):
+        """
+        Unfollows every user in a list of emails, resolving and deleting them in bulk.
+
+        Parameters:
+            follower_id (int): The user_id of the person doing the unfollowing.
+            emails (list of str): The emails of the users to be unfollowed.
+
+        Returns:
+            tuple: (number of users unfollowed, list of emails that did not match any user),
+            or None if an error occurs.
+        """
+        try:
+            # Step 1: Resolve every email in one round trip
+            found, missing = self.resolve_emails(emails)
+            followee_ids = list(found.values())
+            unfollowed = 0
+
+            # Step 2: Delete all relationships in a single statement
+            if followee_ids:
+                self.cursor.execute(
+                    'DELETE FROM following WHERE follower = %s AND followee = ANY(%s)',
+                    (follower_id, followee_ids)
+                )
+                unfollowed = self.cursor.rowcount
+                suggestions.mark_dirty(self.cursor, follower_id)
+                self.commit()
+                if self.follow_graph is not None:
+                    for followee_id in followee_ids:
+                        self.follow_graph.remove_edge(follower_id, followee_id)
+            return unfollowed, missing
+
+        except Exception as e:
+            print(f"An error occurred while trying to unfollow in bulk: {e}")
+            self.rollback()
+            return None
+
+    @reads("follow_suggestion", "users", "user_email")
+    def suggested_users(self, user_id):
+        """
+        Retrieves the precomputed "who to follow" suggestions for a user.
+
+        Parameters:
+            user_id (int): The ID of the user asking for suggestions.
+
+        Returns:
+            list of tuples: (username, email, mutual_count, shared_books) ordered by mutual follows,
+            or None if an error occurs.
+        """
+        try:
+            query = """
+                SELECT u.username, e.email, s.mutual_count, s.shared_books
+                FROM follow_suggestion s
+                JOIN users u ON s.suggested_user_id = u.user_id
+                LEFT JOIN LATERAL (
+                    SELECT email FROM user_email WHERE user_id = s.suggested_user_id LIMIT 1
+                ) e ON TRUE
+                WHERE s.user_id = %s
+                ORDER BY s.mutual_count DESC, s.shared_books DESC
+                LIMIT 10;
+            """
+            self.cursor.execute(query, (user_id,))
+            return self.cursor.fetchall()
+
+        except Exception as e:
+            print(f"An error occurred while retrieving suggestions: {e}")
+            self.rollback()
+            return None
+
+    @writes("follow_suggestion")
+    def refresh_suggestions(self, workers=None, full=False):
+        """
+        Runs the "who to follow" batch job. See suggestions.precompute_suggestions.
+
+        Parameters:
+            workers (int): Number of worker processes, defaults to the number of cores.
+            full (bool): Whether to recompute every user instead of only the changed ones.
+
+        Returns:
+            int: The number of users recomputed.
+        """
+        return suggestions.precompute_suggestions(self.connection, workers=workers, full=full)
+
+    @writes("book_recommendation", "recommendation_computed")
+    def refresh_recommendations(self, workers=None, active_days=30):
+        """
+        Runs the nightly recommendations job. See recommendations.precompute_recommendations.
+
+        Parameters:
+            workers (int): Number of worker processes, defaults to the number of cores.
+            active_days (int): Users who accessed the platform within this many days are recomputed.
+
+        Returns:
+            int: The number of users recomputed.
+        """
+        try:
+            return recommendations.precompute_recommendations(
+                self.connection, self.parameters, workers=workers, active_days=active_days
+            )
+        except psycopg2.Error:
+            self.rollback()
+            raise
+
+    @writes("book", "contributor", "genre", "audience", "writes", "publishes", "edits",
+            "classifies_as", "enjoys", "edition", "collection")
+    def load_catalog(self, path, workers=None):
+        """
+        Bulk-loads a catalog dump through the tunnel. See catalog_loader.load_catalog.
+
+        Parameters:
+            path (str): The CSV or JSONL dump.
+            workers (int): Number of parallel COPY workers, defaults to the number of cores.
+
+        Returns:
+            dict: records, skipped and rows per table, as catalog_loader.load_catalog returns.
+        """
+        result = catalog_loader.load_catalog(self.parameters, path, workers=workers)
+        # Titles may have changed, which the incremental title index refresh does not see
+        self.title_index = None
+        return result
+
+    @reads("reading_daily")
+    def reading_stats(self, user_id, days=None):
+        """
+        Summarizes a user's reading (pages, minutes, sessions, books, streaks) from the daily rollups.
+
+        Parameters:
+            user_id (int): The ID of the user.
+            days (int): How many days back to include, None for all time.
+
+        Returns:
+            dict: See reading_rollup.reading_stats, or None if an error occurs.
+
+        Raises:
+            ValueError: If days is less than 1.
+        """
+        if days is not None and days < 1:
+            raise ValueError("The number of days must be at least 1.")
+        try:
+            return reading_rollup.reading_stats(self.cursor, user_id, days=days)
+
+        except Exception as e:
+            print(f"An error occurred while retrieving reading stats: {e}")
+            self.rollback()
+            return None
+
+    @writes("reading_daily")
+    def backfill_reading_rollups(self):
+        """
+        Rebuilds the daily reading rollups from the raw reading sessions.
+
+        Returns:
+            int: The number of rollup rows written.
+        """
+        try:
+            count = reading_rollup.backfill(self.cursor)
+        except psycopg2.Error:
+            self.rollback()
+            raise
+        self.commit()
+        return count
+
+    @writes("reading_session")
+    def partition_reading_sessions(self, months_ahead=3):
+        """
+        Migrates reading_session to monthly partitions (if needed) and creates the upcoming months' partitions.
+
+        Parameters:
+            months_ahead (int): How many future months to create partitions for.
+
+        Returns:
+            bool: True if the table was migrated by this call.
+        """
+        migrated = session_partitions.migrate(self.connection, months_ahead=months_ahead)
+        session_partitions.ensure_partitions(self.connection, months_ahead=months_ahead)
+        return migrated
+
+    @writes("reading_session")
+    def archive_reading_sessions(self, keep_months, archive_dir=None, drop=False):
+        """
+        Detaches (and optionally exports and drops) reading_session partitions older than keep_months.
+        See session_partitions.archive_partitions.
+
+        Returns:
+            list of str: The names of the partitions archived.
+        """
+        return session_partitions.archive_partitions(self.connection, keep_months, archive_dir=archive_dir, drop=drop)
+
+    def check_schema(self):
+        """
+        Makes sure every schema migration has been applied, since the queries here assume the latest schema.
+        Run once after connecting, before any other method. See migrations.check.
+
+        Raises:
+            SchemaOutdatedError: If any migration is pending.
+        """
+        migrations.check(self.connection)
+
+    def apply_migrations(self, target=None):
+        """
+        Applies the pending schema migrations. See migrations.migrate.
+
+        Parameters:
+            target (int): The last version to apply, None for all of them.
+
+        Returns:
+            list of tuples: (version, name) of the migrations applied.
+        """
+        applied = migrations.migrate(self.connection, target=target)
+        if applied and self.result_cache is not None:
+            self.result_cache.clear()
+        return applied
+
+    @reads("following")
     def follower_info(self, user_id):
         """
         Retrieves follower information for a specified user.
@@ -473,6 +1493,9 @@ class Connection:
         Returns:
             tuple: (following_count, followers_count) or None if an error occurs.
         """
+        if self.follow_graph is not None:
+            return self.follow_graph.following_count(user_id), self.follow_graph.followers_count(user_id)
+
         try:
             # SQL to count users this user is following
             following_count_query = """
@@ -500,133 +1523,69 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving follower info: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    @reads("book", "writes", "publishes", "edits", "contributor", "enjoys", "audience", "classifies_as", "genre", "edition")
     def search_books(self, search_param, search_value):
         """
         Search for books based on specific parameters. It performs a SQL query on the database.
 
         Parameters:
-            search_page (str): Search parameters (e.g., title, genre, date, author, publisher).
+            search_param (str): Search parameters (e.g., title, genre, date, author, publisher, editor).
             search_value (str): Value to search for.
 
         Returns:
-            list of tuples: List of books that match the search criteria.
-        """
-
-        # "book".number_of_books,
-        sql_query = """
-        SELECT "book".book_id, "book".title,
-        "book".length,
-        W.first_name AS writer_first_name, W.last_name AS writer_last_name,
-        P.first_name AS publisher_first_name, P.last_name AS publisher_last_name,
-        E.first_name AS editor_first_name, E.last_name AS editor_last_name,
-        A.type AS audience_type, G.type AS genre_type,
-        edition.release_date,
-        rating.stars AS rating
-        FROM "book"
-        LEFT JOIN writes ON "book".book_id = writes.book_id
-        LEFT JOIN "contributor" AS W ON writes.contributor_id = W.contributor_id
-        LEFT JOIN publishes ON "book".book_id = publishes.book_id
-        LEFT JOIN "contributor" AS P ON publishes.contributor_id = P.contributor_id
-        LEFT JOIN edits ON "book".book_id = edits.book_id
-        LEFT JOIN "contributor" AS E ON edits.contributor_id = E.contributor_id
-        LEFT JOIN enjoys ON "book".book_id = enjoys.book_id
-        LEFT JOIN "audience" AS A ON enjoys.audience_id = A.audience_id
-        LEFT JOIN classifies_as ON "book".book_id = classifies_as.book_id
-        LEFT JOIN "genre" AS G ON classifies_as.genre_id = G.genre_id
-        LEFT JOIN edition ON "book".book_id = edition.book_id
-        LEFT JOIN rating on "book".book_id = rating.book_id
+            list of tuples: One row per matching book, in the BOOK_SUMMARY column order.
         """
-        
-        order_by = 'ORDER BY "book".title, edition.release_date;'
-        where_clause = ""
-        if search_param == "title":
-            where_clause = 'WHERE "book".title= \'' + search_value + '\''
-        elif search_param == "genre":
-            where_clause = 'WHERE G.type= \'' + search_value + '\''
-        elif search_param == "date":
-            where_clause = 'WHERE edition.release_date= \'' +  search_value + '\''
-        elif search_param == "author":
-            first_name, last_name = search_value.split(" ")
-            where_clause= 'WHERE W.first_name=\'' + first_name + '\' AND W.last_name=\'' + last_name + '\''
-        elif search_param == "publisher":
-            first_name, last_name = search_value.split(" ")
-            where_clause= 'WHERE P.first_name=\'' + first_name + '\' AND P.last_name=\'' + last_name + '\''
-        self.cursor.execute(sql_query + where_clause + order_by)
+        where_clause, values = self._book_filter(search_param, search_value)
+        if where_clause is None:
+            return []
+        self.cursor.execute(BOOK_SUMMARY + where_clause + ' ORDER BY b.title', values)
         return self.cursor.fetchall()
 
+    def _book_filter(self, search_param, search_value):
+        """
+        Builds the WHERE clause shared by search_books and sort_books.
+
+        Returns:
+            tuple: (where clause, query values); the clause is None if nothing can match.
+        """
+        if search_param == "title":
+            return 'WHERE b.title = %s', (search_value,)
+        if search_param == "genre":
+            return """
+            WHERE EXISTS (
+                SELECT 1 FROM classifies_as ca JOIN genre g ON ca.genre_id = g.genre_id
+                WHERE ca.book_id = b.book_id AND g.type = %s
+            )""", (search_value,)
+        if search_param == "date":
+            return 'WHERE EXISTS (SELECT 1 FROM edition e WHERE e.book_id = b.book_id AND e.release_date = %s)', (search_value,)
+        if search_param in contributors.ROLE_TABLES:
+            # Resolve the contributor's books first so only those books are summarized
+            book_ids = contributors.books_by(self.cursor, search_param, search_value)
+            if not book_ids:
+                return None, ()
+            return 'WHERE b.book_id = ANY(%s)', (book_ids,)
+        return '', ()
+
+    @reads("book", "writes", "publishes", "edits", "contributor", "enjoys", "audience", "classifies_as", "genre", "edition")
     def sort_books(self, search_param, search_value, sort_by, sort_order):
         """
         Sorts and filters books on specific parameters, with support for multiple editions.
 
         Parameters:
-            search_param (str): Search parameter (e.g., title, genre, date, author, publisher).
+            search_param (str): Search parameter (e.g., title, genre, date, author, publisher, editor).
             search_value (str): Value to search for.
             sort_by (str): Field to sort by (e.g., title, publisher, genre, release_year).
             sort_order (str): Sort order (e.g., 'asc' or 'desc').
 
         Returns:
-            list of tuples: List of books that match the search and sorting criteria.
-        """
-        sql_query = """
-        SELECT "book".book_id, "book".title,
-               "book".length,
-               W.writer_names AS writer_names,  -- Aggregated writer names
-               P.first_name AS publisher_first_name, P.last_name AS publisher_last_name,
-               E.first_name AS editor_first_name, E.last_name AS editor_last_name,
-               A.audience_type, G.genre_type,
-               edition.release_date,
-               rating.stars AS rating
-        FROM "book"
-        LEFT JOIN (
-            SELECT writes.book_id, array_agg(C.first_name || ' ' || C.last_name) AS writer_names
-            FROM "writes"
-            JOIN "contributor" AS C ON writes.contributor_id = C.contributor_id
-            GROUP BY writes.book_id
-        ) AS W ON "book".book_id = W.book_id
-        LEFT JOIN (
-            SELECT publishes.book_id, C.first_name, C.last_name
-            FROM "publishes"
-            JOIN "contributor" AS C ON publishes.contributor_id = C.contributor_id
-            GROUP BY publishes.book_id, C.first_name, C.last_name
-        ) AS P ON "book".book_id = P.book_id
-        LEFT JOIN (
-            SELECT edits.book_id, C.first_name, C.last_name
-            FROM "edits"
-            JOIN "contributor" AS C ON edits.contributor_id = C.contributor_id
-            GROUP BY edits.book_id, C.first_name, C.last_name
-        ) AS E ON "book".book_id = E.book_id
-        LEFT JOIN (
-            SELECT enjoys.book_id, array_agg(A.type) AS audience_type
-            FROM "enjoys"
-            JOIN "audience" AS A ON enjoys.audience_id = A.audience_id
-            GROUP BY enjoys.book_id
-        ) AS A ON "book".book_id = A.book_id
-        LEFT JOIN (
-            SELECT classifies_as.book_id, array_agg(G.type) AS genre_type
-            FROM "classifies_as"
-            JOIN "genre" AS G ON classifies_as.genre_id = G.genre_id
-            GROUP BY classifies_as.book_id
-        ) AS G ON "book".book_id = G.book_id
-        LEFT JOIN "edition" ON "book".book_id = edition.book_id
-        LEFT JOIN "rating" ON "book".book_id = rating.book_id
-        """
-
-        # Construct the WHERE clause based on search parameters
-        where_clause = ""
-        if search_param == "title":
-            where_clause = f"WHERE book.title = '{search_value}'"
-        elif search_param == "genre":
-            where_clause = f"WHERE '{search_value}' = ANY(G.genre_type)"
-        elif search_param == "date":
-            where_clause = f"WHERE edition.release_date = '{search_value}'"
-        elif search_param == "author":
-            first_name, last_name = search_value.split(" ")
-            where_clause = f"WHERE '{first_name} {last_name}' = ANY(W.writer_names)"
-        elif search_param == "publisher":
-            where_clause = f"WHERE P.first_name = '{first_name}' AND P.last_name = '{last_name}'"
+            list of tuples: One row per matching book, in the BOOK_SUMMARY column order.
+        """
+        where_clause, values = self._book_filter(search_param, search_value)
+        if where_clause is None:
+            return []
 
         # Construct the ORDER BY clause
         if sort_order.lower() == "desc":
@@ -636,19 +1595,144 @@ class Connection:
 
         order_by_clause = ""
         if sort_by == "title":
-            order_by_clause = f"ORDER BY book.title {sort_order}"
+            order_by_clause = f"ORDER BY title {sort_order}"
         elif sort_by == "publisher":
-            order_by_clause = f"ORDER BY P.first_name {sort_order}, P.last_name {sort_order}"
+            order_by_clause = f"ORDER BY publishers[1] {sort_order}, title"
         elif sort_by == "genre":
-            order_by_clause = f"ORDER BY G.genre_type {sort_order}"
+            order_by_clause = f"ORDER BY genres {sort_order}, title"
         elif sort_by == "release_year":
-            order_by_clause = f"ORDER BY edition.release_date {sort_order}"
+            order_by_clause = f"ORDER BY release_dates[1] {sort_order}, title"
 
-        # Final SQL execution
-        sql_query += " " + where_clause + " " + order_by_clause
-        self.cursor.execute(sql_query)
+        self.cursor.execute(f"SELECT * FROM ({BOOK_SUMMARY} {where_clause}) summary {order_by_clause}", values)
         return self.cursor.fetchall()
 
+    # Depends on the clock through its window
+    @reads("book_reader_sketch", "reading_daily", "following", "book", ttl=300)
+    def most_read(self, days=90, user_id=None, n=20):
+        """
+        Ranks books by how many different people read them in the last days days.
+
+        Across all readers the counts are HyperLogLog estimates merged from the per-day sketches
+        (see reader_sketch). Among one user's followers they are exact counts from the daily rollups,
+        since a follower set is small enough that sketching would not save anything.
+
+        Parameters:
+            days (int): How many days back to include (today counts as one).
+            user_id (int): Count only this user's followers, None for everyone.
+            n (int): How many books to return.
+
+        Returns:
+            list of tuples: (title, distinct readers), most readers first.
+        """
+        try:
+            if user_id is None:
+                counts = reader_sketch.most_read(self.cursor, days=days, n=n)
+            else:
+                self.cursor.execute("""
+                    SELECT rd.book_id, COUNT(DISTINCT rd.user_id) AS readers
+                    FROM reading_daily rd
+                    JOIN following f ON rd.user_id = f.follower
+                    WHERE f.followee = %s AND rd.day >= CURRENT_DATE - %s
+                    GROUP BY rd.book_id
+                    ORDER BY readers DESC
+                    LIMIT %s
+                """, (user_key(user_id), days - 1, n))
+                counts = self.cursor.fetchall()
+            self.cursor.execute('SELECT book_id, title FROM "book" WHERE book_id = ANY(%s)', ([book_id for book_id, readers in counts],))
+            titles = dict(self.cursor.fetchall())
+            return [(titles[book_id], readers) for book_id, readers in counts if book_id in titles]
+        except Exception as e:
+            print(f"An error occurred while retrieving the most read books: {e}")
+            self.rollback()
+            return None
+
+    @reads("feed_item", "activity", "following", "users", "book")
+    def feed(self, user_id, before=None, n=20):
+        """
+        Reads a page of what the people a user follows have been reading and rating.
+        See activity_feed for how feeds are stored.
+
+        Parameters:
+            user_id (int): Whose feed.
+            before (int): The item_id of the last item on the previous page, None for the newest items.
+            n (int): Items per page.
+
+        Returns:
+            list of tuples: (item_id, username, kind, title, detail, created_at), newest first, where kind is
+                            "read" (detail is pages read) or "rate" (detail is stars). None if an error occurred.
+        """
+        try:
+            return activity_feed.feed_page(self.cursor, user_id, before=before, n=n)
+        except Exception as e:
+            print(f"An error occurred while retrieving the feed: {e}")
+            self.rollback()
+            return None
+
+    def _record_trending(self, book_id, weight, when=None):
+        """
+        Adds an event to the trending scores, and persists the accumulated changes when they are due.
+        """
+        self.trending.record(book_id, weight, when)
+        if self.trending.is_due() and not self.group_commits:
+            self._save_trending()
+
+    def _save_trending(self):
+        saved = {}
+        try:
+            saved = self.trending.save(self.cursor)
+            self.connection.commit()
+        except psycopg2.Error as e:
+            print(f"An error occurred while saving trending scores: {e}")
+            self.connection.rollback()
+            # Keep the changes for the next save
+            self.trending.restore(saved)
+
+    def trending_books(self, n=20):
+        """
+        Retrieves the books with the most recent activity, weighting each read and rating by how recent it is
+        (see trending.TrendingEngine). Served from memory; only the titles are read from the database.
+
+        Parameters:
+            n (int): How many books to return, at most trending.TOP_K.
+
+        Returns:
+            list of tuples: (title, score) for the top n books, highest score first.
+        """
+        try:
+            if not self.trending.loaded:
+                self.trending.load(self.cursor)
+            elif self.trending.is_due() and not self.group_commits:
+                self._save_trending()
+            top = self.trending.top_books(n)
+            self.cursor.execute('SELECT book_id, title FROM "book" WHERE book_id = ANY(%s)', ([book_id for book_id, score in top],))
+            titles = dict(self.cursor.fetchall())
+            return [(titles[book_id], score) for book_id, score in top if book_id in titles]
+        except Exception as e:
+            print(f"An error occurred while retrieving trending books: {e}")
+            self.rollback()
+            return None
+
+    @writes("trending_score")
+    def rebuild_trending(self):
+        """
+        Recomputes the trending scores from the reading and rating history and reloads them.
+
+        Returns:
+            int: The number of books scored.
+        """
+        try:
+            count = trending.rebuild(self.cursor)
+        except psycopg2.Error:
+            self.rollback()
+            raise
+        self.commit()
+        # The rebuilt table already holds everything recorded so far, so unsaved changes would count twice
+        self.trending.reset()
+        self.trending.load(self.cursor)
+        return count
+
+    # Depends on the clock through its 90-day window
+    @reads("reading_session", "rating", "book", ttl=300)
     def top20(self):
         """
         Retrieves the top 20 most popular books in the last 90 days based on average ratings and 5-star counts.
@@ -660,9 +1744,9 @@ class Connection:
             # SQL query to find the top 20 most popular books in the last 90 days
             query = """
             WITH recent_sessions AS (
-                SELECT DISTINCT book_id
-                FROM "book+session" bs
-                JOIN reading_session rs ON bs.session_id = rs.session_id
+                -- Filtering on the partition key means only the last few monthly partitions are scanned
+                SELECT DISTINCT rs.book_id
+                FROM reading_session rs
                 WHERE rs.start_time >= NOW() - INTERVAL '90 days'
             ),
             book_ratings AS (
@@ -689,9 +1773,10 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving the top 20 most popular books: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    @reads("following", "reading_session", "rating", "book")
     def follower20(self, user_id):
         """
         Retrieves the top 20 most popular books read by the user's followers, based on average ratings and 5-star counts.
@@ -703,15 +1788,26 @@ class Connection:
             list of tuples: A list of the top 20 books with their titles, average ratings, and 5-star counts.
         """
         try:
-            # SQL query to find the top 20 most popular books read by followers
-            query = """
-            WITH followers_sessions AS (
-                SELECT DISTINCT bs.book_id
+            if self.follow_graph is not None:
+                # Use the in-memory follower set instead of scanning the following table
+                followers_sessions = """
+                SELECT DISTINCT rs.book_id
+                FROM reading_session rs
+                WHERE rs.user_id = ANY(%s)
+                """
+                parameter = list(self.follow_graph.followers(user_id))
+            else:
+                followers_sessions = """
+                SELECT DISTINCT rs.book_id
                 FROM following f
                 JOIN reading_session rs ON f.follower = rs.user_id
-                JOIN "book+session" bs ON rs.session_id = bs.session_id
                 WHERE f.followee = %s
-            ),
+                """
+                parameter = user_id
+
+            # SQL query to find the top 20 most popular books read by followers
+            query = f"""
+            WITH followers_sessions AS ({followers_sessions}),
             book_ratings AS (
                 SELECT r.book_id,
                        AVG(r.stars) AS avg_rating,
@@ -727,8 +1823,8 @@ class Connection:
             LIMIT 20;
             """
 
-            # Execute the query with the provided user ID
-            self.cursor.execute(query, (user_id,))
+            # Execute the query with the provided user ID or follower set
+            self.cursor.execute(query, (parameter,))
             popular_books = self.cursor.fetchall()
 
             # Return the result
@@ -736,9 +1832,11 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving the top 20 books read by followers: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    # Depends on the clock through its one-month window
+    @reads("edition", "rating", "book", ttl=300)
     def top5new(self):
         """
         Retrieves the top 5 books released within the last month, based on average ratings and 5-star counts.
@@ -778,12 +1876,14 @@ class Connection:
 
         except Exception as e:
             print(f"An error occurred while retrieving the top 5 new releases: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
+    @reads("book_recommendation", "recommendation_computed", "reading_session", "classifies_as", "rating", "book", "writes", "contributor")
     def recommendations(self, user_id):
         """
         Provides book recommendations for a user based on their reading preferences.
+        Served from the nightly precomputed table, or computed live for users it does not cover yet.
 
         Parameters:
             user_id (int): The ID of the user requesting recommendations.
@@ -792,61 +1892,17 @@ class Connection:
             list of tuples: Recommended books with their title, author, and average rating.
         """
         try:
-            # SQL query to find the recommendations
-            query = """
-            WITH user_books AS (
-                SELECT DISTINCT bs.book_id
-                FROM reading_session rs
-                JOIN "book+session" bs ON rs.session_id = bs.session_id
-                WHERE rs.user_id = %s
-            ),
-            user_genres AS (
-                SELECT ca.genre_id, COUNT(ca.genre_id) AS genre_count
-                FROM classifies_as ca
-                JOIN user_books ub ON ca.book_id = ub.book_id
-                GROUP BY ca.genre_id
-                ORDER BY genre_count DESC
-                LIMIT 2
-            ),
-            top_books AS (
-                SELECT r.book_id,
-                       AVG(r.stars) AS avg_rating,
-                       COUNT(CASE WHEN r.stars = 5 THEN 1 END) AS five_star_count
-                FROM rating r
-                JOIN classifies_as ca ON r.book_id = ca.book_id
-                JOIN user_genres ug ON ca.genre_id = ug.genre_id
-                WHERE r.book_id NOT IN (SELECT book_id FROM user_books)
-                GROUP BY r.book_id
-            ),
-            ranked_books AS (
-                SELECT DISTINCT ON (b.title) 
-                       b.title,
-                       c.first_name AS author_first_name,
-                       c.last_name AS author_last_name,
-                       tb.avg_rating,
-                       tb.five_star_count
-                FROM top_books tb
-                JOIN book b ON tb.book_id = b.book_id
-                LEFT JOIN writes w ON b.book_id = w.book_id
-                LEFT JOIN contributor c ON w.contributor_id = c.contributor_id
-                ORDER BY b.title, tb.avg_rating DESC, tb.five_star_count DESC
-            )
-            SELECT title, author_first_name, author_last_name, avg_rating
-            FROM ranked_books
-            ORDER BY avg_rating DESC, five_star_count DESC
-            LIMIT 10;
-            """
-
-            # Execute the query
-            self.cursor.execute(query, (user_id,))
-            recommendations = self.cursor.fetchall()
+            stored = recommendations.stored_recommendations(self.cursor, user_id)
+            if stored is not None:
+                return stored
 
-            # Return the recommendations
-            return recommendations
+            # Compute them live
+            self.cursor.execute(recommendations.RECOMMENDATIONS_QUERY, (user_id,))
+            return self.cursor.fetchall()
 
         except Exception as e:
             print(f"An error occurred while generating recommendations: {e}")
-            self.connection.rollback()
+            self.rollback()
             return None
 
 
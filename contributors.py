@@ -0,0 +1,69 @@
+# A contributor's name with case, spacing and punctuation removed, so "J. R. R. Tolkien",
+# "JRR Tolkien" and "j.r.r. tolkien" all match however the name is split between first_name and last_name
+NAME_KEY = "lower(regexp_replace(coalesce(first_name, '') || coalesce(last_name, ''), '[^[:alnum:]]+', '', 'g'))"
+
+# The name lookup, and each role table's lookup from contributor to books
+CONTRIBUTOR_INDEXES = f"""
+CREATE INDEX IF NOT EXISTS contributor_name_key_idx ON contributor (({NAME_KEY}));
+CREATE INDEX IF NOT EXISTS writes_contributor_idx ON writes (contributor_id);
+CREATE INDEX IF NOT EXISTS publishes_contributor_idx ON publishes (contributor_id);
+CREATE INDEX IF NOT EXISTS edits_contributor_idx ON edits (contributor_id);
+"""
+
+# The table linking books to contributors for each role that can be searched
+ROLE_TABLES = {
+    "author": "writes",
+    "publisher": "publishes",
+    "editor": "edits",
+}
+
+def name_key(name):
+    """
+    Normalizes a name the same way as NAME_KEY. "Last, First" is read as "First Last".
+
+    Parameters:
+        name (str): The name as the user typed it.
+
+    Returns:
+        str: The normalized name.
+    """
+    if "," in name:
+        last, first = name.split(",", 1)
+        name = first + " " + last
+    return "".join(ch for ch in name if ch.isalnum()).lower()
+
+def resolve_contributors(cursor, name):
+    """
+    Finds the contributors with a given name through contributor_name_key_idx.
+
+    Parameters:
+        cursor: A database cursor.
+        name (str): The name as the user typed it.
+
+    Returns:
+        list of int: The IDs of the matching contributors.
+    """
+    cursor.execute(f"SELECT contributor_id FROM contributor WHERE {NAME_KEY} = %s", (name_key(name),))
+    return [row[0] for row in cursor.fetchall()]
+
+def books_by(cursor, role, name):
+    """
+    Finds the books a contributor has a role in, resolving the contributor first so only
+    their rows of the role table are read.
+
+    Parameters:
+        cursor: A database cursor.
+        role (str): "author", "publisher" or "editor".
+        name (str): The contributor's name as the user typed it.
+
+    Returns:
+        list of int: The IDs of the matching books.
+    """
+    contributor_ids = resolve_contributors(cursor, name)
+    if not contributor_ids:
+        return []
+    cursor.execute(
+        f"SELECT DISTINCT book_id FROM {ROLE_TABLES[role]} WHERE contributor_id = ANY(%s)",
+        (contributor_ids,)
+    )
+    return [row[0] for row in cursor.fetchall()]
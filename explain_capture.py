@@ -0,0 +1,146 @@
+import sys
+import json
+from psycopg2.extensions import cursor as base_cursor
+
+# Statement kinds EXPLAIN accepts; everything else (DDL, LOCK, SAVEPOINT, ...) runs uncaptured
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "VALUES")
+
+# An estimate off by at least this factor in either direction is flagged
+MISESTIMATE_FACTOR = 10
+
+def _first_word(statement):
+    if isinstance(statement, bytes):
+        statement = statement.decode(errors="replace")
+    if not isinstance(statement, str):
+        return ""
+    words = statement.lstrip(" \t\r\n(").split(None, 1)
+    return words[0].upper() if words else ""
+
+def _calling_method(cls):
+    """
+    Finds the outermost method of cls on the call stack, so statements issued by helpers
+    (suggestions, reading_rollup, ...) are charged to the Connection method that called them.
+    """
+    method = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        instance = frame.f_locals.get("self")
+        if isinstance(instance, cls) and callable(getattr(cls, frame.f_code.co_name, None)):
+            method = frame.f_code.co_name
+        frame = frame.f_back
+    return method or "<outside Connection>"
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+def analyze_plan(plan):
+    """
+    Pulls the problems worth a look out of an EXPLAIN (FORMAT JSON) plan.
+
+    Parameters:
+        plan (dict): The top-level object EXPLAIN returns (with "Plan" and "Execution Time").
+
+    Returns:
+        dict: seq_scans (relations read by a sequential scan) and misestimates
+              (nodes whose actual row count is MISESTIMATE_FACTOR times off the estimate).
+    """
+    seq_scans = []
+    misestimates = []
+    for node in _walk(plan["Plan"]):
+        if node["Node Type"] == "Seq Scan":
+            seq_scans.append(node.get("Relation Name"))
+        if "Actual Rows" in node and node.get("Actual Loops", 1):
+            estimated = max(node["Plan Rows"], 1)
+            actual = max(node["Actual Rows"], 1)
+            if max(estimated, actual) / min(estimated, actual) >= MISESTIMATE_FACTOR:
+                misestimates.append({
+                    "node": node["Node Type"],
+                    "relation": node.get("Relation Name"),
+                    "estimated_rows": node["Plan Rows"],
+                    "actual_rows": node["Actual Rows"],
+                })
+    return {"seq_scans": seq_scans, "misestimates": misestimates}
+
+class ExplainCapture:
+    """
+    Collects EXPLAIN (ANALYZE, BUFFERS) plans for every statement run through its cursors,
+    grouped by the Connection method that issued them.
+
+    Each statement is explained inside a savepoint that is rolled back, then run for real,
+    so writes happen once but are executed twice. Sequence values consumed by the explained
+    copy are not given back.
+    """
+
+    def __init__(self, owner):
+        """
+        Parameters:
+            owner (type): The class whose methods statements are attributed to (Connection).
+        """
+        self.owner = owner
+        self.plans = {}
+        self.cursor_factory = self._make_cursor_factory()
+
+    def _make_cursor_factory(self):
+        capture = self
+
+        class ExplainCursor(base_cursor):
+            def execute(self, query, vars=None):
+                # Server-side (named) cursors cannot be explained without consuming them
+                if self.name is None and _first_word(query) in EXPLAINABLE:
+                    capture.explain(self, query, vars)
+                return super().execute(query, vars)
+
+        return ExplainCursor
+
+    def explain(self, cursor, query, vars):
+        """
+        Runs EXPLAIN (ANALYZE, BUFFERS) for one statement and records its plan.
+        A statement EXPLAIN rejects is skipped; the real execution reports its error.
+        """
+        prefix = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+        explained = prefix.encode() + query if isinstance(query, bytes) else prefix + query
+        base_cursor.execute(cursor, "SAVEPOINT explain_capture")
+        try:
+            base_cursor.execute(cursor, explained, vars)
+            plan = cursor.fetchone()[0][0]
+        except Exception:
+            plan = None
+        base_cursor.execute(cursor, "ROLLBACK TO SAVEPOINT explain_capture")
+        base_cursor.execute(cursor, "RELEASE SAVEPOINT explain_capture")
+        if plan is None:
+            return
+        statement = query.decode(errors="replace") if isinstance(query, bytes) else query
+        entry = {
+            "statement": " ".join(statement.split()),
+            "planning_ms": plan.get("Planning Time"),
+            "execution_ms": plan.get("Execution Time"),
+            "plan": plan["Plan"],
+        }
+        entry.update(analyze_plan(plan))
+        self.plans.setdefault(_calling_method(self.owner), []).append(entry)
+
+    def summary(self):
+        """
+        Returns:
+            list of dicts: Per method, the statement count, total execution time,
+                           sequentially scanned relations and misestimate count, slowest first.
+        """
+        rows = []
+        for method, entries in self.plans.items():
+            rows.append({
+                "method": method,
+                "statements": len(entries),
+                "execution_ms": sum(entry["execution_ms"] or 0 for entry in entries),
+                "seq_scans": sorted({relation for entry in entries for relation in entry["seq_scans"] if relation}),
+                "misestimates": sum(len(entry["misestimates"]) for entry in entries),
+            })
+        return sorted(rows, key=lambda row: -row["execution_ms"])
+
+    def dump(self, path):
+        """
+        Writes every captured plan to path as JSON, keyed by method, for comparison across releases.
+        """
+        with open(path, "w") as output:
+            json.dump(self.plans, output, indent=2, default=str)
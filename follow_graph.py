@@ -0,0 +1,291 @@
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+# Number of pending edge changes after which the arrays are rebuilt
+COMPACT_THRESHOLD = 10000
+
+def user_key(user_id):
+    """
+    Normalizes a user ID to a plain int.
+
+    Parameters:
+        user_id (int or tuple): A user ID, possibly still wrapped in the row tuple returned by fetchone().
+
+    Returns:
+        int: The user ID.
+    """
+    if isinstance(user_id, (tuple, list)):
+        return user_id[0]
+    return user_id
+
+def build_csr(size, sources, targets):
+    """
+    Groups edges by source with a counting sort. Targets stay in input order within each
+    source, so they come out sorted when the edges are ordered by (source, target) or by
+    (target, source).
+
+    Parameters:
+        size (int): One more than the largest source ID.
+        sources (array): The source of each edge.
+        targets (array): The target of each edge.
+
+    Returns:
+        tuple: (offsets, neighbors) arrays; the targets of source i are neighbors[offsets[i]:offsets[i + 1]].
+    """
+    offsets = array('q', bytes(8 * (size + 1)))
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    position = array('q', offsets[:-1])
+    neighbors = array('i', bytes(4 * len(targets)))
+    for source, target in zip(sources, targets):
+        neighbors[position[source]] = target
+        position[source] += 1
+    return offsets, neighbors
+
+class FollowGraph:
+    """
+    An in-memory index of the "following" table stored as two CSR (compressed sparse row) structures:
+    one from follower to followees and one from followee to followers.
+
+    User IDs are handed out sequentially, so they index the arrays directly. Each direction keeps an
+    offsets array (one entry per user) and a neighbors array (one entry per edge), plus a degree array
+    that is updated in place so degree lookups stay O(1) while follows and unfollows are pending.
+    Pending changes are indexed by user in both directions, so a neighbor lookup only looks at that
+    user's changes, and are merged back into the arrays by compact().
+    """
+
+    def __init__(self, size, edges_src, edges_dst):
+        """
+        Builds the graph from two parallel arrays of edges.
+
+        Parameters:
+            size (int): One more than the largest user ID in the graph.
+            edges_src (array): The follower of each edge.
+            edges_dst (array): The followee of each edge.
+        """
+        self.size = size
+        self.out_offsets, self.out_neighbors = build_csr(size, edges_src, edges_dst)
+        self.in_offsets, self.in_neighbors = build_csr(size, edges_dst, edges_src)
+        self.out_degree = self._degrees(self.out_offsets)
+        self.in_degree = self._degrees(self.in_offsets)
+        self._clear_pending()
+
+    def _clear_pending(self):
+        # follower -> followees and followee -> followers, for the follows and unfollows not yet compacted
+        self.added_out = {}
+        self.added_in = {}
+        self.removed_out = {}
+        self.removed_in = {}
+        self.pending = 0
+
+    @classmethod
+    def load(cls, connection, batch_size=100000):
+        """
+        Builds the graph by streaming the "following" table through a server-side cursor.
+
+        Parameters:
+            connection: An open psycopg2 connection.
+            batch_size (int): Number of rows fetched per round trip.
+
+        Returns:
+            FollowGraph: The loaded graph.
+        """
+        edges_src = array('i')
+        edges_dst = array('i')
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COALESCE(MAX(user_id), 0) FROM users')
+            size = cursor.fetchone()[0] + 1
+        with connection.cursor(name='follow_graph_load') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute('SELECT follower, followee FROM following ORDER BY follower, followee')
+            for follower, followee in cursor:
+                edges_src.append(follower)
+                edges_dst.append(followee)
+        size = max(size, max(edges_src, default=-1) + 1, max(edges_dst, default=-1) + 1)
+        return cls(size, edges_src, edges_dst)
+
+    @staticmethod
+    def _degrees(offsets):
+        return array('i', (offsets[i + 1] - offsets[i] for i in range(len(offsets) - 1)))
+
+    def _grow(self, user_id):
+        """
+        Extends the per-user arrays so they cover a user that joined after the graph was built.
+        """
+        if user_id < self.size:
+            return
+        extra = user_id + 1 - self.size
+        self.out_offsets.extend([self.out_offsets[-1]] * extra)
+        self.in_offsets.extend([self.in_offsets[-1]] * extra)
+        self.out_degree.extend([0] * extra)
+        self.in_degree.extend([0] * extra)
+        self.size = user_id + 1
+
+    def _in_base(self, follower, followee):
+        if follower >= self.size:
+            return False
+        lo, hi = self.out_offsets[follower], self.out_offsets[follower + 1]
+        i = bisect_left(self.out_neighbors, followee, lo, hi)
+        return i < hi and self.out_neighbors[i] == followee
+
+    def has_edge(self, follower, followee):
+        """
+        Checks whether follower follows followee.
+        """
+        follower, followee = user_key(follower), user_key(followee)
+        if followee in self.added_out.get(follower, ()):
+            return True
+        if followee in self.removed_out.get(follower, ()):
+            return False
+        return self._in_base(follower, followee)
+
+    @staticmethod
+    def _index(by_follower, by_followee, follower, followee, present):
+        """
+        Adds an edge to (present=True) or drops it from a pair of per-user pending indexes.
+        """
+        for index, key, value in ((by_follower, follower, followee), (by_followee, followee, follower)):
+            if present:
+                index.setdefault(key, set()).add(value)
+            else:
+                values = index[key]
+                values.discard(value)
+                if not values:
+                    del index[key]
+
+    def add_edge(self, follower, followee):
+        """
+        Records a follow. Does nothing if the edge already exists.
+        """
+        follower, followee = user_key(follower), user_key(followee)
+        if self.has_edge(follower, followee):
+            return
+        self._grow(max(follower, followee))
+        if followee in self.removed_out.get(follower, ()):
+            self._index(self.removed_out, self.removed_in, follower, followee, False)
+            self.pending -= 1
+        else:
+            self._index(self.added_out, self.added_in, follower, followee, True)
+            self.pending += 1
+        self.out_degree[follower] += 1
+        self.in_degree[followee] += 1
+        self._maybe_compact()
+
+    def remove_edge(self, follower, followee):
+        """
+        Records an unfollow. Does nothing if the edge does not exist.
+        """
+        follower, followee = user_key(follower), user_key(followee)
+        if not self.has_edge(follower, followee):
+            return
+        if followee in self.added_out.get(follower, ()):
+            self._index(self.added_out, self.added_in, follower, followee, False)
+            self.pending -= 1
+        else:
+            self._index(self.removed_out, self.removed_in, follower, followee, True)
+            self.pending += 1
+        self.out_degree[follower] -= 1
+        self.in_degree[followee] -= 1
+        self._maybe_compact()
+
+    def following_count(self, user_id):
+        """
+        Returns the number of users this user follows in O(1).
+        """
+        user_id = user_key(user_id)
+        return self.out_degree[user_id] if user_id < self.size else 0
+
+    def followers_count(self, user_id):
+        """
+        Returns the number of users following this user in O(1).
+        """
+        user_id = user_key(user_id)
+        return self.in_degree[user_id] if user_id < self.size else 0
+
+    def _neighbors(self, offsets, neighbors, user_id, added, removed):
+        if user_id < self.size:
+            row = neighbors[offsets[user_id]:offsets[user_id + 1]]
+            gone = removed.get(user_id)
+            if gone is None:
+                yield from row
+            else:
+                for neighbor in row:
+                    if neighbor not in gone:
+                        yield neighbor
+        yield from added.get(user_id, ())
+
+    def followees(self, user_id):
+        """
+        Iterates over the users this user follows.
+        """
+        return self._neighbors(self.out_offsets, self.out_neighbors, user_key(user_id), self.added_out, self.removed_out)
+
+    def followers(self, user_id):
+        """
+        Iterates over the users following this user.
+        """
+        return self._neighbors(self.in_offsets, self.in_neighbors, user_key(user_id), self.added_in, self.removed_in)
+
+    def edges(self):
+        """
+        Iterates over every (follower, followee) edge in (follower, followee) order.
+        """
+        for follower in range(self.size):
+            for followee in sorted(self.followees(follower)):
+                yield follower, followee
+
+    def _maybe_compact(self):
+        if self.pending >= COMPACT_THRESHOLD:
+            self.compact()
+
+    def _merge(self, offsets, neighbors, degree, added, removed):
+        """
+        Rebuilds one direction's arrays with its pending changes applied. The offsets come from the degrees,
+        which are already current; the rows of users without changes are copied in runs, one slice per run.
+        """
+        new_offsets = array('q', accumulate(degree, initial=0))
+        new_neighbors = array('i')
+        copied = 0
+        for user_id in sorted(added.keys() | removed.keys()):
+            new_neighbors.extend(neighbors[offsets[copied]:offsets[user_id]])
+            gone = removed.get(user_id, ())
+            row = [neighbor for neighbor in neighbors[offsets[user_id]:offsets[user_id + 1]] if neighbor not in gone]
+            row.extend(added.get(user_id, ()))
+            row.sort()
+            new_neighbors.extend(row)
+            copied = user_id + 1
+        new_neighbors.extend(neighbors[offsets[copied]:offsets[self.size]])
+        return new_offsets, new_neighbors
+
+    def compact(self):
+        """
+        Merges pending follows and unfollows back into the CSR arrays. Only the rows of users with
+        pending changes are rebuilt one by one; the rest are bulk copies.
+        """
+        self.out_offsets, self.out_neighbors = self._merge(self.out_offsets, self.out_neighbors, self.out_degree,
+                                                           self.added_out, self.removed_out)
+        self.in_offsets, self.in_neighbors = self._merge(self.in_offsets, self.in_neighbors, self.in_degree,
+                                                         self.added_in, self.removed_in)
+        self._clear_pending()
+
+    def memory_report(self):
+        """
+        Reports how many bytes each part of the index uses.
+
+        Returns:
+            dict: Bytes per component, plus a "total" entry.
+        """
+        report = {}
+        for name in ('out_offsets', 'out_neighbors', 'in_offsets', 'in_neighbors', 'out_degree', 'in_degree'):
+            values = getattr(self, name)
+            report[name] = values.buffer_info()[1] * values.itemsize
+        # Each pending change is held in one set per direction, plus a dict entry per user with changes
+        indexes = (self.added_out, self.added_in, self.removed_out, self.removed_in)
+        report['pending'] = sum(sys.getsizeof(index) + sum(sys.getsizeof(values) for values in index.values())
+                                for index in indexes)
+        report['total'] = sum(report.values())
+        return report
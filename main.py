@@ -8,11 +8,22 @@
 # Description: The primary script #
 # that handles all DB functions   #
 ###################################
+import os
 import sys
+import pstats
+import cProfile
 import hashlib
+import argparse
+import contextlib
 from getpass import getpass
-from connection_and_queries import Connection
-from User import User
+import session_daemon
+
+# The database modules (psycopg2, sshtunnel) are imported by the run functions that need them, so
+# --batch --daemon, which only talks to the daemon's socket, starts without loading them.
+
+# Schema changes, rebuilds, bulk loads and whole-database checks, only run when started with --admin
+ADMIN_COMMANDS = {"checkcollections", "statsbackfill", "suggestbuild", "trendingrebuild", "recbuild",
+                  "loadcatalog", "partitionsessions", "archivesessions", "migrate"}
 
 def help():
     """
@@ -23,21 +34,45 @@ def help():
     print("logout     -- Logouts of the current session")
     print("create     -- Creates a new book collection")
     print("list       -- Displays all collections")
+    print("checkcollections -- Checks (and optionally repairs) collection book counts and page totals")
     print("add        -- Adds a book to a collection")
     print("remove     -- Removes a book from a collection")
     print("rename     -- Renames an existing book collection")
     print("delete     -- Deletes an existing book collection")
     print("rate       -- Rates a book (1-5 stars)")
     print("read       -- Reads a book from a certain page to a certain page")
+    print("stats      -- Shows reading totals and streaks")
+    print("statsbackfill -- Rebuilds the daily reading rollups from reading history")
     print("profile    -- Check follow and collection info")
     print("follow     -- Follows another user (by email)")
     print("unfollow   -- Unfollows another user (by email)")
+    print("followmany -- Follows several users at once (comma-separated emails)")
+    print("unfollowmany -- Unfollows several users at once (comma-separated emails)")
+    print("suggest    -- Suggests users to follow based on who the people you follow follow")
+    print("suggestbuild -- Recomputes follow suggestions for users whose follows changed")
+    print("graph      -- Loads the in-memory follow graph index and shows its memory usage")
     print("search     -- Searches a book based on a search term and a search value")
     print("sort       -- Sorts and searches books")
+    print("complete   -- Lists book titles and contributor names starting with what you type")
     print("top20      -- Top 20 most popular books in last 90 days (rolling)")
     print("follower20 -- Top 20 most popular books among my followers")
     print("top5new    -- Top 5 new releases of the month (calendar month)")
+    print("feed       -- Shows what the people you follow have been reading and rating")
+    print("mostread   -- Books read by the most different people (everyone, or your followers)")
+    print("trending   -- Books with the most recent activity, older reads and ratings counting less")
+    print("trendingrebuild -- Recomputes trending scores from the full reading and rating history")
     print("rec        -- Gives book recommendations based on user reading history")
+    print("recbuild   -- Precomputes recommendations for all recently active users (the nightly job)")
+    print("cachestats -- Shows query result cache hit rates")
+    print("explain    -- Toggles capturing query plans for every command; turning it off shows the report")
+    print("trace      -- Toggles timing spans for every command and statement; turning it off shows the report")
+    print("cprofile   -- Toggles the Python profiler; turning it off shows the slowest functions")
+    print("loadcatalog -- Bulk-loads books, contributors and editions from a CSV or JSONL catalog dump")
+    print("partitionsessions -- Partitions reading history by month and creates upcoming partitions")
+    print("archivesessions -- Detaches (and optionally exports) old reading history partitions")
+    print("migrate    -- Applies pending schema migrations and indexes")
+    print("(checkcollections, statsbackfill, suggestbuild, trendingrebuild, recbuild, loadcatalog,")
+    print(" partitionsessions, archivesessions and migrate need --admin)")
     print("help       -- Shows a help message")
     print("quit       -- Exits the application")
 
@@ -53,15 +88,205 @@ def hash_password(password):
     """
     return hashlib.sha256(password.encode()).hexdigest()
 
-def main():
+def read_email_list(raw):
     """
-    The main function of the application. The entry point which handles user interaction and command processing.
+    Splits a comma-separated list of emails into a clean list.
+
+    Parameters:
+        raw (str): The raw comma-separated input.
+
+    Returns:
+        list of str: The non-empty, whitespace-stripped emails.
+    """
+    return [email.strip() for email in raw.split(",") if email.strip()]
+
+def prompt_title(session, prompt):
+    """
+    Asks for a book title and, if what was typed is not an exact title, offers the closest
+    completions from the title index to pick from.
+
+    Parameters:
+        session (Connection): The database connection, used for the completions.
+        prompt (str): The input prompt.
+
+    Returns:
+        str: The chosen title, or what was typed if nothing was picked.
+    """
+    typed = input(prompt).strip()
+    matches = session.complete_names(typed, kind="title")
+    if typed in matches or not matches:
+        return typed
+    if len(matches) == 1:
+        print(f'Using "{matches[0]}".')
+        return matches[0]
+    for i, title in enumerate(matches, start=1):
+        print(f"{i}. {title}")
+    choice = input("Pick a number (blank to keep what you typed): ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(matches):
+        return matches[int(choice) - 1]
+    return typed
+
+def parse_arguments(argv):
+    """
+    Parses the command line options.
+
+    Parameters:
+        argv (list of str): The arguments after the script name.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="The Books Platform command line interface.")
+    parser.add_argument("--migrate", action="store_true",
+                        help="apply the pending schema migrations and exit")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run JSONL commands from FILE ('-' for stdin) instead of prompting; each record "
+                             "needs the password of the user it names")
+    parser.add_argument("--admin", action="store_true",
+                        help="allow the schema, rebuild and bulk load commands; in batch mode, also run "
+                             "records that name a user without their password")
+    parser.add_argument("--group-size", type=int, default=1,
+                        help="number of batch commands committed together per transaction (default: 1)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel batch workers, each with its own connection (default: 1)")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="queue reads and ratings and write them in the background in batches")
+    parser.add_argument("--spool", metavar="FILE",
+                        help="with --write-behind, spool queued events to FILE so a crash does not lose them")
+    parser.add_argument("--cache", action="store_true",
+                        help="cache read-only query results until a write touches the tables they read")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="after login, load your collections, profile, top 20 and recommendations in the "
+                             "background so those commands answer from the cache (implies --cache)")
+    parser.add_argument("--replica", metavar="HOST:PORT",
+                        help="read replica address as seen from the SSH server; read-only queries are sent there")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run under cProfile and write the stats to FILE (open with pstats or snakeviz)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record a span for every command and statement and write them to FILE "
+                             "(open in chrome://tracing or Perfetto)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="with --batch, send the commands to a running session daemon, which reuses its "
+                             "tunnel, connections and cache (start one with 'python session_daemon.py serve')")
+    parser.add_argument("--socket", default=session_daemon.DEFAULT_SOCKET,
+                        help=f"with --daemon, the daemon's socket (default: {session_daemon.DEFAULT_SOCKET})")
+    return parser.parse_args(argv)
+
+def parse_address(address):
+    """
+    Parses a HOST:PORT address.
+
+    Parameters:
+        address (str): The address, or None.
+
+    Returns:
+        tuple: (host, port), or None if no address was given.
     """
+    if not address:
+        return None
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+def run_batch(arguments):
+    """
+    Runs the commands in a JSONL batch file and writes one JSON result per line to stdout.
+    SSH credentials come from the SSH_USERNAME and SSH_PASSWORD environment variables, or are prompted for.
+
+    Parameters:
+        arguments (argparse.Namespace): The parsed command line options.
+    """
+    if arguments.daemon:
+        source = sys.stdin if arguments.batch == "-" else open(arguments.batch)
+        try:
+            session_daemon.run_batch(source, sys.stdout, arguments.socket)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        return
+    from batch import BatchRunner
+    from tracing import Tracer
+    from migrations import SchemaOutdatedError
+    ssh_username = os.environ.get("SSH_USERNAME") or getpass("SSH Username: ")
+    ssh_password = os.environ.get("SSH_PASSWORD") or getpass("SSH Password: ")
+    tracer = Tracer() if arguments.trace else None
+    runner = BatchRunner(ssh_username, ssh_password, hash_password, output=sys.stdout,
+                         group_size=arguments.group_size, workers=arguments.workers,
+                         replica_address=parse_address(arguments.replica), tracer=tracer,
+                         admin=arguments.admin)
+    source = sys.stdin if arguments.batch == "-" else open(arguments.batch)
+    try:
+        # Keep the progress messages printed by Connection out of the structured results
+        with contextlib.redirect_stdout(sys.stderr):
+            runner.run(source)
+    except SchemaOutdatedError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if tracer is not None:
+            tracer.dump(arguments.trace)
+
+def run_migrations(arguments):
+    """
+    Applies the pending schema migrations through the tunnel. SSH credentials come from the SSH_USERNAME
+    and SSH_PASSWORD environment variables, or are prompted for.
+
+    Parameters:
+        arguments (argparse.Namespace): The parsed command line options.
+    """
+    from connection_and_queries import Connection
+    ssh_username = os.environ.get("SSH_USERNAME") or getpass("SSH Username: ")
+    ssh_password = os.environ.get("SSH_PASSWORD") or getpass("SSH Password: ")
+    session = Connection(ssh_username, ssh_password)
+    try:
+        applied = session.apply_migrations()
+    finally:
+        session.close()
+    for version, name in applied:
+        print(f"Applied migration {version}: {name}")
+    if not applied:
+        print("The schema is up to date.")
+
+def print_profile(profiler, limit=25):
+    """
+    Displays the functions with the most cumulative time in a profile.
+
+    Parameters:
+        profiler (cProfile.Profile): A stopped profiler.
+        limit (int): How many functions to show.
+    """
+    pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+
+def run_interactive(arguments):
+    """
+    Handles user interaction and command processing.
+
+    Parameters:
+        arguments (argparse.Namespace): The parsed command line options.
+    """
+    from connection_and_queries import Connection, RetryError
+    from User import User
+    from migrations import SchemaOutdatedError
     ssh_username = input("SSH Username: ")
     ssh_password = input("SSH Password: ")
+    tracer = None
+    profiler = None
     try:
-        session = Connection(ssh_username, ssh_password)
-        user = User(session)
+        session = Connection(ssh_username, ssh_password, replica_address=parse_address(arguments.replica))
+        try:
+            session.check_schema()
+        except SchemaOutdatedError:
+            session.close()
+            raise
+        if arguments.write_behind:
+            session.enable_write_behind(spool_path=arguments.spool)
+        if arguments.cache or arguments.prefetch:
+            session.enable_result_cache()
+        user = User(session, prefetch=arguments.prefetch)
+        if arguments.trace:
+            tracer = session.enable_tracing()
+            tracer.instrument(user, "User")
         print("""
                 __________________   __________________
             .-/|                  \ /                  |\-.
@@ -87,89 +312,190 @@ def main():
                 command = input(f"{user.username} > ").lower()
             else:
                 command = input("> ").lower()
-            if command == "login":
-                username = input("Username: ")
-                password = hash_password(input("Password: "))
-                print("Logging you in...")
-                user.login(username=username, password=password)
-            elif command == "join":
-                username = input("Username: ")
-                password = hash_password(input("Password: "))
-                email = input("Email: ")
-                first_name = input("First Name: ")
-                last_name = input("Last Name: ")
-                print("Creating your account...")
-                user.join(username=username, email=email, password=password, first_name=first_name, last_name=last_name)
-            elif command == "logout":
-                print("Logging you out...")
-                user.logout()
-            elif command == "create":
-                title = input("Collection Title: ")
-                print("Creating new book collection...")
-                user.create_collection(title)
-            elif command == "delete":
-                title = input("Collection Title: ")
-                print("Deleting collection...")
-                user.delete_collection(title)
-            elif command == "rename":
-                old_title = input("Old Collection Title: ")
-                new_title = input("New Collection Title: ")
-                print("Renaming collection...")
-                user.rename_collection(old_title, new_title)
-            elif command == "add":
-                book_title = input("Book Title: ")
-                collection_title = input("Collection Title: ")
-                print("Adding book to collection...")
-                user.add_to_collection(book_title, collection_title)
-            elif command == "remove":
-                book_title = input("Book Title: ")
-                collection_title = input("Collection Title: ")
-                print("Removing book from collection...")
-                user.remove_from_collection(book_title, collection_title)
-            elif command == "rate":
-                book_title = input("Book Title: ")
-                rating = int(input("Rating (1-5 stars): "))
-                print("Rating the book...")
-                user.rate_book(book_title, rating)
-            elif command == "read":
-                book_title = input("Which book do you want to read? ")
-                book_start_page = int(input("Start page: "))
-                book_end_page = int(input("End page: "))
-                print("Reading the book...")
-                user.read_book(book_title, book_start_page, book_end_page)
-            elif command == "profile":
-                user.profile()
-            elif command == "follow":
-                email = input("Please enter the email of the person to follow: ")
-                user.follow(email)
-            elif command == "unfollow":
-                email = input("Please enter the email of the person to unfollow: ")
-                user.unfollow(email)
-            elif command == "list":
-                user.list_collections()
-            elif command == "search":
-                search_term = input("Please enter the search term[title/release_date/author/publisher/genre]: ")
-                search_value = input("Please enter the search value: ")
-                user.search(search_term, search_value)
-            elif command == "sort":
-                search_term = input("Please enter the search term[title/publisher/genre/release_date]: ")
-                search_value = input("Please enter the search value: ")
-                order_value = input("Please enter the order term[title/publisher/genre/released year]: ")
-                order_by = input("Please enter the sort order[asc/desc]: ").lower()
-                user.sort(search_term, search_value, order_value, order_by)
-            elif command == 'top20':
-                user.top20()
-            elif command == 'follower20':
-                user.follower20()
-            elif command == "top5new":
-                user.top5new()
-            elif command == "rec":
-                user.recommended()
-            elif command == "help":
-                help()
-            elif command == "quit":
-                print("Thank you for using our application!")
-                print("""
+            try:
+                if command in ADMIN_COMMANDS and not arguments.admin:
+                    print(f"The {command} command is only available when started with --admin.")
+                elif command == "login":
+                    username = input("Username: ")
+                    password = hash_password(input("Password: "))
+                    print("Logging you in...")
+                    user.login(username=username, password=password)
+                elif command == "join":
+                    username = input("Username: ")
+                    password = hash_password(input("Password: "))
+                    email = input("Email: ")
+                    first_name = input("First Name: ")
+                    last_name = input("Last Name: ")
+                    print("Creating your account...")
+                    user.join(username=username, email=email, password=password, first_name=first_name, last_name=last_name)
+                elif command == "logout":
+                    print("Logging you out...")
+                    user.logout()
+                elif command == "create":
+                    title = input("Collection Title: ")
+                    print("Creating new book collection...")
+                    user.create_collection(title)
+                elif command == "delete":
+                    title = input("Collection Title: ")
+                    print("Deleting collection...")
+                    user.delete_collection(title)
+                elif command == "rename":
+                    old_title = input("Old Collection Title: ")
+                    new_title = input("New Collection Title: ")
+                    print("Renaming collection...")
+                    user.rename_collection(old_title, new_title)
+                elif command == "add":
+                    book_title = prompt_title(session, "Book Title: ")
+                    collection_title = input("Collection Title: ")
+                    print("Adding book to collection...")
+                    user.add_to_collection(book_title, collection_title)
+                elif command == "remove":
+                    book_title = prompt_title(session, "Book Title: ")
+                    collection_title = input("Collection Title: ")
+                    print("Removing book from collection...")
+                    user.remove_from_collection(book_title, collection_title)
+                elif command == "rate":
+                    book_title = prompt_title(session, "Book Title: ")
+                    rating = int(input("Rating (1-5 stars): "))
+                    print("Rating the book...")
+                    user.rate_book(book_title, rating)
+                elif command == "read":
+                    book_title = prompt_title(session, "Which book do you want to read? ")
+                    book_start_page = int(input("Start page: "))
+                    book_end_page = int(input("End page: "))
+                    print("Reading the book...")
+                    user.read_book(book_title, book_start_page, book_end_page)
+                elif command == "stats":
+                    days = input("Number of days to include (blank for all time): ")
+                    user.stats(int(days) if days.strip() else None)
+                elif command == "statsbackfill":
+                    user.backfill_reading_rollups()
+                elif command == "profile":
+                    user.profile()
+                elif command == "follow":
+                    email = input("Please enter the email of the person to follow: ")
+                    user.follow(email)
+                elif command == "unfollow":
+                    email = input("Please enter the email of the person to unfollow: ")
+                    user.unfollow(email)
+                elif command == "followmany":
+                    emails = read_email_list(input("Please enter the emails of the people to follow (comma-separated): "))
+                    user.follow_many(emails)
+                elif command == "unfollowmany":
+                    emails = read_email_list(input("Please enter the emails of the people to unfollow (comma-separated): "))
+                    user.unfollow_many(emails)
+                elif command == "suggest":
+                    user.suggest()
+                elif command == "suggestbuild":
+                    full = input("Recompute every user? [y/n]: ").lower() == "y"
+                    user.refresh_suggestions(full=full)
+                elif command == "graph":
+                    user.load_follow_graph()
+                elif command == "list":
+                    user.list_collections()
+                elif command == "checkcollections":
+                    fix = input("Repair mismatched collections? [y/n]: ").lower() == "y"
+                    user.check_collections(fix=fix)
+                elif command == "search":
+                    search_term = input("Please enter the search term[title/release_date/author/publisher/genre]: ")
+                    search_value = input("Please enter the search value: ")
+                    user.search(search_term, search_value)
+                elif command == "complete":
+                    prefix = input("Start of a title or name: ")
+                    for name in session.complete_names(prefix):
+                        print(name)
+                elif command == "sort":
+                    search_term = input("Please enter the search term[title/publisher/genre/release_date]: ")
+                    search_value = input("Please enter the search value: ")
+                    order_value = input("Please enter the order term[title/publisher/genre/released year]: ")
+                    order_by = input("Please enter the sort order[asc/desc]: ").lower()
+                    user.sort(search_term, search_value, order_value, order_by)
+                elif command == 'top20':
+                    user.top20()
+                elif command == 'follower20':
+                    user.follower20()
+                elif command == "top5new":
+                    user.top5new()
+                elif command == "feed":
+                    user.feed()
+                elif command == "mostread":
+                    days = input("Number of days to include (blank for 90): ")
+                    among_followers = input("Only count your followers? [y/n]: ").lower() == "y"
+                    user.most_read(int(days) if days.strip() else 90, among_followers)
+                elif command == "trending":
+                    user.trending()
+                elif command == "trendingrebuild":
+                    user.rebuild_trending()
+                elif command == "rec":
+                    user.recommended()
+                elif command == "recbuild":
+                    user.refresh_recommendations()
+                elif command == "cachestats":
+                    user.cache_stats()
+                elif command == "loadcatalog":
+                    path = input("Catalog dump (CSV or JSONL): ").strip()
+                    workers = input("Parallel workers (blank for one per core): ").strip()
+                    user.load_catalog(path, workers=int(workers) if workers else None)
+                elif command == "partitionsessions":
+                    user.partition_reading_sessions()
+                elif command == "archivesessions":
+                    keep_months = int(input("Months of reading history to keep: "))
+                    archive_dir = input("Directory to export archived months to (blank to only detach): ").strip() or None
+                    drop = archive_dir is not None and input("Drop exported months from the database? [y/n]: ").lower() == "y"
+                    archived = session.archive_reading_sessions(keep_months, archive_dir=archive_dir, drop=drop)
+                    print(f"Archived {len(archived)} partitions: {', '.join(archived) or 'none'}")
+                elif command == "migrate":
+                    applied = session.apply_migrations()
+                    for version, name in applied:
+                        print(f"Applied migration {version}: {name}")
+                    if not applied:
+                        print("The schema is up to date.")
+                elif command == "explain":
+                    if session.explain_capture is None:
+                        session.enable_explain()
+                        print("Explain mode on. Every statement is now run with EXPLAIN (ANALYZE, BUFFERS) first.")
+                    else:
+                        capture = session.disable_explain()
+                        print("Explain mode off.")
+                        user.explain_report(capture)
+                        path = input("Save plans to JSON file (blank to skip): ").strip()
+                        if path:
+                            capture.dump(path)
+                            print(f"Saved plans to {path}")
+                elif command == "trace":
+                    if session.tracer is None:
+                        tracer = session.enable_tracing()
+                        tracer.instrument(user, "User")
+                        print("Tracing on. Every command and statement is now timed.")
+                    else:
+                        tracer = session.disable_tracing()
+                        tracer.uninstrument(user)
+                        print("Tracing off.")
+                        user.trace_report(tracer)
+                        path = input("Save the trace to a file (blank to skip): ").strip()
+                        if path:
+                            tracer.dump(path)
+                            print(f"Saved the trace to {path}; open it in chrome://tracing or Perfetto")
+                        tracer = None
+                elif command == "cprofile":
+                    if profiler is None:
+                        profiler = cProfile.Profile()
+                        profiler.enable()
+                        print("Profiling on.")
+                    else:
+                        profiler.disable()
+                        print("Profiling off.")
+                        print_profile(profiler)
+                        path = input("Save the profile to a file (blank to skip): ").strip()
+                        if path:
+                            profiler.dump_stats(path)
+                            print(f"Saved the profile to {path}")
+                        profiler = None
+                elif command == "help":
+                    help()
+                elif command == "quit":
+                    print("Thank you for using our application!")
+                    print("""
                        ---------------------------------
                       /|                                |
                       ||                                |
@@ -189,14 +515,37 @@ def main():
                       | ================================|
                       ----------------------------------- 
                  """)
-                break
-            else:
-                print("Command not recognized. Enter 'help' to see all commands.")
-                print("Here is a list of all avaialble commands:")
-                help()
+                    break
+                else:
+                    print("Command not recognized. Enter 'help' to see all commands.")
+                    print("Here is a list of all avaialble commands:")
+                    help()
+            except RetryError as e:
+                # The connection was re-established; the session goes on and the command can be retried
+                print(e)
     except Exception as e:
         print(e)
         sys.exit()
+    finally:
+        # Tracing still on at exit goes to the --trace file
+        if arguments.trace and tracer is not None:
+            tracer.dump(arguments.trace)
+
+def main():
+    """
+    The main function of the application. The entry point which handles user interaction and command processing.
+    """
+    arguments = parse_arguments(sys.argv[1:])
+    run = run_migrations if arguments.migrate else run_batch if arguments.batch else run_interactive
+    if not arguments.profile:
+        run(arguments)
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, arguments)
+    finally:
+        profiler.dump_stats(arguments.profile)
+        print(f"Saved the profile to {arguments.profile}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,289 @@
+import sys
+import argparse
+import psycopg2
+import suggestions
+import collection_summary
+import reading_rollup
+import session_partitions
+import recommendations
+import contributors
+import book_ratings
+import trending
+import reader_sketch
+import activity_feed
+
+# The tables the application reads and writes, as the queries in connection_and_queries.py use them.
+# On an existing database every statement is a no-op; on a fresh one it creates the schema.
+BASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username VARCHAR(255) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    creation_date TIMESTAMP,
+    last_access_date TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS user_email (
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    email VARCHAR(255) NOT NULL,
+    PRIMARY KEY (user_id, email)
+);
+CREATE TABLE IF NOT EXISTS following (
+    follower INTEGER NOT NULL REFERENCES users (user_id),
+    followee INTEGER NOT NULL REFERENCES users (user_id)
+);
+CREATE TABLE IF NOT EXISTS book (
+    book_id INTEGER PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    length INTEGER
+);
+CREATE TABLE IF NOT EXISTS contributor (
+    contributor_id INTEGER PRIMARY KEY,
+    first_name VARCHAR(255),
+    last_name VARCHAR(255)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    contributor_id INTEGER NOT NULL REFERENCES contributor (contributor_id),
+    PRIMARY KEY (book_id, contributor_id)
+);
+CREATE TABLE IF NOT EXISTS publishes (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    contributor_id INTEGER NOT NULL REFERENCES contributor (contributor_id),
+    PRIMARY KEY (book_id, contributor_id)
+);
+CREATE TABLE IF NOT EXISTS edits (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    contributor_id INTEGER NOT NULL REFERENCES contributor (contributor_id),
+    PRIMARY KEY (book_id, contributor_id)
+);
+CREATE TABLE IF NOT EXISTS audience (
+    audience_id INTEGER PRIMARY KEY,
+    type VARCHAR(255) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS enjoys (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    audience_id INTEGER NOT NULL REFERENCES audience (audience_id),
+    PRIMARY KEY (book_id, audience_id)
+);
+CREATE TABLE IF NOT EXISTS genre (
+    genre_id INTEGER PRIMARY KEY,
+    type VARCHAR(255) NOT NULL
+);
+CREATE TABLE IF NOT EXISTS classifies_as (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    genre_id INTEGER NOT NULL REFERENCES genre (genre_id),
+    PRIMARY KEY (book_id, genre_id)
+);
+CREATE TABLE IF NOT EXISTS edition (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    release_date DATE
+);
+CREATE TABLE IF NOT EXISTS collection (
+    collection_id INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users (user_id)
+);
+CREATE TABLE IF NOT EXISTS part_of (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    collection_id INTEGER NOT NULL REFERENCES collection (collection_id)
+);
+CREATE TABLE IF NOT EXISTS rating (
+    book_id INTEGER NOT NULL REFERENCES book (book_id),
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    stars INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reading_session (
+    session_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP,
+    pages_read INTEGER
+);
+CREATE TABLE IF NOT EXISTS "book+session" (
+    book_id INTEGER NOT NULL,
+    session_id INTEGER NOT NULL
+);
+"""
+
+# Indexes behind the lookups each Connection method makes. The comment on each names the methods that use it.
+INDEXES = [
+    # login, join, find_user
+    ("users_username_idx", "CREATE INDEX IF NOT EXISTS users_username_idx ON users (username)"),
+    # follow, unfollow, resolve_emails, suggested_users
+    ("user_email_email_idx", "CREATE INDEX IF NOT EXISTS user_email_email_idx ON user_email (email)"),
+    # add/remove_book_from_collection, rate_a_book, read_book, search_books and sort_books by title
+    ("book_title_idx", "CREATE INDEX IF NOT EXISTS book_title_idx ON book (title)"),
+    # create/delete/rename collection, add/remove_book_from_collection, get_collections, collection_info
+    ("collection_user_name_idx", "CREATE INDEX IF NOT EXISTS collection_user_name_idx ON collection (user_id, name)"),
+    # add/remove_book_from_collection, delete_collection
+    ("part_of_collection_idx", "CREATE INDEX IF NOT EXISTS part_of_collection_idx ON part_of (collection_id, book_id)"),
+    # follower_info (followers), follower20
+    ("following_followee_idx", "CREATE INDEX IF NOT EXISTS following_followee_idx ON following (followee, follower)"),
+    # top20, follower20, top5new, recommendations, search_books
+    ("rating_book_idx", "CREATE INDEX IF NOT EXISTS rating_book_idx ON rating (book_id)"),
+    # top_rated_books
+    ("rating_user_idx", "CREATE INDEX IF NOT EXISTS rating_user_idx ON rating (user_id)"),
+    # top20
+    ("reading_session_start_time_idx", "CREATE INDEX IF NOT EXISTS reading_session_start_time_idx ON reading_session (start_time)"),
+    # follower20, recommendations
+    ("reading_session_user_idx", "CREATE INDEX IF NOT EXISTS reading_session_user_idx ON reading_session (user_id)"),
+    # anything still joining reading_session through "book+session"
+    ("book_session_session_idx", 'CREATE INDEX IF NOT EXISTS book_session_session_idx ON "book+session" (session_id)'),
+    # recommendations
+    ("classifies_as_genre_idx", "CREATE INDEX IF NOT EXISTS classifies_as_genre_idx ON classifies_as (genre_id)"),
+    # top5new
+    ("edition_release_date_idx", "CREATE INDEX IF NOT EXISTS edition_release_date_idx ON edition (release_date)"),
+    # search_books and sort_books by author and publisher
+    ("contributor_name_idx", "CREATE INDEX IF NOT EXISTS contributor_name_idx ON contributor (last_name, first_name)"),
+]
+
+# follow_many and unfollow_many rely on (follower, followee) being unique for ON CONFLICT DO NOTHING
+FOLLOWING_UNIQUE = """
+DELETE FROM following f
+USING following d
+WHERE f.ctid > d.ctid AND f.follower = d.follower AND f.followee = d.followee;
+CREATE UNIQUE INDEX IF NOT EXISTS following_pair_idx ON following (follower, followee);
+"""
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+class SchemaOutdatedError(Exception):
+    """
+    Raised when the database is missing migrations the application's queries depend on.
+    """
+
+    def __init__(self, pending):
+        self.pending = pending
+        super().__init__(
+            "The database schema is behind this version of the application. Pending migrations: "
+            + ", ".join(f"{version} ({name})" for version, name in pending)
+            + ". Run main.py --migrate to apply them."
+        )
+
+def _sql(statement):
+    def apply(cursor):
+        cursor.execute(statement)
+    return apply
+
+def _indexes(cursor):
+    for name, statement in INDEXES:
+        cursor.execute(statement)
+
+# Every schema change the application depends on, in the order they must be applied. Each is called with
+# a cursor and runs in the same transaction that records its version, so it must not commit.
+# Never edit or reorder an applied migration; append a new one instead.
+MIGRATIONS = [
+    (1, "base schema", _sql(BASE_SCHEMA)),
+    (2, "monthly reading_session partitions", session_partitions.partition),
+    (3, "lookup indexes", _indexes),
+    (4, "unique follow pairs", _sql(FOLLOWING_UNIQUE)),
+    (5, "follow suggestions", suggestions.create_tables),
+    (6, "collection summaries", collection_summary.create_columns),
+    (7, "daily reading rollups", lambda cursor: (reading_rollup.create_table(cursor), reading_rollup.backfill(cursor))),
+    (8, "precomputed recommendations", recommendations.create_tables),
+    (9, "contributor name and role indexes", _sql(contributors.CONTRIBUTOR_INDEXES)),
+    (10, "book rating summaries", book_ratings.create_columns),
+    (11, "trending scores", _sql(trending.TRENDING_TABLE)),
+    (12, "distinct reader sketches", reader_sketch.create_table),
+    (13, "activity feeds", _sql(activity_feed.FEED_TABLES)),
+    # 14 is not used: it was a rating dedupe that has been withdrawn
+    (15, "rating timestamps", _sql(book_ratings.RATED_AT_COLUMN)),
+    # Needs rating.rated_at from 15
+    (16, "trending scores from reading and rating history", trending.rebuild),
+    # For databases whose version 2 only added reading_session.book_id; a no-op where 2 partitioned the table
+    (17, "monthly reading_session partitions where version 2 skipped them", session_partitions.partition),
+]
+
+def applied_versions(connection):
+    """
+    Returns:
+        set of int: The versions already recorded in schema_migrations.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(MIGRATIONS_TABLE)
+        cursor.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cursor.fetchall()}
+    connection.commit()
+    return versions
+
+def status(connection):
+    """
+    Returns:
+        list of tuples: (version, name, applied) for every known migration.
+    """
+    applied = applied_versions(connection)
+    return [(version, name, version in applied) for version, name, apply in MIGRATIONS]
+
+def check(connection):
+    """
+    Makes sure every migration has been applied. The application's queries assume the latest schema,
+    so it refuses to run against an older one instead of failing command by command.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+
+    Raises:
+        SchemaOutdatedError: If any migration is pending.
+    """
+    pending = [(version, name) for version, name, applied in status(connection) if not applied]
+    if pending:
+        raise SchemaOutdatedError(pending)
+
+def migrate(connection, target=None):
+    """
+    Applies every pending migration up to target, each in its own transaction together with its
+    schema_migrations row, so a failed or interrupted migration leaves nothing behind.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        target (int): The last version to apply, None for all of them.
+
+    Returns:
+        list of tuples: (version, name) of the migrations applied.
+    """
+    applied = applied_versions(connection)
+    done = []
+    for version, name, apply in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+        try:
+            with connection.cursor() as cursor:
+                apply(cursor)
+                cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)', (version, name))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        done.append((version, name))
+    return done
+
+def main(argv=None):
+    """
+    Applies migrations to a database reached directly (e.g. a local Postgres), without the SSH tunnel.
+    """
+    parser = argparse.ArgumentParser(description="Applies the Books Platform schema migrations.")
+    parser.add_argument("dsn", help='libpq connection string, e.g. "dbname=books host=localhost"')
+    parser.add_argument("--target", type=int, help="last migration version to apply")
+    parser.add_argument("--status", action="store_true", help="only list the migrations and whether they are applied")
+    arguments = parser.parse_args(argv)
+    connection = psycopg2.connect(arguments.dsn)
+    try:
+        if arguments.status:
+            for version, name, applied in status(connection):
+                print(f"{version:3d} {'applied' if applied else 'pending':8s} {name}")
+            return
+        for version, name in migrate(connection, target=arguments.target):
+            print(f"Applied migration {version}: {name}")
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+import datetime
+from psycopg2.extras import execute_values
+from follow_graph import user_key
+
+# HyperLogLog sketches of each book's distinct readers per day. Each sketch has 2^PRECISION registers,
+# for a standard error of about 1.04 / sqrt(2^PRECISION) (3.3%). Only non-empty registers are stored,
+# one row each, so sketches merge in SQL with MAX(rank) over any range of days.
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+READER_SKETCH_TABLE = """
+CREATE TABLE IF NOT EXISTS book_reader_sketch (
+    book_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    register SMALLINT NOT NULL,
+    rank SMALLINT NOT NULL,
+    PRIMARY KEY (book_id, day, register)
+);
+"""
+
+# Hashes each reader with Postgres' 64-bit hashtextextended. The low PRECISION bits pick the register;
+# the rank is the position of the first 1 bit in the next 54 bits (55 if they are all zero).
+_REGISTERS_OF = f"""
+SELECT book_id, day,
+       (h & {REGISTERS - 1})::SMALLINT AS register,
+       MAX(55 - length(ltrim((h >> {PRECISION})::BIT(54)::TEXT, '0')))::SMALLINT AS rank
+FROM (
+    SELECT book_id, day, hashtextextended(user_id::TEXT, 0) AS h
+    FROM {{source}}
+) hashed
+GROUP BY book_id, day, register
+"""
+
+_UPSERT = """
+INSERT INTO book_reader_sketch (book_id, day, register, rank)
+{registers}
+ON CONFLICT (book_id, day, register) DO UPDATE
+SET rank = GREATEST(book_reader_sketch.rank, EXCLUDED.rank)
+"""
+
+# Adds the readers in {source}, any relation with (book_id, day, user_id) columns, to the sketches
+UPSERT_READERS = _UPSERT.format(registers=_REGISTERS_OF)
+
+RECORD_READERS = UPSERT_READERS.format(source="(VALUES %s) AS v(book_id, day, user_id)")
+
+BACKFILL = UPSERT_READERS.format(source="""(
+        SELECT rs.book_id, rs.start_time::DATE AS day, rs.user_id
+        FROM reading_session rs
+        WHERE rs.book_id IS NOT NULL
+    ) sessions""")
+
+# Merges each book's sketches over a range of days and turns them into a distinct-reader estimate,
+# switching to linear counting while many registers are still empty
+MOST_READ = f"""
+WITH merged AS (
+    SELECT book_id, register, MAX(rank) AS rank
+    FROM book_reader_sketch
+    WHERE day BETWEEN %s AND %s
+    GROUP BY book_id, register
+),
+sums AS (
+    SELECT book_id, COUNT(*) AS filled, SUM(POWER(2.0, -rank)) AS harmonic
+    FROM merged
+    GROUP BY book_id
+),
+estimates AS (
+    SELECT book_id, filled, {ALPHA} * {REGISTERS} * {REGISTERS} / (({REGISTERS} - filled) + harmonic) AS raw
+    FROM sums
+)
+SELECT book_id,
+       CASE WHEN raw <= 2.5 * {REGISTERS} AND filled < {REGISTERS}
+            THEN {REGISTERS} * LN({REGISTERS}.0 / ({REGISTERS} - filled))
+            ELSE raw END AS readers
+FROM estimates
+ORDER BY readers DESC
+LIMIT %s
+"""
+
+def create_table(cursor):
+    """
+    Creates the sketch table and fills it from the reading history. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(READER_SKETCH_TABLE)
+    cursor.execute(BACKFILL)
+
+def record_readers(cursor, readers):
+    """
+    Adds readers to the sketches. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A cursor on the caller's connection.
+        readers (list of tuples): (book_id, day, user_id) per reading session.
+    """
+    execute_values(cursor, RECORD_READERS, [(book_id, day, user_key(user_id)) for book_id, day, user_id in readers])
+
+def most_read(cursor, days=90, n=20, today=None):
+    """
+    Ranks books by estimated distinct readers over the last days days.
+
+    Parameters:
+        cursor: A database cursor.
+        days (int): How many days back to include (today counts as one).
+        n (int): How many books to return.
+        today (date): The last day of the range, defaults to today.
+
+    Returns:
+        list of tuples: (book_id, estimated readers), most readers first.
+    """
+    today = today or datetime.date.today()
+    cursor.execute(MOST_READ, (today - datetime.timedelta(days=days - 1), today, n))
+    return [(book_id, round(readers)) for book_id, readers in cursor.fetchall()]
@@ -0,0 +1,138 @@
+import datetime
+from psycopg2.extras import execute_values
+from follow_graph import user_key
+
+# Per-user, per-book, per-day reading totals, maintained alongside reading_session
+READING_ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS reading_daily (
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    pages INTEGER NOT NULL DEFAULT 0,
+    minutes INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, book_id)
+);
+"""
+
+# Rebuilds every rollup row from the raw sessions; sessions count toward the day they started.
+# The lock holds off read_book's upserts until the rebuild commits, so a session committed after the
+# rebuild read reading_session is added on top of the rebuilt rows rather than lost or counted twice.
+BACKFILL = """
+LOCK TABLE reading_daily IN SHARE ROW EXCLUSIVE MODE;
+DELETE FROM reading_daily;
+INSERT INTO reading_daily (user_id, book_id, day, pages, minutes, sessions)
+SELECT rs.user_id, rs.book_id, rs.start_time::date,
+       SUM(rs.pages_read),
+       SUM(EXTRACT(EPOCH FROM rs.end_time - rs.start_time) / 60)::INTEGER,
+       COUNT(*)
+FROM reading_session rs
+WHERE rs.book_id IS NOT NULL
+GROUP BY rs.user_id, rs.book_id, rs.start_time::date;
+"""
+
+# Adds (user_id, book_id, day, pages, minutes, sessions) rows to the rollups; {rows} is a VALUES list or a SELECT
+UPSERT = """
+INSERT INTO reading_daily (user_id, book_id, day, pages, minutes, sessions) {rows}
+ON CONFLICT (user_id, day, book_id) DO UPDATE
+SET pages = reading_daily.pages + EXCLUDED.pages,
+    minutes = reading_daily.minutes + EXCLUDED.minutes,
+    sessions = reading_daily.sessions + EXCLUDED.sessions
+"""
+
+def create_table(cursor):
+    """
+    Creates the reading_daily table if it does not exist yet.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(READING_ROLLUP_TABLE)
+
+def backfill(cursor):
+    """
+    Recomputes reading_daily from reading_session. Safe to re-run; existing rows are replaced, so
+    rows left over from deleted sessions go too. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    cursor.execute(BACKFILL)
+    # With several statements in one execute, rowcount is the last one's: the rows inserted
+    return cursor.rowcount
+
+def record_sessions(cursor, sessions):
+    """
+    Adds reading sessions to the rollups. Runs in the caller's transaction, so the rollups
+    commit together with the sessions themselves.
+
+    Parameters:
+        cursor: A cursor on the caller's connection.
+        sessions (list of tuples): (user_id, book_id, start_time, end_time, pages_read) per session.
+    """
+    # Sessions for the same row must be combined first, since one upsert cannot touch a row twice
+    totals = {}
+    for user_id, book_id, start_time, end_time, pages_read in sessions:
+        key = (user_key(user_id), book_id, start_time.date())
+        pages, minutes, count = totals.get(key, (0, 0, 0))
+        totals[key] = (pages + pages_read, minutes + int((end_time - start_time).total_seconds() // 60), count + 1)
+    execute_values(cursor, UPSERT.format(rows="VALUES %s"), [key + value for key, value in totals.items()])
+
+def reading_stats(cursor, user_id, days=None, today=None):
+    """
+    Summarizes a user's reading from the rollups. Reads one row per day in the range.
+
+    Parameters:
+        cursor: A database cursor.
+        user_id (int): The user's ID.
+        days (int): How many days back to include (today counts as one), None for all time.
+        today (date): The last day of the range, defaults to today.
+
+    Returns:
+        dict: pages, minutes, sessions, days_read, books, current_streak and longest_streak.
+
+    Raises:
+        ValueError: If days is less than 1.
+    """
+    if days is not None and days < 1:
+        raise ValueError("The number of days must be at least 1.")
+    user_id = user_key(user_id)
+    today = today or datetime.date.today()
+    first_day = today - datetime.timedelta(days=days - 1) if days is not None else datetime.date.min
+    cursor.execute("""
+        SELECT day, SUM(pages), SUM(minutes), SUM(sessions)
+        FROM reading_daily
+        WHERE user_id = %s AND day BETWEEN %s AND %s
+        GROUP BY day
+        ORDER BY day
+    """, (user_id, first_day, today))
+    per_day = cursor.fetchall()
+    cursor.execute("""
+        SELECT COUNT(DISTINCT book_id)
+        FROM reading_daily
+        WHERE user_id = %s AND day BETWEEN %s AND %s
+    """, (user_id, first_day, today))
+    books = cursor.fetchone()[0]
+
+    longest_streak = 0
+    streak = 0
+    previous = None
+    for day, pages, minutes, sessions in per_day:
+        streak = streak + 1 if previous is not None and day - previous == datetime.timedelta(days=1) else 1
+        longest_streak = max(longest_streak, streak)
+        previous = day
+    # The current streak is still alive if the last reading day was today or yesterday
+    current_streak = streak if previous is not None and today - previous <= datetime.timedelta(days=1) else 0
+
+    return {
+        "pages": sum(row[1] for row in per_day),
+        "minutes": sum(row[2] for row in per_day),
+        "sessions": sum(row[3] for row in per_day),
+        "days_read": len(per_day),
+        "books": books,
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+    }
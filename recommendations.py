@@ -0,0 +1,180 @@
+import os
+import psycopg2
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from psycopg2.extras import execute_values
+from follow_graph import user_key
+
+# Precomputed recommendations, rebuilt by the nightly job. recommendation_computed records which
+# users the job has covered, so a user with no recommendations is not recomputed live on every request.
+RECOMMENDATION_TABLES = """
+CREATE TABLE IF NOT EXISTS book_recommendation (
+    user_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    author_first_name VARCHAR(255),
+    author_last_name VARCHAR(255),
+    avg_rating NUMERIC NOT NULL,
+    PRIMARY KEY (user_id, rank)
+);
+CREATE TABLE IF NOT EXISTS recommendation_computed (
+    user_id INTEGER PRIMARY KEY,
+    computed_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+# A user's top 10 unread books from their two most-read genres, by average rating
+RECOMMENDATIONS_QUERY = """
+WITH user_books AS (
+    SELECT DISTINCT rs.book_id
+    FROM reading_session rs
+    WHERE rs.user_id = %s
+),
+user_genres AS (
+    SELECT ca.genre_id, COUNT(ca.genre_id) AS genre_count
+    FROM classifies_as ca
+    JOIN user_books ub ON ca.book_id = ub.book_id
+    GROUP BY ca.genre_id
+    ORDER BY genre_count DESC
+    LIMIT 2
+),
+top_books AS (
+    SELECT r.book_id,
+           AVG(r.stars) AS avg_rating,
+           COUNT(CASE WHEN r.stars = 5 THEN 1 END) AS five_star_count
+    FROM rating r
+    JOIN classifies_as ca ON r.book_id = ca.book_id
+    JOIN user_genres ug ON ca.genre_id = ug.genre_id
+    WHERE r.book_id NOT IN (SELECT book_id FROM user_books)
+    GROUP BY r.book_id
+),
+ranked_books AS (
+    SELECT DISTINCT ON (b.title)
+           b.title,
+           c.first_name AS author_first_name,
+           c.last_name AS author_last_name,
+           tb.avg_rating,
+           tb.five_star_count
+    FROM top_books tb
+    JOIN book b ON tb.book_id = b.book_id
+    LEFT JOIN writes w ON b.book_id = w.book_id
+    LEFT JOIN contributor c ON w.contributor_id = c.contributor_id
+    ORDER BY b.title, tb.avg_rating DESC, tb.five_star_count DESC
+)
+SELECT title, author_first_name, author_last_name, avg_rating
+FROM ranked_books
+ORDER BY avg_rating DESC, five_star_count DESC
+LIMIT 10;
+"""
+
+# Number of users each worker computes and commits at a time
+CHUNK_SIZE = 200
+
+# Worker state, set once per process by _init_worker
+_connection = None
+
+def create_tables(cursor):
+    """
+    Creates the recommendation tables if they do not exist yet. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(RECOMMENDATION_TABLES)
+
+def active_users(connection, active_days):
+    """
+    Returns:
+        list of int: The users who accessed the platform in the last active_days days.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT user_id FROM users WHERE last_access_date >= NOW() - %s * INTERVAL '1 day' ORDER BY user_id",
+            (active_days,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+def _init_worker(parameters):
+    global _connection
+    _connection = psycopg2.connect(**parameters)
+    # Closed when the worker process exits normally, i.e. after the pool is closed and joined
+    Finalize(None, _connection.close, exitpriority=10)
+
+def _compute_chunk(user_ids):
+    """
+    Computes and stores the recommendations for a chunk of users on this worker's connection.
+
+    Returns:
+        int: The number of users in the chunk.
+    """
+    rows = []
+    with _connection.cursor() as cursor:
+        for user_id in user_ids:
+            cursor.execute(RECOMMENDATIONS_QUERY, (user_id,))
+            for rank, (title, first_name, last_name, avg_rating) in enumerate(cursor.fetchall(), start=1):
+                rows.append((user_id, rank, title, first_name, last_name, avg_rating))
+        cursor.execute('DELETE FROM book_recommendation WHERE user_id = ANY(%s)', (user_ids,))
+        execute_values(
+            cursor,
+            'INSERT INTO book_recommendation (user_id, rank, title, author_first_name, author_last_name, avg_rating) VALUES %s',
+            rows
+        )
+        execute_values(
+            cursor,
+            'INSERT INTO recommendation_computed (user_id) VALUES %s '
+            'ON CONFLICT (user_id) DO UPDATE SET computed_at = NOW()',
+            [(user_id,) for user_id in user_ids]
+        )
+    _connection.commit()
+    return len(user_ids)
+
+def precompute_recommendations(connection, parameters, workers=None, active_days=30):
+    """
+    Recomputes the recommendations of every active user and stores them in book_recommendation.
+
+    The users are split into chunks that a process pool works through; each worker has its own
+    database connection, computes its chunks and commits them itself, so throughput grows with
+    the number of workers until the database is saturated.
+
+    Parameters:
+        connection: An open psycopg2 connection, used to find the active users.
+        parameters (dict): psycopg2.connect keyword arguments for the worker connections.
+        workers (int): Number of worker processes, defaults to the number of cores.
+        active_days (int): Users who accessed the platform within this many days are recomputed.
+
+    Returns:
+        int: The number of users recomputed.
+    """
+    user_ids = active_users(connection, active_days)
+    connection.commit()
+    chunks = [user_ids[i:i + CHUNK_SIZE] for i in range(0, len(user_ids), CHUNK_SIZE)]
+    with Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=(parameters,)) as pool:
+        count = sum(pool.imap_unordered(_compute_chunk, chunks))
+        # Leaving the block terminates the workers, which skips their cleanup; let them exit on their own
+        pool.close()
+        pool.join()
+    return count
+
+def stored_recommendations(cursor, user_id):
+    """
+    Reads a user's precomputed recommendations.
+
+    Parameters:
+        cursor: A database cursor.
+        user_id (int): The user's ID.
+
+    Returns:
+        list of tuples: (title, author first name, author last name, average rating) in rank order,
+                        or None if the nightly job has not covered the user yet.
+    """
+    user_id = user_key(user_id)
+    cursor.execute('SELECT 1 FROM recommendation_computed WHERE user_id = %s', (user_id,))
+    if cursor.fetchone() is None:
+        return None
+    cursor.execute("""
+        SELECT title, author_first_name, author_last_name, avg_rating
+        FROM book_recommendation
+        WHERE user_id = %s
+        ORDER BY rank
+    """, (user_id,))
+    return cursor.fetchall()
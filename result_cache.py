@@ -0,0 +1,234 @@
+import time
+import functools
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    A size-bounded LRU cache of read-method results, indexed by the tables each result depends on
+    so that a write to a table drops exactly the entries that read it.
+    """
+
+    def __init__(self, max_entries=1024, default_ttl=None, ttls=None):
+        """
+        Parameters:
+            max_entries (int): Maximum number of cached results; the least recently used is evicted first.
+            default_ttl (float): Seconds a result stays valid, None for no expiry.
+            ttls (dict): Per-method TTL overrides in seconds, keyed by method name.
+        """
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = dict(ttls or {})
+        self.entries = OrderedDict()  # key -> (value, expires_at, tables)
+        self.by_table = {}  # table -> set of keys
+        self.lock = threading.Lock()
+        self.method_stats = {}
+        self.invalidations = 0
+        self.invalidated_at = {}  # table -> value of invalidations when it was last written
+        self.pending = {}  # key -> future of a prefetch still computing it
+
+    def _stats_for(self, method):
+        if method not in self.method_stats:
+            self.method_stats[method] = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+        return self.method_stats[method]
+
+    def _remove(self, key):
+        value, expires_at, tables = self.entries.pop(key)
+        for table in tables:
+            keys = self.by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_table[table]
+
+    def get(self, key):
+        """
+        Looks up a cached result.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss.
+        """
+        method = key[0]
+        with self.lock:
+            stats = self._stats_for(method)
+            entry = self.entries.get(key)
+            if entry is None:
+                stats["misses"] += 1
+                return False, None
+            value, expires_at, tables = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                stats["expired"] += 1
+                stats["misses"] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            stats["hits"] += 1
+            return True, value
+
+    def version(self):
+        """
+        Returns:
+            int: A marker to pass to put() as since, taken before the result is read.
+        """
+        with self.lock:
+            return self.invalidations
+
+    def put(self, key, value, tables, ttl=None, since=None):
+        """
+        Stores a result.
+
+        Parameters:
+            key (tuple): (method name, arguments...).
+            value: The result to cache.
+            tables (tuple of str): The tables the result was read from.
+            ttl (float): The method's declared TTL, used unless overridden in ttls.
+            since (int): version() from before the result was read. If one of its tables was written
+                         since, the result may be stale and is not stored.
+        """
+        method = key[0]
+        ttl = self.ttls.get(method, ttl if ttl is not None else self.default_ttl)
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            if since is not None and any(self.invalidated_at.get(table, -1) >= since for table in tables):
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, expires_at, tables)
+            for table in tables:
+                self.by_table.setdefault(table, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                self._stats_for(oldest[0])["evicted"] += 1
+                self._remove(oldest)
+
+    def invalidate(self, tables):
+        """
+        Drops every cached result that depends on any of the given tables.
+
+        Parameters:
+            tables (iterable of str): The tables that were written.
+        """
+        with self.lock:
+            for table in tables:
+                self.invalidated_at[table] = self.invalidations
+                for key in list(self.by_table.get(table, ())):
+                    self._stats_for(key[0])["invalidated"] += 1
+                    self._remove(key)
+            self.invalidations += 1
+
+    def expect(self, key, future):
+        """
+        Registers a prefetch that will put key, so a lookup arriving first waits for it instead of
+        running the same query again.
+
+        Parameters:
+            key (tuple): The cache key the prefetch fills.
+            future (Future): Done when the prefetch has finished.
+        """
+        with self.lock:
+            self.pending[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def wait_for(self, key):
+        """
+        Waits for a prefetch of key that is still running, if there is one. A failed prefetch is ignored.
+        """
+        with self.lock:
+            future = self.pending.get(key)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_table.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Per-method counters plus a hit rate, and the current number of entries.
+        """
+        with self.lock:
+            report = {}
+            for method, stats in self.method_stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                report[method] = dict(stats, hit_rate=stats["hits"] / lookups if lookups else 0.0)
+            return {"entries": len(self.entries), "methods": report}
+
+def _freeze(value):
+    """
+    Turns lists (e.g. email lists) into tuples so arguments can be used as a cache key.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+def cache_key(method_name, args, kwargs):
+    """
+    Returns:
+        tuple: The key a reads() method caches its result for these arguments under.
+    """
+    return (method_name, _freeze(args), _freeze(kwargs))
+
+def reads(*tables, ttl=None):
+    """
+    Declares that a Connection method only reads the given tables, so its results can be cached
+    in the connection's result_cache (when one is enabled) until one of those tables is written.
+    Being read-only, the method is also safe to retry after a reconnect.
+
+    Parameters:
+        tables (str): The tables the method reads.
+        ttl (float): How long results stay valid regardless of writes, for methods that depend on the clock.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = self.result_cache
+            if cache is None:
+                return self.run_with_reconnect(method, args, kwargs, retry=True)
+            key = cache_key(method.__name__, args, kwargs)
+            cache.wait_for(key)
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            since = cache.version()
+            value = self.run_with_reconnect(method, args, kwargs, retry=True)
+            # Errors are reported as None, which should not be cached. Inside grouped_commits() the result
+            # may include the group's uncommitted writes, which a rollback would take back.
+            if value is not None and not self.group_commits:
+                cache.put(key, value, tables, ttl, since=since)
+            return value
+        wrapper.reads_tables = tables
+        wrapper.reads_ttl = ttl
+        return wrapper
+    return decorator
+
+def writes(*tables):
+    """
+    Declares that a Connection method writes the given tables, so cached results that read them
+    are dropped once it returns (or raises).
+
+    Parameters:
+        tables (str): The tables the method writes.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return self.run_with_reconnect(method, args, kwargs, retry=False)
+            finally:
+                if self.result_cache is not None:
+                    self.result_cache.invalidate(tables)
+        wrapper.writes_tables = tables
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+import sys
+import argparse
+import datetime
+from connection_and_queries import Connection
+import migrations
+
+# The most round trips each write path may take: its statements plus its COMMIT. psycopg2's BEGIN
+# before the first statement of a transaction comes on top and is the same for every method.
+ROUND_TRIP_BUDGETS = {
+    "join": 2,
+    "login": 2,
+    "create_collection": 2,
+    "delete_collection": 2,
+    "read_book": 2,
+}
+
+# Fixture rows the calls use, created inside the rolled-back transaction
+FIXTURES = """
+INSERT INTO book (book_id, title, length)
+SELECT COALESCE(MAX(book_id), 0) + 1, 'Round Trip Check', 100 FROM book;
+"""
+
+def count_round_trips(connection, call):
+    """
+    Runs call and counts the statements it sends and the commits it asks for.
+
+    Parameters:
+        connection (Connection): A connection with tracing enabled.
+        call (callable): Takes the Connection.
+
+    Returns:
+        tuple: (statements, commits).
+    """
+    events = connection.tracer.events
+    first = len(events)
+    call(connection)
+    new = events[first:]
+    statements = sum(1 for event in new if event.get("cat") == "sql")
+    commits = sum(1 for event in new if event.get("name") == "Connection.commit")
+    return statements, commits
+
+def calls():
+    """
+    Returns:
+        list of tuples: (method name, callable taking the Connection), in an order where each call
+                        can use what the earlier ones created.
+    """
+    now = datetime.datetime.now()
+    state = {}
+
+    def join(c):
+        state["user_id"] = c.join("round_trip_check", "round_trip_check@example.com", "x", "Round", "Trip")
+
+    return [
+        ("join", join),
+        ("login", lambda c: c.login("round_trip_check", "x")),
+        ("create_collection", lambda c: c.create_collection(state["user_id"], "round trips")),
+        ("delete_collection", lambda c: c.delete_collection(state["user_id"], "round trips")),
+        ("read_book", lambda c: c.read_book(state["user_id"], "Round Trip Check", now,
+                                            now + datetime.timedelta(minutes=3), 1, 2)),
+    ]
+
+def run(connection):
+    """
+    Counts the round trips of every method in ROUND_TRIP_BUDGETS inside one transaction that is rolled
+    back at the end, so the database is left unchanged.
+
+    Returns:
+        list of dicts: method, statements, commits, round_trips and budget per method.
+    """
+    results = []
+    connection.enable_tracing()
+    try:
+        with connection.grouped_commits():
+            connection.cursor.execute(FIXTURES)
+            for method, call in calls():
+                statements, commits = count_round_trips(connection, call)
+                results.append({"method": method, "statements": statements, "commits": commits,
+                                "round_trips": statements + commits, "budget": ROUND_TRIP_BUDGETS[method]})
+            connection.group_failed = True
+    finally:
+        connection.disable_tracing()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Counts the database round trips of each write path and fails if one exceeds its budget."
+    )
+    parser.add_argument("--database", required=True, help="name of a local, disposable database")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    arguments = parser.parse_args(argv)
+
+    parameters = {"database": arguments.database, "host": arguments.host, "port": arguments.port}
+    if arguments.user:
+        parameters["user"] = arguments.user
+    if arguments.password:
+        parameters["password"] = arguments.password
+    connection = Connection.direct(**parameters)
+    try:
+        migrations.migrate(connection.connection)
+        results = run(connection)
+    finally:
+        connection.close()
+
+    print(f"{'method':20s} {'statements':>10s} {'commits':>8s} {'round trips':>12s} {'budget':>7s}")
+    over = [result for result in results if result["round_trips"] > result["budget"]]
+    for result in results:
+        flag = "  OVER" if result in over else ""
+        print(f"{result['method']:20s} {result['statements']:10d} {result['commits']:8d} "
+              f"{result['round_trips']:12d} {result['budget']:7d}{flag}")
+    sys.exit(1 if over else 0)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
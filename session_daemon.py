@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import queue
+import socket
+import argparse
+import threading
+import socketserver
+from getpass import getpass
+
+# Only the standard library is imported at the top: the client side (run, status, stop) must start fast,
+# and the database modules are loaded by serve() alone.
+
+DEFAULT_SOCKET = os.path.expanduser("~/.books-platform.sock")
+
+# Database connections the daemon keeps open through its tunnel; each request borrows one
+DEFAULT_POOL_SIZE = 4
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Answers one client: every line it sends is a batch record (see batch.parse_records) or a
+    {"control": ...} message, and every answer is one JSON line.
+    """
+
+    def handle(self):
+        # Users found for this client only: a lookup is checked against the password each client sends
+        users = {}
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                result = self.server.daemon.handle(record, users)
+            except ValueError as e:
+                result = {"ok": False, "error": f"Invalid request: {e}"}
+            self.wfile.write((json.dumps(result, default=str) + "\n").encode())
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class SessionDaemon:
+    """
+    Holds one SSH tunnel, a pool of database connections through it and a result cache they all share,
+    and runs batch commands sent by CLI processes over a Unix socket. Short CLI runs skip the SSH login
+    and connection setup, and find the cache as earlier runs left it.
+
+    The socket is only accessible to the user who started the daemon. Commands name their user with
+    a password, as batch records do; a daemon started with --admin also runs admin commands and
+    records without a password.
+    """
+
+    def __init__(self, session, hash_password, pool_size=DEFAULT_POOL_SIZE, admin=False):
+        """
+        Parameters:
+            session (Connection): The tunnel-owning connection, with the result cache enabled.
+            hash_password (callable): Hashes plaintext passwords, as the interactive CLI does.
+            pool_size (int): Number of pooled connections.
+            admin (bool): Whether to run admin commands and records without a password.
+        """
+        from batch import BatchRunner
+        self.session = session
+        self.runner = BatchRunner(None, None, hash_password, admin=admin)
+        self.pool = queue.Queue()
+        self.connections = [session] + [session.worker_connection() for _ in range(pool_size - 1)]
+        for connection in self.connections:
+            self.pool.put(connection)
+        self.served = 0
+        self.server = None
+
+    def handle(self, record, users):
+        """
+        Runs one record on a pooled connection.
+
+        Parameters:
+            record (dict): A batch record or control message.
+            users (dict): The calling client's found users, see BatchRunner.find_user.
+
+        Returns:
+            dict: The result, in the same form as a batch result line.
+        """
+        control = record.get("control")
+        if control == "status":
+            return {"ok": True, "result": self.status()}
+        if control == "stop":
+            threading.Thread(target=self.server.shutdown).start()
+            return {"ok": True, "result": "stopping"}
+        result = {"username": record.get("username"), "command": record.get("command")}
+        connection = self.pool.get()
+        try:
+            result["result"] = self.runner.run_command(connection, users, record)
+            result["ok"] = True
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+            connection.rollback()
+        finally:
+            self.pool.put(connection)
+        self.served += 1
+        return result
+
+    def status(self):
+        """
+        Returns:
+            dict: Pool size, commands served and result cache statistics.
+        """
+        cache = self.session.result_cache
+        return {
+            "pid": os.getpid(),
+            "connections": len(self.connections),
+            "served": self.served,
+            "cache": cache.stats() if cache is not None else None,
+        }
+
+    def serve(self, socket_path):
+        """
+        Listens on socket_path until a stop message arrives, then closes the pooled connections and the tunnel.
+        """
+        if os.path.exists(socket_path):
+            if is_running(socket_path):
+                raise RuntimeError(f"A session daemon is already listening on {socket_path}.")
+            os.unlink(socket_path)  # Left over from a daemon that did not shut down cleanly
+        previous_umask = os.umask(0o177)
+        try:
+            self.server = _Server(socket_path, _Handler)
+        finally:
+            os.umask(previous_umask)
+        self.server.daemon = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(socket_path)
+            for connection in self.connections[1:]:
+                connection.close()
+            self.session.close()
+
+def _connect(socket_path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    return client
+
+def is_running(socket_path=DEFAULT_SOCKET):
+    """
+    Returns:
+        bool: Whether a daemon is accepting connections on socket_path.
+    """
+    try:
+        _connect(socket_path).close()
+        return True
+    except OSError:
+        return False
+
+def send(records, socket_path=DEFAULT_SOCKET):
+    """
+    Sends records to the daemon one at a time over a single connection.
+
+    Parameters:
+        records (iterable of dicts): Batch records or control messages.
+        socket_path (str): The daemon's socket.
+
+    Yields:
+        dict: The daemon's answer to each record, in order.
+    """
+    with _connect(socket_path) as client, client.makefile("rwb") as stream:
+        for record in records:
+            stream.write((json.dumps(record) + "\n").encode())
+            stream.flush()
+            answer = stream.readline()
+            if not answer:
+                raise ConnectionError("The session daemon closed the connection.")
+            yield json.loads(answer)
+
+def run_batch(lines, output, socket_path=DEFAULT_SOCKET):
+    """
+    Runs JSONL batch input through the daemon and writes one result line per record, as batch mode does.
+
+    Parameters:
+        lines (iterable of str): JSONL input lines.
+        output (file): Where result lines are written.
+        socket_path (str): The daemon's socket.
+    """
+    numbered = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            numbered.append((line_number, json.loads(line), None))
+        except ValueError as e:
+            # Answered here, as the daemon would answer it, so the other records still run
+            numbered.append((line_number, None, {"ok": False, "error": f"Invalid request: {e}"}))
+    answers = send((record for line_number, record, invalid in numbered if invalid is None), socket_path)
+    for line_number, record, invalid in numbered:
+        answer = invalid or next(answers)
+        output.write(json.dumps({"line": line_number, **answer}, default=str) + "\n")
+        output.flush()
+
+def serve(arguments):
+    """
+    Opens the tunnel and serves until stopped. SSH credentials come from the SSH_USERNAME and
+    SSH_PASSWORD environment variables, or are prompted for.
+    """
+    from connection_and_queries import Connection
+    from main import hash_password, parse_address
+    ssh_username = os.environ.get("SSH_USERNAME") or getpass("SSH Username: ")
+    ssh_password = os.environ.get("SSH_PASSWORD") or getpass("SSH Password: ")
+    session = Connection(ssh_username, ssh_password, replica_address=parse_address(arguments.replica))
+    try:
+        session.check_schema()
+    except Exception as e:
+        session.close()
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    session.enable_result_cache()
+    daemon = SessionDaemon(session, hash_password, pool_size=max(1, arguments.pool_size), admin=arguments.admin)
+    print(f"Serving on {arguments.socket}", file=sys.stderr)
+    daemon.serve(arguments.socket)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keeps a Books Platform tunnel, connections and caches "
+                                                 "open for short CLI runs.")
+    parser.add_argument("action", choices=("serve", "run", "status", "stop"),
+                        help="serve: start the daemon in the foreground; run: send JSONL batch commands "
+                             "from FILE (default stdin); status; stop")
+    parser.add_argument("file", nargs="?", default="-", help="with run, the JSONL batch file ('-' for stdin)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"the Unix socket (default: {DEFAULT_SOCKET})")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help=f"with serve, pooled database connections (default: {DEFAULT_POOL_SIZE})")
+    parser.add_argument("--replica", metavar="HOST:PORT",
+                        help="with serve, read replica address as seen from the SSH server")
+    parser.add_argument("--admin", action="store_true",
+                        help="with serve, allow admin commands and records that name a user without a password")
+    arguments = parser.parse_args(argv)
+
+    if arguments.action == "serve":
+        serve(arguments)
+        return
+    if not is_running(arguments.socket):
+        print(f"No session daemon is listening on {arguments.socket}; start one with "
+              f"'python session_daemon.py serve'.", file=sys.stderr)
+        sys.exit(1)
+    if arguments.action == "run":
+        source = sys.stdin if arguments.file == "-" else open(arguments.file)
+        try:
+            run_batch(source, sys.stdout, arguments.socket)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+    else:
+        for answer in send([{"control": arguments.action}], arguments.socket):
+            print(json.dumps(answer.get("result"), indent=2, default=str))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
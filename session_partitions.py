@@ -0,0 +1,228 @@
+import datetime
+
+# Denormalizes each session's book onto reading_session, so reading queries no longer need to join
+# "book+session". New sessions are written with both.
+BOOK_ID_COLUMN = """
+ALTER TABLE reading_session ADD COLUMN IF NOT EXISTS book_id INTEGER;
+UPDATE reading_session rs
+SET book_id = bs.book_id
+FROM "book+session" bs
+WHERE rs.session_id = bs.session_id AND rs.book_id IS NULL;
+"""
+
+# Monthly range-partitioned replacement for reading_session, created once the old table is out of the way
+PARTITIONED_TABLE = """
+CREATE TABLE reading_session (
+    session_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    book_id INTEGER,
+    start_time TIMESTAMP NOT NULL,
+    end_time TIMESTAMP,
+    pages_read INTEGER,
+    PRIMARY KEY (session_id, start_time)
+) PARTITION BY RANGE (start_time);
+CREATE TABLE reading_session_default PARTITION OF reading_session DEFAULT;
+CREATE INDEX reading_session_start_time_idx ON reading_session (start_time);
+CREATE INDEX reading_session_user_idx ON reading_session (user_id);
+"""
+
+COPY_SESSIONS = """
+INSERT INTO reading_session (session_id, user_id, book_id, start_time, end_time, pages_read)
+SELECT session_id, user_id, book_id, start_time, end_time, pages_read
+FROM reading_session_unpartitioned
+"""
+
+# Foreign keys and checks declared on reading_session, to be declared again on the partitioned table
+OWN_CONSTRAINTS = """
+SELECT quote_ident(conname), pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = 'reading_session'::regclass AND contype IN ('f', 'c')
+"""
+
+# Foreign keys in other tables that reference reading_session
+INCOMING_FOREIGN_KEYS = """
+SELECT conrelid::regclass::text, quote_ident(conname), pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE confrelid = 'reading_session'::regclass AND contype = 'f'
+"""
+
+TABLE_INDEXES = """
+SELECT c.relname
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = 'reading_session'::regclass
+"""
+
+OLD_TABLE = "reading_session_unpartitioned"
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+def next_month(day):
+    return datetime.date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def partition_name(month):
+    return f"reading_session_y{month.year:04d}m{month.month:02d}"
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = 'reading_session'")
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+def create_month_partitions(cursor, parent, first_month, last_month):
+    """
+    Creates one partition per month from first_month through last_month, skipping existing ones.
+    """
+    month = month_start(first_month)
+    while month <= last_month:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {parent} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            (month, next_month(month))
+        )
+        month = next_month(month)
+
+def _set_aside(cursor):
+    """
+    Renames reading_session and its indexes (which renames the primary key along with its index)
+    so the partitioned table can take over their names.
+
+    Returns:
+        list of tuples: (name, definition) of the foreign keys and checks declared on the table.
+    """
+    cursor.execute(OWN_CONSTRAINTS)
+    constraints = cursor.fetchall()
+    cursor.execute(INCOMING_FOREIGN_KEYS)
+    for table, name, definition in cursor.fetchall():
+        # A partitioned table cannot have a unique key on session_id alone, so nothing can reference it
+        print(f"Dropping foreign key {name} on {table} ({definition}), which cannot reference a partitioned table.")
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    cursor.execute(TABLE_INDEXES)
+    for (name,) in cursor.fetchall():
+        renamed = OLD_TABLE + name[len("reading_session"):] if name.startswith("reading_session") else f"{name}_old"
+        cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{renamed}"')
+    cursor.execute(f"ALTER TABLE reading_session RENAME TO {OLD_TABLE}")
+    return constraints
+
+def partition(cursor, months_ahead=3):
+    """
+    Converts reading_session into a table partitioned by month of start_time. The old table and its
+    indexes are renamed and kept as reading_session_unpartitioned until it is dropped by hand; its
+    foreign keys and checks are declared again on the new table. Foreign keys from other tables to
+    reading_session are dropped. Does nothing if reading_session is already partitioned.
+    Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+        months_ahead (int): How many future months to create partitions for.
+
+    Returns:
+        bool: True if the table was partitioned, False if it already was.
+    """
+    if is_partitioned(cursor):
+        return False
+    # Keep readers and writers out while the rows are copied and the tables are swapped
+    cursor.execute('LOCK TABLE reading_session IN ACCESS EXCLUSIVE MODE')
+    cursor.execute(BOOK_ID_COLUMN)
+    constraints = _set_aside(cursor)
+    cursor.execute(PARTITIONED_TABLE)
+    cursor.execute(f'SELECT MIN(start_time) FROM {OLD_TABLE}')
+    earliest = cursor.fetchone()[0]
+    today = datetime.date.today()
+    first = month_start(earliest.date()) if earliest else month_start(today)
+    last = month_start(today)
+    for _ in range(months_ahead):
+        last = next_month(last)
+    create_month_partitions(cursor, 'reading_session', first, last)
+    cursor.execute(COPY_SESSIONS)
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE reading_session ADD CONSTRAINT {name} {definition}")
+    return True
+
+def migrate(connection, months_ahead=3):
+    """
+    Partitions reading_session (see partition) in its own transaction.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        months_ahead (int): How many future months to create partitions for.
+
+    Returns:
+        bool: True if the table was migrated, False if it already was.
+    """
+    try:
+        with connection.cursor() as cursor:
+            migrated = partition(cursor, months_ahead=months_ahead)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return migrated
+
+def ensure_partitions(connection, months_ahead=3):
+    """
+    Creates the partitions for the current month and the next months_ahead months.
+    Meant to be run regularly (e.g. from the nightly batch) so sessions never land in the default partition.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        months_ahead (int): How many future months to create partitions for.
+    """
+    today = month_start(datetime.date.today())
+    last = today
+    for _ in range(months_ahead):
+        last = next_month(last)
+    with connection.cursor() as cursor:
+        create_month_partitions(cursor, 'reading_session', today, last)
+    connection.commit()
+
+def list_partitions(cursor):
+    """
+    Returns:
+        list of tuples: (partition name, first day of month) for every monthly partition, oldest first.
+    """
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON i.inhrelid = c.oid
+        JOIN pg_class p ON i.inhparent = p.oid
+        WHERE p.relname = 'reading_session'
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        if name.startswith("reading_session_y"):
+            partitions.append((name, datetime.date(int(name[17:21]), int(name[22:24]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def archive_partitions(connection, keep_months, archive_dir=None, drop=False):
+    """
+    Detaches the monthly partitions older than keep_months so queries no longer see them.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        keep_months (int): How many months (including the current one) stay attached.
+        archive_dir (str): If given, each detached partition is also exported to archive_dir/<name>.csv.
+        drop (bool): Whether to drop the detached tables afterwards (only allowed with archive_dir).
+
+    Returns:
+        list of str: The names of the partitions archived.
+    """
+    if drop and archive_dir is None:
+        raise ValueError("Refusing to drop partitions without exporting them first.")
+    cutoff = month_start(datetime.date.today())
+    for _ in range(keep_months - 1):
+        cutoff = month_start(cutoff - datetime.timedelta(days=1))
+    archived = []
+    with connection.cursor() as cursor:
+        for name, month in list_partitions(cursor):
+            if month >= cutoff:
+                break
+            cursor.execute(f"ALTER TABLE reading_session DETACH PARTITION {name}")
+            if archive_dir is not None:
+                with open(f"{archive_dir}/{name}.csv", "w") as archive:
+                    cursor.copy_expert(f"COPY {name} TO STDOUT WITH CSV HEADER", archive)
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+            connection.commit()
+            archived.append(name)
+    return archived
@@ -0,0 +1,191 @@
+import os
+from array import array
+from multiprocessing import Pool
+from psycopg2.extras import execute_values
+from follow_graph import FollowGraph, build_csr, user_key
+
+# Tables backing the "who to follow" suggestions
+SUGGESTION_TABLES = """
+CREATE TABLE IF NOT EXISTS follow_suggestion (
+    user_id INTEGER NOT NULL,
+    suggested_user_id INTEGER NOT NULL,
+    mutual_count INTEGER NOT NULL,
+    shared_books INTEGER NOT NULL,
+    computed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, suggested_user_id)
+);
+CREATE TABLE IF NOT EXISTS suggestion_dirty (
+    user_id INTEGER PRIMARY KEY
+);
+"""
+
+# Number of suggestions stored per user
+SUGGESTIONS_PER_USER = 20
+
+# Number of users written per transaction by the batch job
+BATCH_SIZE = 1000
+
+# Worker state, set once per process by _init_worker
+_graph = None
+_book_offsets = None
+_books = None
+
+def create_tables(cursor):
+    """
+    Creates the suggestion tables if they do not exist yet. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+    """
+    cursor.execute(SUGGESTION_TABLES)
+
+def load_user_books(connection, size, batch_size=100000):
+    """
+    Loads the distinct books each user has read as a CSR user -> book matrix.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        size (int): One more than the largest user ID.
+        batch_size (int): Number of rows fetched per round trip.
+
+    Returns:
+        tuple: (offsets, books) arrays with each user's books sorted ascending.
+    """
+    user_ids = array('i')
+    book_ids = array('i')
+    with connection.cursor(name='suggestion_books_load') as cursor:
+        cursor.itersize = batch_size
+        cursor.execute("""
+            SELECT DISTINCT rs.user_id, rs.book_id
+            FROM reading_session rs
+            WHERE rs.user_id < %s AND rs.book_id IS NOT NULL
+            ORDER BY rs.user_id, rs.book_id
+        """, (size,))
+        for user_id, book_id in cursor:
+            user_ids.append(user_id)
+            book_ids.append(book_id)
+    return build_csr(size, user_ids, book_ids)
+
+def _init_worker(graph, book_offsets, books):
+    global _graph, _book_offsets, _books
+    _graph = graph
+    _book_offsets = book_offsets
+    _books = books
+
+def _shared_books(user_a, user_b):
+    """
+    Counts the books two users have both read by merging their sorted book lists.
+    """
+    i, end_a = _book_offsets[user_a], _book_offsets[user_a + 1]
+    j, end_b = _book_offsets[user_b], _book_offsets[user_b + 1]
+    shared = 0
+    while i < end_a and j < end_b:
+        if _books[i] == _books[j]:
+            shared += 1
+            i += 1
+            j += 1
+        elif _books[i] < _books[j]:
+            i += 1
+        else:
+            j += 1
+    return shared
+
+def _suggest_for_users(user_ids):
+    """
+    Computes the suggestion rows for a chunk of users.
+
+    The mutual counts for a user are one row of A x A, where A is the follow adjacency matrix,
+    computed row by row over the CSR arrays with a sparse accumulator (Gustavson's algorithm).
+
+    Returns:
+        list of tuples: (user_id, suggested_user_id, mutual_count, shared_books) rows.
+    """
+    rows = []
+    for user_id in user_ids:
+        followees = set(_graph.followees(user_id))
+        mutual = {}
+        for followee in followees:
+            for candidate in _graph.followees(followee):
+                mutual[candidate] = mutual.get(candidate, 0) + 1
+        mutual.pop(user_id, None)
+        for followee in followees:
+            mutual.pop(followee, None)
+        if not mutual:
+            continue
+        # Only the best candidates by mutual count are worth the shared-books merge
+        best = sorted(mutual.items(), key=lambda item: (-item[1], item[0]))[:SUGGESTIONS_PER_USER * 5]
+        scored = [(candidate, count, _shared_books(user_id, candidate)) for candidate, count in best]
+        scored.sort(key=lambda item: (-item[1], -item[2], item[0]))
+        for candidate, count, shared in scored[:SUGGESTIONS_PER_USER]:
+            rows.append((user_id, candidate, count, shared))
+    return rows
+
+def _affected_users(graph, dirty_ids):
+    """
+    Expands the users whose follows changed to everyone whose two-hop neighborhood changed:
+    the users themselves and their followers.
+    """
+    affected = set(dirty_ids)
+    for user_id in dirty_ids:
+        affected.update(graph.followers(user_id))
+    return sorted(affected)
+
+def precompute_suggestions(connection, workers=None, full=False):
+    """
+    Recomputes "who to follow" suggestions and stores them in the follow_suggestion table.
+
+    By default only users whose two-hop neighborhood changed since the last run (tracked in
+    suggestion_dirty by follow and unfollow) are recomputed; full=True recomputes every user.
+    The work is split across a process pool, and results are written in batches.
+
+    Parameters:
+        connection: An open psycopg2 connection.
+        workers (int): Number of worker processes, defaults to the number of cores.
+        full (bool): Whether to recompute every user instead of only the changed ones.
+
+    Returns:
+        int: The number of users recomputed.
+    """
+    graph = FollowGraph.load(connection)
+    book_offsets, books = load_user_books(connection, graph.size)
+
+    cursor = connection.cursor()
+    dirty_ids = []
+    if full:
+        user_ids = list(range(1, graph.size))
+    else:
+        cursor.execute('SELECT user_id FROM suggestion_dirty')
+        dirty_ids = [row[0] for row in cursor.fetchall()]
+        user_ids = _affected_users(graph, dirty_ids)
+
+    chunks = [user_ids[i:i + BATCH_SIZE] for i in range(0, len(user_ids), BATCH_SIZE)]
+    with Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=(graph, book_offsets, books)) as pool:
+        for chunk, rows in zip(chunks, pool.imap(_suggest_for_users, chunks)):
+            cursor.execute('DELETE FROM follow_suggestion WHERE user_id = ANY(%s)', (chunk,))
+            execute_values(
+                cursor,
+                'INSERT INTO follow_suggestion (user_id, suggested_user_id, mutual_count, shared_books) VALUES %s',
+                rows
+            )
+            connection.commit()
+
+    if full:
+        cursor.execute('TRUNCATE suggestion_dirty')
+    else:
+        cursor.execute('DELETE FROM suggestion_dirty WHERE user_id = ANY(%s)', (dirty_ids,))
+    connection.commit()
+    cursor.close()
+    return len(user_ids)
+
+def mark_dirty(cursor, user_id):
+    """
+    Marks a user's suggestions as stale. Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A cursor on the caller's connection.
+        user_id (int): The user whose follows changed.
+    """
+    cursor.execute(
+        'INSERT INTO suggestion_dirty (user_id) VALUES (%s) ON CONFLICT DO NOTHING',
+        (user_key(user_id),)
+    )
@@ -0,0 +1,121 @@
+import time
+import heapq
+from bisect import bisect_left
+
+# How long a loaded index is trusted before complete() pulls in newly added books and contributors
+REFRESH_SECONDS = 60
+
+# Sorts after every character a title can contain, so (prefix + END) bounds all keys starting with prefix
+END = "\U0010ffff"
+
+BOOKS_QUERY = 'SELECT book_id, title FROM "book" WHERE book_id > %s'
+CONTRIBUTORS_QUERY = """
+SELECT contributor_id, TRIM(CONCAT_WS(' ', first_name, last_name))
+FROM contributor
+WHERE contributor_id > %s
+"""
+
+class PrefixIndex:
+    """
+    A sorted-array prefix index over book titles and contributor names.
+
+    Keys are case-folded names kept in one sorted list, with the original spelling and kind
+    ("title" or "contributor") in parallel lists. A completion is two binary searches for the
+    range of keys starting with the prefix, so lookups stay in the microseconds regardless of
+    catalog size. Rows are only ever added, tracked by the highest book and contributor IDs
+    loaded, so a refresh fetches just the new ones and merges them in.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.names = []
+        self.kinds = []
+        self.last_book_id = 0
+        self.last_contributor_id = 0
+        self.loaded_at = None
+
+    @classmethod
+    def load(cls, cursor):
+        """
+        Builds the index from the book and contributor tables.
+
+        Parameters:
+            cursor: A database cursor.
+
+        Returns:
+            PrefixIndex: The loaded index.
+        """
+        index = cls()
+        index.refresh(cursor)
+        return index
+
+    def refresh(self, cursor):
+        """
+        Adds the books and contributors created since the last load or refresh.
+
+        Parameters:
+            cursor: A database cursor.
+
+        Returns:
+            int: The number of names added.
+        """
+        cursor.execute(BOOKS_QUERY, (self.last_book_id,))
+        books = cursor.fetchall()
+        cursor.execute(CONTRIBUTORS_QUERY, (self.last_contributor_id,))
+        contributors = cursor.fetchall()
+        self.last_book_id = max([self.last_book_id] + [row[0] for row in books])
+        self.last_contributor_id = max([self.last_contributor_id] + [row[0] for row in contributors])
+        self.loaded_at = time.monotonic()
+
+        entries = {(name.casefold(), name, "title") for _, name in books if name}
+        entries.update((name.casefold(), name, "contributor") for _, name in contributors if name)
+        entries.difference_update(zip(self.keys, self.names, self.kinds))
+        if not entries:
+            return 0
+        merged = list(heapq.merge(zip(self.keys, self.names, self.kinds), sorted(entries)))
+        self.keys = [entry[0] for entry in merged]
+        self.names = [entry[1] for entry in merged]
+        self.kinds = [entry[2] for entry in merged]
+        return len(entries)
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > REFRESH_SECONDS
+
+    def complete(self, prefix, k=10, kind=None):
+        """
+        Finds the names starting with prefix, ignoring case.
+
+        Parameters:
+            prefix (str): What the user has typed so far.
+            k (int): The maximum number of completions.
+            kind (str): "title" or "contributor" to restrict the matches, None for both.
+
+        Returns:
+            list of str: Up to k matching names, in alphabetical order.
+        """
+        key = prefix.casefold()
+        start = bisect_left(self.keys, key)
+        end = bisect_left(self.keys, key + END, start)
+        matches = []
+        for position in range(start, end):
+            if kind is None or self.kinds[position] == kind:
+                matches.append(self.names[position])
+                if len(matches) == k:
+                    break
+        return matches
+
+    def contains(self, name, kind=None):
+        """
+        Returns:
+            bool: Whether name is in the index exactly as spelled.
+        """
+        key = name.casefold()
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position] == key:
+            if self.names[position] == name and (kind is None or self.kinds[position] == kind):
+                return True
+            position += 1
+        return False
+
+    def __len__(self):
+        return len(self.keys)
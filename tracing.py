@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextlib
+from psycopg2.extensions import cursor as base_cursor
+
+# Longest statement text kept in a span's arguments
+STATEMENT_CHARS = 500
+
+def _statement_text(query):
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    return " ".join(str(query).split())
+
+class Tracer:
+    """
+    Records spans in the Chrome trace event format, which chrome://tracing, Perfetto and speedscope open.
+
+    Method spans nest per thread. Each statement run through the tracer's cursors is a span of its own
+    (wall time around execute, rows affected or returned), and its time and rows are added to every
+    span open around it, so a method span shows how much of its wall time was spent waiting on the
+    database (db_ms) and how much in Python (python_ms). Statement time is measured from the client,
+    so it includes the SSH tunnel.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.threads = set()
+        self.factories = {}
+        self.instrumented = {}
+
+    def _now(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _emit(self, name, category, start, duration, args):
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.threads:
+                self.threads.add(thread.ident)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                                    "args": {"name": thread.name}})
+            self.events.append({"name": name, "cat": category, "ph": "X", "ts": round(start, 1),
+                                "dur": round(duration, 1), "pid": self.pid, "tid": thread.ident, "args": args})
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """
+        Records the enclosed block as one span.
+
+        Parameters:
+            name (str): The span name, e.g. "User.top20".
+            category (str): Groups spans in trace viewers and summary(), e.g. "User".
+            args: Extra values shown with the span.
+        """
+        stack = self._stack()
+        totals = {"statements": 0, "rows": 0, "db_us": 0.0}
+        stack.append(totals)
+        start = self._now()
+        try:
+            yield
+        finally:
+            duration = self._now() - start
+            stack.pop()
+            args.update(wall_ms=round(duration / 1000, 3), db_ms=round(totals["db_us"] / 1000, 3),
+                        python_ms=round((duration - totals["db_us"]) / 1000, 3),
+                        statements=totals["statements"], rows=totals["rows"])
+            self._emit(name, category, start, duration, args)
+
+    def statement(self, query, start, rows):
+        """
+        Records one statement that ran from start until now and charges it to the open spans.
+        """
+        duration = self._now() - start
+        text = _statement_text(query)
+        for totals in self._stack():
+            totals["statements"] += 1
+            totals["rows"] += rows
+            totals["db_us"] += duration
+        self._emit(text.split(" ", 1)[0].upper() or "SQL", "sql", start, duration,
+                   {"statement": text[:STATEMENT_CHARS], "rows": rows})
+
+    def cursor_factory(self, base=base_cursor):
+        """
+        Returns:
+            type: A subclass of base whose statements are recorded by this tracer.
+        """
+        if base not in self.factories:
+            tracer = self
+
+            class TracingCursor(base):
+                def execute(self, query, vars=None):
+                    start = tracer._now()
+                    try:
+                        return super().execute(query, vars)
+                    finally:
+                        tracer.statement(query, start, max(self.rowcount, 0))
+
+                def executemany(self, query, vars_list):
+                    start = tracer._now()
+                    try:
+                        return super().executemany(query, vars_list)
+                    finally:
+                        tracer.statement(query, start, max(self.rowcount, 0))
+
+            self.factories[base] = TracingCursor
+        return self.factories[base]
+
+    def instrument(self, instance, category, exclude=()):
+        """
+        Wraps every public method of instance in a span named Class.method, until uninstrument().
+
+        Parameters:
+            instance: The object to trace, e.g. a User or Connection.
+            category (str): The span category.
+            exclude (iterable of str): Public methods to leave unwrapped.
+        """
+        names = []
+        for name, function in inspect.getmembers(type(instance), inspect.isfunction):
+            if name.startswith("_") or name in exclude:
+                continue
+            setattr(instance, name, self._traced(getattr(instance, name), f"{type(instance).__name__}.{name}", category))
+            names.append(name)
+        self.instrumented[id(instance)] = names
+
+    def uninstrument(self, instance):
+        for name in self.instrumented.pop(id(instance), []):
+            instance.__dict__.pop(name, None)
+
+    def _traced(self, method, name, category):
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            with self.span(name, category):
+                return method(*args, **kwargs)
+        return traced
+
+    def summary(self, category):
+        """
+        Returns:
+            list of dicts: Per span name in category, the call count and total wall, database and
+                           Python milliseconds, slowest first.
+        """
+        rows = {}
+        with self.lock:
+            events = [event for event in self.events if event["ph"] == "X" and event["cat"] == category]
+        for event in events:
+            row = rows.setdefault(event["name"], {"name": event["name"], "calls": 0, "wall_ms": 0.0,
+                                                  "db_ms": 0.0, "python_ms": 0.0, "statements": 0})
+            row["calls"] += 1
+            for field in ("wall_ms", "db_ms", "python_ms", "statements"):
+                row[field] += event["args"][field]
+        return sorted(rows.values(), key=lambda row: -row["wall_ms"])
+
+    def dump(self, path):
+        """
+        Writes the recorded spans to path as a Chrome trace event file.
+        """
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as output:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, output, default=str)
@@ -0,0 +1,214 @@
+import math
+import time
+import heapq
+import datetime
+import threading
+from psycopg2.extras import execute_values
+
+# A book's trending score halves for every HALF_LIFE_DAYS without new activity
+HALF_LIFE_DAYS = 7
+DECAY_RATE = math.log(2) / (HALF_LIFE_DAYS * 86400)
+
+# Scores are stored with "forward decay": each event's weight is scaled up by how long after LANDMARK
+# it happened, instead of every stored score being scaled down as time passes. All scores share the
+# same decay factor at any moment, so their order never changes on its own and nothing needs rescoring.
+# With a 7-day half-life the scaled weights stay within float range for roughly 19 years after LANDMARK.
+LANDMARK = datetime.datetime(2024, 1, 1)
+
+# Event weights: a reading session counts 1, a rating counts its stars / 5
+READ_WEIGHT = 1.0
+STAR_WEIGHT = 0.2
+
+# Number of books kept in the serving heap
+TOP_K = 100
+
+# How often the accumulated score changes are added to trending_score
+PERSIST_SECONDS = 300
+
+TRENDING_TABLE = """
+CREATE TABLE IF NOT EXISTS trending_score (
+    book_id INTEGER PRIMARY KEY,
+    score DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+"""
+
+# Recomputes every score from the reading and rating history. Ratings made before rating.rated_at
+# existed (migration 15) have no timestamp and are left out. Every other rating counts, re-ratings
+# included, just as TrendingEngine.record counts each one.
+REBUILD = """
+INSERT INTO trending_score (book_id, score)
+SELECT book_id, SUM(weight * EXP(%(rate)s * EXTRACT(EPOCH FROM happened_at - %(landmark)s)))
+FROM (
+    SELECT rs.book_id, %(read_weight)s AS weight, rs.start_time AS happened_at
+    FROM reading_session rs
+    WHERE rs.book_id IS NOT NULL
+    UNION ALL
+    SELECT r.book_id, %(star_weight)s * r.stars, r.rated_at
+    FROM rating r
+    WHERE r.rated_at IS NOT NULL
+) events
+GROUP BY book_id
+"""
+
+def forward_weight(weight, when):
+    """
+    Returns:
+        float: weight scaled to the LANDMARK-relative units the scores are kept in.
+    """
+    return weight * math.exp(DECAY_RATE * (when - LANDMARK).total_seconds())
+
+class TrendingEngine:
+    """
+    Keeps an exponentially decayed activity score per book and a bounded top-K for serving.
+
+    Events update one book's score and, at most, swap one book in or out of the top-K heap, so
+    recording is O(log K) and serving is O(K log K) however many events there have been. Changes
+    are accumulated in pending and added to trending_score by save(), so several processes can
+    record events against the same table.
+    """
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.scores = {}
+        self.pending = {}
+        self.top = {}
+        self.heap = []
+        self.loaded = False
+        self.last_saved = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self, cursor):
+        """
+        Reads the persisted scores and combines them with the events recorded since this engine was created.
+
+        Parameters:
+            cursor: A database cursor.
+        """
+        cursor.execute('SELECT book_id, score FROM trending_score')
+        rows = cursor.fetchall()
+        with self.lock:
+            self.scores = dict(rows)
+            for book_id, delta in self.pending.items():
+                self.scores[book_id] = self.scores.get(book_id, 0.0) + delta
+            self.top = dict(heapq.nlargest(self.k, self.scores.items(), key=lambda item: item[1]))
+            self.heap = [(score, book_id) for book_id, score in self.top.items()]
+            heapq.heapify(self.heap)
+            self.loaded = True
+
+    def reset(self):
+        """
+        Forgets every score and unsaved change, once trending_score has been rebuilt from the history they
+        came from. The engine is shared by all of a session's connections, so it is cleared in place and
+        the next load() reads the rebuilt scores.
+        """
+        with self.lock:
+            self.scores = {}
+            self.pending = {}
+            self.top = {}
+            self.heap = []
+            self.loaded = False
+
+    def record(self, book_id, weight, when=None):
+        """
+        Adds an event to a book's score.
+
+        Parameters:
+            book_id (int): The book.
+            weight (float): The event's weight, e.g. READ_WEIGHT.
+            when (datetime): When it happened, defaults to now.
+        """
+        delta = forward_weight(weight, when or datetime.datetime.now())
+        with self.lock:
+            self.pending[book_id] = self.pending.get(book_id, 0.0) + delta
+            if not self.loaded:
+                return
+            score = self.scores.get(book_id, 0.0) + delta
+            self.scores[book_id] = score
+            self._offer(book_id, score)
+
+    def _offer(self, book_id, score):
+        """
+        Updates the top-K with a book whose score just grew. Scores only grow, so a book outside the
+        top-K can only enter it through its own event, and heap entries for a member that has grown
+        since are stale and skipped.
+        """
+        if book_id in self.top or len(self.top) < self.k:
+            self.top[book_id] = score
+            heapq.heappush(self.heap, (score, book_id))
+        else:
+            while self.heap[0][0] != self.top.get(self.heap[0][1]):
+                heapq.heappop(self.heap)
+            if score <= self.heap[0][0]:
+                return
+            del self.top[heapq.heappop(self.heap)[1]]
+            self.top[book_id] = score
+            heapq.heappush(self.heap, (score, book_id))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(score, book_id) for book_id, score in self.top.items()]
+            heapq.heapify(self.heap)
+
+    def top_books(self, n=20, now=None):
+        """
+        Returns:
+            list of tuples: (book_id, score) for the n highest-scoring books, with scores decayed to now.
+        """
+        decay = math.exp(-DECAY_RATE * ((now or datetime.datetime.now()) - LANDMARK).total_seconds())
+        with self.lock:
+            best = heapq.nlargest(n, self.top.items(), key=lambda item: item[1])
+        return [(book_id, score * decay) for book_id, score in best]
+
+    def is_due(self):
+        return bool(self.pending) and time.monotonic() - self.last_saved > PERSIST_SECONDS
+
+    def save(self, cursor):
+        """
+        Adds the changes recorded since the last save to trending_score. Runs in the caller's transaction;
+        if that transaction does not commit, hand the returned changes to restore().
+
+        Parameters:
+            cursor: A database cursor.
+
+        Returns:
+            dict: book_id -> score change, for every change written.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            execute_values(
+                cursor,
+                'INSERT INTO trending_score (book_id, score) VALUES %s '
+                'ON CONFLICT (book_id) DO UPDATE SET score = trending_score.score + EXCLUDED.score',
+                list(pending.items())
+            )
+        except Exception:
+            self.restore(pending)
+            raise
+        self.last_saved = time.monotonic()
+        return pending
+
+    def restore(self, changes):
+        """
+        Puts back changes taken by a save() that was rolled back, so the next save writes them.
+
+        Parameters:
+            changes (dict): What save() returned.
+        """
+        with self.lock:
+            for book_id, delta in changes.items():
+                self.pending[book_id] = self.pending.get(book_id, 0.0) + delta
+
+def rebuild(cursor):
+    """
+    Replaces trending_score with scores recomputed from the whole reading and rating history.
+    Runs in the caller's transaction.
+
+    Parameters:
+        cursor: A database cursor.
+
+    Returns:
+        int: The number of books scored.
+    """
+    cursor.execute('TRUNCATE trending_score')
+    cursor.execute(REBUILD, {"read_weight": READ_WEIGHT, "star_weight": STAR_WEIGHT,
+                             "rate": DECAY_RATE, "landmark": LANDMARK})
+    return cursor.rowcount
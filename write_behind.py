@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import queue
+import atexit
+import datetime
+import threading
+from psycopg2.extras import execute_values
+from follow_graph import user_key
+import reading_rollup
+import book_ratings
+import trending
+import reader_sketch
+import activity_feed
+
+class QueueFullError(Exception):
+    """
+    Raised when an event cannot be queued because the queue is full and blocking is disabled
+    (or the blocking wait timed out).
+    """
+
+class WriteBehindQueue:
+    """
+    Buffers reading sessions and ratings in a bounded in-process queue and writes them from a
+    background thread in batches, one commit per batch.
+
+    Durability options:
+      - flush on exit: close() (also registered with atexit) drains the queue before returning.
+      - spool file: every event is appended to a local file before enqueue() returns, and an ack line
+        naming the batch's first and last sequence numbers is appended after each committed batch.
+        Events no ack covers are replayed on the next start, so a crash loses nothing. Delivery is
+        at-least-once: a crash between a commit and its ack replays that batch.
+      - dead letters: a batch that still fails after every retry is appended to the dead-letter file
+        (by default the spool path plus ".dead") with its error and then acked, so one bad batch
+        neither blocks later acks nor is replayed forever.
+
+    When the queue is full, enqueue() blocks for up to put_timeout seconds (backpressure) or raises
+    QueueFullError right away if block is False.
+    """
+
+    def __init__(self, connect, max_size=10000, batch_size=500, flush_interval=1.0,
+                 spool_path=None, block=True, put_timeout=None, on_flush=None, trending_engine=None,
+                 dead_letter_path=None):
+        """
+        Parameters:
+            connect (callable): Returns a new psycopg2 connection for the background worker.
+            max_size (int): Maximum number of events waiting in memory.
+            batch_size (int): Maximum number of events written per commit.
+            flush_interval (float): Seconds the worker waits for more events before writing a partial batch.
+            spool_path (str): Optional path of the append-only spool file used for crash recovery.
+            block (bool): Whether enqueue() waits when the queue is full.
+            put_timeout (float): How long enqueue() waits when blocking, None to wait indefinitely.
+            on_flush (callable): Called with the names of the tables written after each committed batch.
+            trending_engine (TrendingEngine): Given the reads and ratings of each committed batch.
+            dead_letter_path (str): Where batches that keep failing are written, default spool_path + ".dead".
+        """
+        self.connect = connect
+        self.connection = connect()
+        self.events = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.put_timeout = put_timeout
+        self.on_flush = on_flush
+        self.trending_engine = trending_engine
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path or (spool_path + ".dead" if spool_path else None)
+        self.spool = None
+        self.spool_lock = threading.Lock()
+        self.enqueue_lock = threading.Lock()
+        self.sequence = 0
+        self.stopping = threading.Event()
+        self.flushed = 0
+        self.failed = 0
+
+        replay = self._recover() if spool_path else []
+        if spool_path:
+            self.spool = open(spool_path, "a")
+
+        self.worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+        for sequence, event in replay:
+            self.events.put((sequence, event))
+
+    def _recover(self):
+        """
+        Reads the spool file and returns the events no ack covers, in order.
+        """
+        if not os.path.exists(self.spool_path):
+            return []
+        pending = []
+        acked = []
+        with open(self.spool_path) as spool:
+            for line in spool:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # A torn final line from a crash mid-write
+                if "ack" in entry:
+                    # Older spools checkpoint with a single number that covers everything up to it
+                    ack = entry["ack"]
+                    acked.append((0, ack) if isinstance(ack, int) else tuple(ack))
+                else:
+                    pending.append((entry["seq"], entry["event"]))
+                    self.sequence = max(self.sequence, entry["seq"])
+        replay = [(sequence, event) for sequence, event in pending
+                  if not any(first <= sequence <= last for first, last in acked)]
+        # Rewrite the spool with only the outstanding events so it does not grow forever
+        with open(self.spool_path, "w") as spool:
+            for sequence, event in replay:
+                spool.write(json.dumps({"seq": sequence, "event": event}) + "\n")
+        return replay
+
+    def _spool_write(self, entry):
+        with self.spool_lock:
+            self.spool.write(json.dumps(entry) + "\n")
+            self.spool.flush()
+            os.fsync(self.spool.fileno())
+
+    def enqueue(self, event):
+        """
+        Adds an event to the queue.
+
+        Parameters:
+            event (dict): A "read" or "rate" event, see read_book() and rate_a_book().
+
+        Raises:
+            QueueFullError: If the queue is full and blocking is disabled or timed out.
+        """
+        if self.stopping.is_set():
+            raise QueueFullError("The write-behind queue is closed.")
+        # Sequence numbers must reach the queue in order, since a checkpoint covers every lower number
+        with self.enqueue_lock:
+            if self.events.full() and not self.block:
+                raise QueueFullError("The write-behind queue is full.")
+            try:
+                self.events.put((self.sequence + 1, event), block=self.block, timeout=self.put_timeout)
+            except queue.Full:
+                raise QueueFullError("The write-behind queue is full.")
+            self.sequence += 1
+            # Spooled before returning, so an event the caller was told about survives a crash
+            if self.spool is not None:
+                self._spool_write({"seq": self.sequence, "event": event})
+
+    def read_book(self, user_id, book_name, start_time, end_time, start_page, end_page):
+        """
+        Queues a reading session. Same parameters as Connection.read_book.
+        """
+        self.enqueue({
+            "type": "read", "user_id": user_key(user_id), "title": book_name,
+            "start_time": start_time.isoformat(), "end_time": end_time.isoformat(),
+            "pages_read": end_page - start_page,
+        })
+
+    def rate_a_book(self, user_id, book_name, rating):
+        """
+        Queues a rating. Same parameters as Connection.rate_a_book.
+        """
+        self.enqueue({"type": "rate", "user_id": user_key(user_id), "title": book_name, "stars": int(rating),
+                      "rated_at": datetime.datetime.now().isoformat()})
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.events.empty()):
+            try:
+                batch = [self.events.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush_with_retry(batch)
+
+    def _ack(self, batch):
+        # Batches are taken from the queue in sequence order, so a batch is one range of sequence numbers
+        if self.spool is not None:
+            self._spool_write({"ack": [batch[0][0], batch[-1][0]]})
+
+    def _dead_letter(self, batch, error):
+        """
+        Sets aside a batch that could not be written, so it can be inspected and replayed by hand.
+        """
+        self.failed += len(batch)
+        if self.dead_letter_path is None:
+            print(f"Dropped {len(batch)} queued events that could not be written: {error}")
+            return
+        with open(self.dead_letter_path, "a") as dead_letters:
+            for sequence, event in batch:
+                dead_letters.write(json.dumps({"seq": sequence, "event": event, "error": str(error)}) + "\n")
+            dead_letters.flush()
+            os.fsync(dead_letters.fileno())
+        print(f"Moved {len(batch)} queued events that could not be written to {self.dead_letter_path}")
+
+    def _flush_with_retry(self, batch, attempts=5):
+        delay = 0.5
+        error = None
+        for attempt in range(attempts):
+            try:
+                tables = self._flush(batch)
+                self.flushed += len(batch)
+                if self.on_flush is not None:
+                    self.on_flush(tables)
+                self._ack(batch)
+                return
+            except Exception as e:
+                error = e
+                print(f"An error occurred while writing queued events (attempt {attempt + 1}): {e}")
+                try:
+                    if self.connection.closed:
+                        self.connection = self.connect()
+                    else:
+                        self.connection.rollback()
+                except Exception as e:
+                    print(f"Could not reconnect the write-behind worker: {e}")
+                time.sleep(delay)
+                delay *= 2
+        self._dead_letter(batch, error)
+        self._ack(batch)
+
+    def _flush(self, batch):
+        """
+        Writes one batch of events in a single transaction.
+
+        Returns:
+            set of str: The tables written.
+        """
+        tables = set()
+        events = [event for sequence, event in batch]
+        with self.connection.cursor() as cursor:
+            # Resolve every title in the batch at once
+            titles = list({event["title"] for event in events})
+            cursor.execute('SELECT title, book_id FROM "book" WHERE title = ANY(%s)', (titles,))
+            book_ids = dict(cursor.fetchall())
+            for event in events:
+                if event["title"] not in book_ids:
+                    print(f"Error: Book '{event['title']}' not found in the database.")
+
+            # Events spooled before ratings were timestamped count as made now
+            ratings = [(book_ids[e["title"]], e["user_id"], e["stars"],
+                        datetime.datetime.fromisoformat(e["rated_at"]) if "rated_at" in e else datetime.datetime.now())
+                       for e in events if e["type"] == "rate" and e["title"] in book_ids]
+            if ratings:
+                book_ratings.record_ratings(cursor, ratings)
+                tables.update(("rating", "book"))
+            activities = [(user_id, "rate", book_id, stars, rated_at) for book_id, user_id, stars, rated_at in ratings]
+
+            reads = [e for e in events if e["type"] == "read" and e["title"] in book_ids]
+            if reads:
+                # Allocate a block of session ids; the table lock keeps concurrent writers from taking the same ones
+                cursor.execute('LOCK TABLE reading_session IN SHARE ROW EXCLUSIVE MODE')
+                cursor.execute('SELECT COALESCE(MAX(session_id), 0) FROM reading_session')
+                first_id = cursor.fetchone()[0] + 1
+                sessions = []
+                links = []
+                for session_id, event in enumerate(reads, start=first_id):
+                    sessions.append((session_id, event["user_id"], book_ids[event["title"]],
+                                     datetime.datetime.fromisoformat(event["start_time"]),
+                                     datetime.datetime.fromisoformat(event["end_time"]),
+                                     event["pages_read"]))
+                    links.append((book_ids[event["title"]], session_id))
+                execute_values(cursor, 'INSERT INTO reading_session (session_id, user_id, book_id, start_time, end_time, pages_read) VALUES %s', sessions)
+                execute_values(cursor, 'INSERT INTO "book+session" (book_id, session_id) VALUES %s', links)
+                reading_rollup.record_sessions(cursor, [(user_id, book_id, start_time, end_time, pages_read)
+                                                        for session_id, user_id, book_id, start_time, end_time, pages_read
+                                                        in sessions])
+                reader_sketch.record_readers(cursor, [(book_id, start_time.date(), user_id)
+                                                      for session_id, user_id, book_id, start_time, end_time, pages_read
+                                                      in sessions])
+                activities += [(user_id, "read", book_id, pages_read, start_time)
+                               for session_id, user_id, book_id, start_time, end_time, pages_read in sessions]
+                tables.update(("reading_session", "book+session", "reading_daily", "book_reader_sketch"))
+            if activities:
+                activity_feed.record_activity(cursor, activities)
+                tables.update(("activity", "feed_item"))
+        self.connection.commit()
+        if self.trending_engine is not None:
+            for book_id, user_id, stars, rated_at in ratings:
+                self.trending_engine.record(book_id, trending.STAR_WEIGHT * stars, rated_at)
+            for event in reads:
+                self.trending_engine.record(book_ids[event["title"]], trending.READ_WEIGHT,
+                                            datetime.datetime.fromisoformat(event["start_time"]))
+        return tables
+
+    def close(self):
+        """
+        Flushes every queued event, stops the worker and closes the spool file and connection.
+        Safe to call more than once.
+        """
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.worker.join()
+        if self.spool is not None:
+            # Every batch was committed or dead-lettered, so nothing is left to replay
+            self.spool.truncate(0)
+            self.spool.close()
+        self.connection.close()